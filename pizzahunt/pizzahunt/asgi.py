@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pizzahunt.settings')
+os.environ.setdefault('PIZZAHUNT_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Фоновая очистка корзин и сессий (CART_GC_INTERVAL) - только в процессах,
+# которые обслуживают запросы, а не в migrate, shell и других командах
+from pizzeria.cleanup import start_periodic  # noqa: E402
+
+start_periodic()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,8 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pizzeria.instrumentation.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'pizzeria.cart_storage.CartStorageMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -54,7 +57,9 @@ ROOT_URLCONF = 'pizzahunt.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендера для /myadmin/perf/
+        'BACKEND': 'pizzeria.instrumentation.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -82,6 +87,115 @@ DATABASES = {
     }
 }
 
+# Боевой профиль SQLite (PIZZAHUNT_DB_PROFILE=production). PRAGMA выполняются
+# при открытии каждого соединения: WAL пускает чтение параллельно с записью,
+# synchronous=NORMAL в WAL не теряет целостность при сбое процесса,
+# busy_timeout ждёт блокировку вместо ошибки "database is locked".
+# Транзакции начинаются с BEGIN IMMEDIATE: блокировка на запись берётся сразу,
+# а не при первой записи, когда ждать её уже нельзя.
+# Под ASGI постоянные соединения отключены, как советует документация Django
+# (async-представления работают с БД из разных потоков).
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -20000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRODUCTION = {
+    'CONN_MAX_AGE': 0 if os.environ.get('PIZZAHUNT_ASYNC_VIEWS') == '1' else 600,
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+if os.environ.get('PIZZAHUNT_DB_PROFILE') == 'production':
+    DATABASES['default'].update(SQLITE_PRODUCTION)
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Общий для всех рабочих процессов кеш (версия каталога меню и т.п.)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+    # Общий кеш для ключей отдельных посетителей (ревизии корзин для условных GET).
+    # Их много, а при переполнении кеш удаляет треть записей наугад, поэтому
+    # они живут отдельно от версий в 'shared'
+    'clients': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'clients',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Корзины гостей при CART_STORAGE='cache': единственная копия, поэтому кеш
+    # без вытеснения; сверх MAX_ENTRIES новые корзины не создаются
+    'carts': {
+        'BACKEND': 'pizzeria.cache_backends.PersistentFileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'carts',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Каталог меню хранится в памяти процесса; общая версия проверяется
+# не чаще чем раз в указанное число секунд
+CATALOG_CACHE_ALIAS = 'shared'
+CLIENT_CACHE_ALIAS = 'clients'
+CATALOG_VERSION_CHECK_INTERVAL = 1.0
+
+# Как часто поток живой статистики админ-панели проверяет, были ли новые заказы
+LIVE_STATS_POLL_INTERVAL = 2.0
+
+# Нативные async-представления корзины. Включаются в asgi.py, чтобы под
+# WSGI (runserver, gunicorn) корзина оставалась синхронной
+ASYNC_VIEWS = os.environ.get('PIZZAHUNT_ASYNC_VIEWS') == '1'
+
+# Где хранится корзина анонимного посетителя: 'database' (Cart/CartItem и сессия
+# в БД), 'cache' (кеш CART_CACHE_ALIAS, в cookie только ключ) или 'cookie'
+# (подписанная cookie). Из кеша и cookie корзина переносится в БД при входе
+# и при оформлении заказа
+CART_STORAGE = os.environ.get('PIZZAHUNT_CART_STORAGE', 'database')
+CART_CACHE_ALIAS = 'carts'
+CART_COOKIE_NAME = 'pizzahunt_cart'
+
+# Очистка брошенных анонимных корзин и истёкших сессий (команда cleanup_carts).
+# CART_GC_INTERVAL - период фонового запуска в секундах в процессах, запущенных через
+# wsgi.py/asgi.py (включая runserver); None - только командой
+CART_TTL_DAYS = 30
+CART_GC_BATCH_SIZE = 500
+CART_GC_PAUSE = 0.05
+CART_GC_INTERVAL = None
+
+# Замеры запросов: заголовок Server-Timing и окна последних замеров
+# по каждому маршруту для страницы /myadmin/perf/. Заголовок раскрывает
+# время БД и число запросов, поэтому всем посетителям он отдаётся только при DEBUG
+SERVER_TIMING_HEADER = DEBUG
+PERF_WINDOW_SIZE = 1000
+
+# Уменьшенные копии загруженных изображений (комбо, акции, аватары)
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1024)
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'jpeg')
+IMAGE_WORKERS = 2
+
+# Потоковая выгрузка заказов (/myadmin/orders/export/, действия OrderAdmin):
+# сколько заказов читается и отдаётся клиенту за один раз
+ORDER_EXPORT_CHUNK_SIZE = 1000
+
+# Очередь кухни (/myadmin/kitchen/): через сколько минут обещан новый заказ,
+# сколько одинаковых пицц печь берёт за раз, шаг слотов очереди в секундах
+# и как часто экран кухни сверяется с БД, даже если заказы не менялись
+KITCHEN_PROMISE_MINUTES = 45
+KITCHEN_OVEN_CAPACITY = 6
+KITCHEN_SLOT_SECONDS = 60
+KITCHEN_RESYNC_INTERVAL = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -123,6 +237,13 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# collectstatic пишет файлы с хешем содержимого в имени и сжатые копии
+# .gz/.br; без DEBUG их отдаёт pizzeria.staticfiles.serve_static
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'pizzeria.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
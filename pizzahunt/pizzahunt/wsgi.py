@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pizzahunt.settings')
 
 application = get_wsgi_application()
+
+# Фоновая очистка корзин и сессий (CART_GC_INTERVAL) - только в процессах,
+# которые обслуживают запросы, а не в migrate, shell и других командах
+from pizzeria.cleanup import start_periodic  # noqa: E402
+
+start_periodic()
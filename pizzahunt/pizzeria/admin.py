@@ -1,5 +1,7 @@
 from django.contrib import admin
 from .models import *
+from .exports import export_response
+from .rollups import update_order_status
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -29,23 +31,32 @@ class CartItemAdmin(admin.ModelAdmin):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'phone', 'total_price', 'status', 'payment_method', 'payment_status', 'created_at')
+    list_display = ('id', 'name', 'phone', 'total_price', 'status', 'payment_method', 'payment_status', 'promised_at', 'created_at')
     list_filter = ('status', 'payment_method', 'payment_status', 'created_at')
     search_fields = ('name', 'phone', 'email', 'address')
+    raw_id_fields = ('user', 'cart')
     readonly_fields = ('created_at', 'updated_at')
-    actions = ['mark_as_confirmed', 'mark_as_completed', 'mark_as_cancelled']
+    actions = ['mark_as_confirmed', 'mark_as_completed', 'mark_as_cancelled', 'export_csv', 'export_jsonl']
     
     def mark_as_confirmed(self, request, queryset):
-        queryset.update(status='confirmed')
+        update_order_status(queryset, 'confirmed')
     mark_as_confirmed.short_description = "Подтвердить выбранные заказы"
     
     def mark_as_completed(self, request, queryset):
-        queryset.update(status='completed')
+        update_order_status(queryset, 'completed')
     mark_as_completed.short_description = "Отметить как завершенные"
     
     def mark_as_cancelled(self, request, queryset):
-        queryset.update(status='cancelled')
+        update_order_status(queryset, 'cancelled')
     mark_as_cancelled.short_description = "Отменить выбранные заказы"
+    
+    def export_csv(self, request, queryset):
+        return export_response(queryset, 'csv')
+    export_csv.short_description = "Выгрузить в CSV"
+    
+    def export_jsonl(self, request, queryset):
+        return export_response(queryset, 'jsonl')
+    export_jsonl.short_description = "Выгрузить в JSON Lines"
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
@@ -61,11 +72,33 @@ class ComboAdmin(admin.ModelAdmin):
 
 @admin.register(Promotion)
 class PromotionAdmin(admin.ModelAdmin):
-    list_display = ('title', 'end_date', 'is_active')
-    list_filter = ('is_active',)
+    list_display = ('title', 'kind', 'value', 'end_date', 'is_active')
+    list_filter = ('is_active', 'kind')
+    fieldsets = (
+        (None, {'fields': ('title', 'description', 'image', 'end_date', 'is_active')}),
+        ('Скидка', {
+            'fields': ('kind', 'value', ('buy_quantity', 'pay_quantity'), 'min_subtotal'),
+            'description': 'Акции не суммируются: на товар действует самая выгодная скидка, '
+                           'на заказ - самая выгодная из скидок на заказ.',
+        }),
+        ('На какие товары', {'fields': ('target', 'category', 'pizza', 'size', 'combo')}),
+    )
 
 @admin.register(Feedback)
 class FeedbackAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'subject', 'created_at', 'is_processed')
     list_filter = ('subject', 'is_processed', 'created_at')
     search_fields = ('name', 'email', 'message')
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    list_display = ('granularity', 'period_start', 'status', 'payment_method', 'orders_count', 'revenue')
+    list_filter = ('granularity', 'status', 'payment_method')
+    date_hierarchy = 'period_start'
+
+@admin.register(ItemSalesRollup)
+class ItemSalesRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'item_name', 'size', 'quantity', 'revenue')
+    list_filter = ('item_type', 'size')
+    search_fields = ('item_name',)
+    date_hierarchy = 'day'
@@ -2,4 +2,10 @@ from django.apps import AppConfig
 
 class PizzeriaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'pizzeria'
\ No newline at end of file
+    name = 'pizzeria'
+
+    def ready(self):
+        # Подключает сигналы, обновляющие снимок каталога, поисковый индекс,
+        # сводки продаж, живую статистику и копии изображений. Порядок важен:
+        # индекс принимает версию каталога после её смены
+        from . import catalog, search, rollups, live, images
@@ -0,0 +1,48 @@
+"""Бэкенды кеша проекта (подключаются в CACHES)."""
+import os
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class CacheFull(Exception):
+    """В кеше без вытеснения нет места для нового ключа"""
+
+
+class PersistentFileBasedCache(FileBasedCache):
+    """Файловый кеш, который не вытесняет записи.
+
+    FileBasedCache при переполнении удаляет треть файлов наугад. Для данных
+    без другой копии (корзины гостей, см. cart_storage) это молчаливая
+    потеря, поэтому здесь записи пропадают только по истечении срока.
+    Новый ключ сверх MAX_ENTRIES не записывается: сначала удаляются
+    истёкшие записи, и если места всё равно нет - CacheFull. Перезапись
+    существующего ключа разрешена всегда.
+    """
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not os.path.exists(self._key_to_file(key, version)) and self._is_full():
+            raise CacheFull(f'В кеше уже {self._max_entries} записей')
+        super().set(key, value, timeout, version)
+
+    def _cull(self):
+        # Вызывается FileBasedCache.set() перед каждой записью; место
+        # освобождает только purge_expired()
+        pass
+
+    def _is_full(self):
+        if len(self._list_cache_files()) < self._max_entries:
+            return False
+        self.purge_expired()
+        return len(self._list_cache_files()) >= self._max_entries
+
+    def purge_expired(self):
+        """Удалить истёкшие записи; возвращает их число"""
+        removed = 0
+        for fname in self._list_cache_files():
+            try:
+                with open(fname, 'rb') as f:
+                    removed += self._is_expired(f)
+            except FileNotFoundError:
+                pass
+        return removed
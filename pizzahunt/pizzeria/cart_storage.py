@@ -0,0 +1,327 @@
+"""Хранение корзин анонимных посетителей вне БД.
+
+Настройка CART_STORAGE выбирает, где живёт корзина посетителя без входа:
+
+- 'database' - строки Cart/CartItem, привязанные к сессии в БД (как раньше);
+- 'cache' - кеш CART_CACHE_ALIAS, в cookie лежит только случайный ключ;
+- 'cookie' - сами строки в подписанной cookie, без обращений к БД и кешу.
+
+Корзина пользователя, вошедшего в систему, всегда хранится в БД. Корзина
+из кеша или cookie переносится туда при входе и при оформлении заказа
+(utils.promote_stored_cart и utils.checkout_cart), после чего хранилище
+очищается.
+
+Корзины гостей в кеше - единственная копия данных, поэтому CART_CACHE_ALIAS
+должен указывать на кеш без вытеснения (cache_backends.PersistentFileBasedCache):
+при его переполнении новая корзина не создаётся, а посетитель видит ошибку,
+вместо того чтобы кеш молча удалил чужие корзины.
+
+Хранимая корзина - список строк [id, тип, id товара, размер, количество]
+и счётчик id новых строк. Id строки живёт только внутри корзины и
+подставляется в несохранённые CartItem, поэтому шаблоны, итоги и
+pricing.quote() работают с ней так же, как с корзиной из БД. Цены
+берутся из снимка каталога; строки с удалёнными товарами отбрасываются.
+"""
+import json
+import secrets
+from abc import ABC, abstractmethod
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import conditional
+from .cache_backends import CacheFull
+from .catalog import get_catalog
+from .models import Cart, CartItem, CartSummary
+
+COOKIE_SALT = 'pizzeria.cart'
+CACHE_PREFIX = 'pizzeria:cart:'
+# Подписанная cookie должна укладываться в 4 КБ
+MAX_LINES = 50
+
+
+class CartStoreError(Exception):
+    """Операция над хранимой корзиной отклонена"""
+
+
+def empty():
+    return {'lines': [], 'next': 1}
+
+
+def _valid(data):
+    if not isinstance(data, dict) or not isinstance(data.get('lines'), list) or not isinstance(data.get('next'), int):
+        return False
+    return all(
+        isinstance(line, list) and len(line) == 5 and line[1] in ('pizza', 'combo')
+        and all(isinstance(line[i], int) for i in (0, 2, 4)) and isinstance(line[3], str)
+        for line in data['lines']
+    )
+
+
+def _ttl():
+    return getattr(settings, 'CART_TTL_DAYS', 30) * 24 * 60 * 60
+
+
+def _cookie_name():
+    return getattr(settings, 'CART_COOKIE_NAME', 'pizzahunt_cart')
+
+
+def _set_cookie(response, value, signed=False):
+    kwargs = {
+        'max_age': _ttl(),
+        'httponly': True,
+        'samesite': 'Lax',
+        'secure': settings.SESSION_COOKIE_SECURE,
+    }
+    if signed:
+        response.set_signed_cookie(_cookie_name(), value, salt=COOKIE_SALT, **kwargs)
+    else:
+        response.set_cookie(_cookie_name(), value, **kwargs)
+
+
+class CartStore(ABC):
+    """Общая часть хранилищ: состояние корзины запоминается на запросе"""
+
+    def load(self, request):
+        data = getattr(request, '_stored_cart', None)
+        if data is None:
+            data = self.read(request)
+            if not _valid(data):
+                data = empty()
+            request._stored_cart = data
+        return data
+
+    def save(self, request, data):
+        """Сохранить корзину; CartStoreError, если хранилище её не приняло"""
+        self.write(request, data)
+        request._stored_cart = data
+        request._stored_cart_dirty = True
+
+    @abstractmethod
+    def read(self, request):
+        """Данные корзины из запроса или None"""
+
+    def write(self, request, data):
+        pass
+
+    def process_response(self, request, response):
+        pass
+
+    @abstractmethod
+    def etag_part(self, request):
+        """Часть ETag страниц каталога: меняется при каждом изменении корзины"""
+
+
+class CookieCartStore(CartStore):
+    def read(self, request):
+        raw = request.get_signed_cookie(_cookie_name(), default=None, salt=COOKIE_SALT, max_age=_ttl())
+        try:
+            return json.loads(raw) if raw else None
+        except ValueError:
+            return None
+
+    def process_response(self, request, response):
+        if not getattr(request, '_stored_cart_dirty', False):
+            return
+        data = request._stored_cart
+        if data['lines']:
+            _set_cookie(response, json.dumps(data, separators=(',', ':')), signed=True)
+        else:
+            response.delete_cookie(_cookie_name(), samesite='Lax')
+
+    def etag_part(self, request):
+        return request.COOKIES.get(_cookie_name(), '')
+
+
+class CacheCartStore(CartStore):
+    def cache(self):
+        return caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+
+    def token(self, request):
+        token = getattr(request, '_cart_token', None)
+        if token is None:
+            token = request.COOKIES.get(_cookie_name(), '')
+            if len(token) != 32 or not token.isalnum():
+                token = ''
+            request._cart_token = token
+        return token
+
+    def read(self, request):
+        token = self.token(request)
+        return self.cache().get(CACHE_PREFIX + token) if token else None
+
+    def write(self, request, data):
+        token = self.token(request)
+        if not data['lines']:
+            if token:
+                self.cache().delete(CACHE_PREFIX + token)
+            return
+        new_token = not token
+        if new_token:
+            token = secrets.token_hex(16)
+        try:
+            self.cache().set(CACHE_PREFIX + token, data, _ttl())
+        except CacheFull:
+            raise CartStoreError("Корзина временно недоступна: войдите в аккаунт или попробуйте позже")
+        if new_token:
+            request._cart_token = token
+            request._cart_token_new = True
+
+    def process_response(self, request, response):
+        if getattr(request, '_cart_token_new', False):
+            _set_cookie(response, request._cart_token)
+
+    def etag_part(self, request):
+        token = self.token(request)
+        if not token:
+            return ''
+        return token + json.dumps(self.load(request)['lines'], separators=(',', ':'))
+
+
+STORES = {
+    'cookie': CookieCartStore(),
+    'cache': CacheCartStore(),
+}
+
+
+def get_store(user=None):
+    """Хранилище корзины анонимного посетителя или None, если корзины в БД"""
+    if user is not None and user.is_authenticated:
+        return None
+    return STORES.get(getattr(settings, 'CART_STORAGE', 'database'))
+
+
+def etag_part(request):
+    store = get_store()
+    return store.etag_part(request) if store else ''
+
+
+# Операции над хранимой корзиной
+
+def _product(catalog, item_type, item_id):
+    if item_type == 'pizza':
+        return catalog.get_pizza(item_id)
+    return catalog.get_combo(item_id)
+
+
+def _key(item_type, product_id, size):
+    # У комбо размер не используется, в CartItem он остаётся по умолчанию
+    return item_type, product_id, size if item_type == 'pizza' else '30'
+
+
+def build_cart(data):
+    """Несохранённая Cart с посчитанными итогами для хранимой корзины"""
+    catalog = get_catalog()
+    items = []
+    for line_id, item_type, product_id, size, quantity in data['lines']:
+        product = _product(catalog, item_type, product_id)
+        if product is None:
+            continue
+        item = CartItem(id=line_id, item_type=item_type, size=size, quantity=quantity)
+        setattr(item, f'{item_type}_id', product_id)
+        item.line_unit_price = product.get_price_by_size(size) if item_type == 'pizza' else product.price
+        item.line_total_price = item.line_unit_price * quantity
+        items.append(item)
+    cart = Cart()
+    cart._summary = CartSummary(items)
+    return cart
+
+
+def apply(data, operations):
+    """Применить операции ('add', тип, id, размер, количество), ('update', id строки,
+    количество), ('remove', id строки) к копии корзины; ошибка отменяет все"""
+    catalog = get_catalog()
+    lines = [list(line) for line in data['lines']]
+    next_id = data['next']
+    name = None
+    for operation in operations:
+        if operation[0] == 'add':
+            _, item_type, item_id, size, quantity = operation
+            product = _product(catalog, item_type, item_id)
+            if product is None:
+                raise CartStoreError("Товар не найден")
+            size = _key(item_type, item_id, size)[2]
+            name = product.name
+            for line in lines:
+                if line[1:4] == [item_type, item_id, size]:
+                    line[4] += quantity
+                    break
+            else:
+                if len(lines) >= MAX_LINES:
+                    raise CartStoreError(f"В корзине может быть не больше {MAX_LINES} разных товаров")
+                lines.append([next_id, item_type, item_id, size, quantity])
+                next_id += 1
+        else:
+            line = next((line for line in lines if line[0] == operation[1]), None)
+            if line is None:
+                raise CartStoreError("Элемент корзины не найден")
+            if operation[0] == 'update':
+                line[4] = operation[2]
+            else:
+                lines.remove(line)
+    return {'lines': lines, 'next': next_id}, name
+
+
+def promote(data, cart, replace=False):
+    """Записать строки хранимой корзины в корзину из БД.
+
+    Совпадающие строки складываются; при replace=True прежние строки
+    корзины удаляются, поэтому повторный перенос той же корзины (повтор
+    оформления заказа) не удваивает количества.
+    """
+    catalog = get_catalog()
+    with transaction.atomic():
+        existing = {}
+        if replace:
+            CartItem.objects.filter(cart=cart).delete()
+        else:
+            for line in CartItem.objects.filter(cart=cart):
+                existing[_key(line.item_type, line.pizza_id or line.combo_id, line.size)] = line
+        changed, created = [], []
+        for _, item_type, product_id, size, quantity in data['lines']:
+            if _product(catalog, item_type, product_id) is None:
+                continue
+            line = existing.get(_key(item_type, product_id, size))
+            if line is not None:
+                line.quantity += quantity
+                changed.append(line)
+            else:
+                line = CartItem(cart=cart, item_type=item_type, size=size, quantity=quantity)
+                setattr(line, f'{item_type}_id', product_id)
+                created.append(line)
+        if changed:
+            CartItem.objects.bulk_update(changed, ['quantity'])
+        if created:
+            CartItem.objects.bulk_create(created)
+        conditional.touch_cart(cart)
+    cart.invalidate_summary()
+    return cart
+
+
+class CartStorageMiddleware:
+    """Записывает изменённую хранимую корзину в cookie ответа"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self._finish(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._finish(request, await self.get_response(request))
+
+    def _finish(self, request, response):
+        store = STORES.get(getattr(settings, 'CART_STORAGE', 'database'))
+        if store is not None:
+            store.process_response(request, response)
+        return response
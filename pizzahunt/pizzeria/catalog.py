@@ -0,0 +1,279 @@
+"""Снимок каталога меню в памяти процесса.
+
+Пиццы, категории, комбо и акции меняются несколько раз в день, а читаются
+на каждой странице. Снимок строится один раз на процесс и хранится в виде
+неизменяемых кортежей. При изменении моделей сигналы сбрасывают локальный
+снимок и после коммита меняют общую версию в кеше, по которой остальные
+процессы узнают, что свой снимок пора перестроить. До конца транзакции,
+изменившей каталог, снимок строится на каждый запрос и не запоминается:
+иначе после отката процесс продолжал бы отдавать незакоммиченные данные
+под прежней версией.
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .models import Category, Pizza, Combo, Promotion
+
+VERSION_KEY = 'pizzeria:catalog:version'
+CHANGED_KEY = 'pizzeria:catalog:changed'
+
+
+class CategoryEntry(NamedTuple):
+    id: int
+    name: str
+    slug: str
+    description: str
+    order: int
+
+
+class PizzaEntry(NamedTuple):
+    id: int
+    name: str
+    slug: str
+    description: str
+    ingredients: str
+    price_30: object
+    price_35: object
+    price_40: object
+    category_id: int
+    is_popular: bool
+    is_new: bool
+    is_spicy: bool
+    is_vegetarian: bool
+    image_url: str
+    order: int
+
+    @classmethod
+    def from_instance(cls, pizza):
+        return cls(
+            pizza.id, pizza.name, pizza.slug, pizza.description, pizza.ingredients,
+            pizza.price_30, pizza.price_35, pizza.price_40, pizza.category_id,
+            pizza.is_popular, pizza.is_new, pizza.is_spicy, pizza.is_vegetarian,
+            pizza.image_url, pizza.order,
+        )
+
+    def get_price_by_size(self, size):
+        if size == '35':
+            return self.price_35
+        elif size == '40':
+            return self.price_40
+        return self.price_30
+
+
+class ComboEntry(NamedTuple):
+    id: int
+    name: str
+    description: str
+    price: object
+    image_url: str
+    includes: str
+    order: int
+    image_srcset: dict
+
+
+class PromotionEntry(NamedTuple):
+    id: int
+    title: str
+    description: str
+    image_url: str
+    end_date: object
+    image_srcset: dict
+    # Условия скидки: из них pricing.RuleSet собирает правила расчёта
+    kind: str = 'banner'
+    target: str = 'all'
+    category_id: int = None
+    pizza_id: int = None
+    size: str = ''
+    combo_id: int = None
+    value: object = 0
+    buy_quantity: int = 0
+    pay_quantity: int = 0
+    min_subtotal: object = 0
+
+    @classmethod
+    def from_instance(cls, promotion):
+        return cls(
+            promotion.id, promotion.title, promotion.description,
+            promotion.image.url if promotion.image else '', promotion.end_date, promotion.image_srcset,
+            promotion.kind, promotion.target, promotion.category_id, promotion.pizza_id, promotion.size,
+            promotion.combo_id, promotion.value, promotion.buy_quantity, promotion.pay_quantity,
+            promotion.min_subtotal,
+        )
+
+
+class Catalog:
+    """Неизменяемый снимок меню одной версии"""
+
+    __slots__ = ('version', 'categories', 'pizzas', 'combos', 'promotions',
+                 'pizzas_by_id', 'combos_by_id', 'popular_pizzas', 'new_pizzas')
+
+    def __init__(self, version, categories, pizzas, combos, promotions):
+        self.version = version
+        self.categories = tuple(categories)
+        self.pizzas = tuple(pizzas)
+        self.combos = tuple(combos)
+        self.promotions = tuple(promotions)
+        self.pizzas_by_id = MappingProxyType({pizza.id: pizza for pizza in self.pizzas})
+        self.combos_by_id = MappingProxyType({combo.id: combo for combo in self.combos})
+        self.popular_pizzas = tuple(pizza for pizza in self.pizzas if pizza.is_popular)
+        self.new_pizzas = tuple(pizza for pizza in self.pizzas if pizza.is_new)
+
+    def get_pizza(self, pizza_id):
+        return self.pizzas_by_id.get(pizza_id)
+
+    def get_combo(self, combo_id):
+        return self.combos_by_id.get(combo_id)
+
+    def get_category(self, name_contains):
+        """Первая по порядку категория, в названии которой есть подстрока"""
+        needle = name_contains.lower()
+        for category in self.categories:
+            if needle in category.name.lower():
+                return category
+        return None
+
+
+def _build(version):
+    categories = [
+        CategoryEntry(c.id, c.name, c.slug, c.description, c.order)
+        for c in Category.objects.order_by('order', 'name')
+    ]
+    pizzas = [PizzaEntry.from_instance(p) for p in Pizza.objects.order_by('order', 'name')]
+    combos = [
+        ComboEntry(c.id, c.name, c.description, c.price, c.image_url, c.includes, c.order, c.image_srcset)
+        for c in Combo.objects.order_by('order', 'name')
+    ]
+    promotions = [
+        PromotionEntry.from_instance(p)
+        for p in Promotion.objects.filter(is_active=True).order_by('-created_at')
+    ]
+    return Catalog(version, categories, pizzas, combos, promotions)
+
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+# dirty: текущий поток изменил каталог в ещё открытой транзакции
+_pending = threading.local()
+
+
+def _version_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def current_version():
+    """Общая для всех процессов версия каталога"""
+    cache = _version_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def changed_at():
+    """Время последней смены версии каталога (unix time) для Last-Modified"""
+    cache = _version_cache()
+    changed = cache.get(CHANGED_KEY)
+    if changed is None:
+        cache.add(CHANGED_KEY, time.time(), None)
+        changed = cache.get(CHANGED_KEY)
+    return changed
+
+
+def get_catalog():
+    """Текущий снимок каталога.
+
+    Общая версия проверяется не чаще раза в CATALOG_VERSION_CHECK_INTERVAL
+    секунд, поэтому в установившемся режиме чтение меню не обращается ни
+    к БД, ни к кешу.
+    """
+    global _snapshot, _checked_at
+
+    interval = getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 1.0)
+    snapshot = _snapshot
+    now = time.monotonic()
+    if snapshot is not None and now - _checked_at < interval:
+        return snapshot
+
+    if getattr(_pending, 'dirty', False):
+        if transaction.get_connection().in_atomic_block:
+            return _build(current_version())
+        # Транзакция завершилась откатом: снимок из БД снова можно запомнить
+        _pending.dirty = False
+
+    version = current_version()
+    if snapshot is not None and snapshot.version == version:
+        _checked_at = now
+        return snapshot
+
+    with _lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = _build(version)
+        _checked_at = now
+        return _snapshot
+
+
+def invalidate_catalog():
+    """Сбросить снимок текущего процесса"""
+    global _snapshot
+    _snapshot = None
+    _pending.dirty = False
+
+
+def bump_version():
+    """Сменить общую версию, чтобы остальные процессы перестроили снимок"""
+    invalidate_catalog()
+    cache = _version_cache()
+    cache.set(CHANGED_KEY, time.time(), None)
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+_batch = threading.local()
+
+
+@contextmanager
+def batch_changes():
+    """Изменения каталога внутри блока дают одну смену версии в конце.
+
+    Для массовых правок (команда sync_menu): сигналы отдельных строк
+    не сбрасывают снимок и не меняют версию, это делается один раз
+    после успешного выхода из внешнего блока.
+    """
+    depth = getattr(_batch, 'depth', 0)
+    _batch.depth = depth + 1
+    try:
+        yield
+    finally:
+        _batch.depth = depth
+    if depth == 0:
+        _changed()
+
+
+def _changed():
+    # Свой снимок сбрасываем сразу, а общую версию меняем только после
+    # коммита, чтобы другие процессы не перечитали незакоммиченные данные.
+    # bump_version после коммита снова разрешает запоминать снимок
+    invalidate_catalog()
+    _pending.dirty = transaction.get_connection().in_atomic_block
+    transaction.on_commit(bump_version)
+
+
+def _catalog_changed(sender, **kwargs):
+    if getattr(_batch, 'depth', 0):
+        return
+    _changed()
+
+
+for _model in (Category, Pizza, Combo, Promotion):
+    post_save.connect(_catalog_changed, sender=_model, dispatch_uid=f'catalog_save_{_model.__name__}')
+    post_delete.connect(_catalog_changed, sender=_model, dispatch_uid=f'catalog_delete_{_model.__name__}')
@@ -0,0 +1,130 @@
+"""Удаление брошенных анонимных корзин и истёкших сессий.
+
+get_cart() создаёт корзину на каждую анонимную сессию, поэтому таблицы
+корзин и сессий растут без ограничений. Сборщик удаляет анонимные
+корзины, сессия которых истекла или пропала, и корзины, которые не
+менялись дольше CART_TTL_DAYS дней, а затем истёкшие сессии и истёкшие
+корзины гостей в кеше без вытеснения (CART_CACHE_ALIAS).
+
+Удаление идёт небольшими порциями, каждая в своей короткой транзакции,
+с паузой между порциями: на SQLite запись блокирует всю базу, и
+оформление заказов не должно ждать сборщик дольше одной порции.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+
+def stale_carts(now=None, ttl_days=None):
+    """Анонимные корзины без живой сессии или без изменений дольше TTL"""
+    now = now or timezone.now()
+    if ttl_days is None:
+        ttl_days = getattr(settings, 'CART_TTL_DAYS', 30)
+    live_session = Session.objects.filter(session_key=OuterRef('session_key'), expire_date__gte=now)
+    return Cart.objects.filter(user__isnull=True).filter(
+        ~Exists(live_session) | Q(updated_at__lt=now - timedelta(days=ttl_days))
+    )
+
+
+def _in_batches(queryset, batch_size, pause, delete):
+    """Удалять строки queryset порциями по возрастанию первичного ключа"""
+    last_pk = None
+    while True:
+        batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(batch.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        with transaction.atomic():
+            # Условие проверяется ещё раз внутри транзакции: корзину могли
+            # изменить между выборкой и удалением
+            delete(queryset.filter(pk__in=pks))
+        last_pk = pks[-1]
+        if pause:
+            time.sleep(pause)
+
+
+def collect(ttl_days=None, batch_size=None, pause=0.0, stdout=None):
+    """Удалить брошенные корзины и истёкшие сессии.
+
+    Возвращает словарь {'carts': ..., 'cart_items': ..., 'sessions': ...,
+    'cached_carts': ..., 'seconds': ...}.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'CART_GC_BATCH_SIZE', 500)
+    started = time.monotonic()
+    now = timezone.now()
+    result = {'carts': 0, 'cart_items': 0, 'sessions': 0, 'cached_carts': 0}
+
+    def delete_carts(queryset):
+        total, per_model = queryset.delete()
+        result['carts'] += per_model.get(Cart._meta.label, 0)
+        result['cart_items'] += per_model.get(CartItem._meta.label, 0)
+        if stdout is not None:
+            stdout.write(f"Удалено корзин: {result['carts']}")
+
+    def delete_sessions(queryset):
+        result['sessions'] += queryset.delete()[0]
+        if stdout is not None:
+            stdout.write(f"Удалено сессий: {result['sessions']}")
+
+    _in_batches(stale_carts(now, ttl_days), batch_size, pause, delete_carts)
+    _in_batches(Session.objects.filter(expire_date__lt=now), batch_size, pause, delete_sessions)
+
+    # Кеш корзин не вытесняет записи сам, истёкшие файлы удаляются здесь
+    cart_cache = caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+    result['cached_carts'] = cart_cache.purge_expired() if hasattr(cart_cache, 'purge_expired') else 0
+
+    result['seconds'] = time.monotonic() - started
+    return result
+
+
+class PeriodicCollector:
+    """Запуск сборщика в фоновом потоке процесса раз в interval секунд"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='cart-gc', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                result = collect(pause=getattr(settings, 'CART_GC_PAUSE', 0.05))
+                logger.info('Сборщик корзин: %s', result)
+            except Exception:
+                logger.exception('Сборщик корзин завершился с ошибкой')
+            finally:
+                connection.close()
+
+
+_collector = None
+
+
+def start_periodic():
+    """Запустить фоновый сборщик, если задан CART_GC_INTERVAL"""
+    global _collector
+    interval = getattr(settings, 'CART_GC_INTERVAL', None)
+    if interval and _collector is None:
+        _collector = PeriodicCollector(interval)
+        _collector.start()
+    return _collector
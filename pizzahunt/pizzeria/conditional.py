@@ -0,0 +1,165 @@
+"""Условные GET (ETag / Last-Modified) для страниц, собранных из каталога.
+
+Главная, меню и «О нас» зависят от версии каталога и от того, кто их
+смотрит: вошёл ли пользователь и сколько товаров в его корзине. Все
+валидаторы берутся из общих кешей (версии - CATALOG_CACHE_ALIAS, ключи
+посетителей - CLIENT_CACHE_ALIAS), поэтому ответ 304 не трогает ни БД,
+ни шаблоны:
+
+- версия каталога и время её смены (catalog.current_version/changed_at);
+- ревизия корзины владельца, которую меняет touch_cart() после каждого
+  изменения состава корзины;
+- корзина анонимного посетителя из кеша или cookie (cart_storage.etag_part);
+- владелец, запомненный для ключа сессии после полного рендера
+  (ключ сессии меняется при входе и выходе, поэтому новая сессия
+  сначала получает обычный ответ).
+
+Страницы с непоказанными flash-сообщениями всегда рендерятся полностью.
+Сообщения проверяются через настроенное хранилище (MESSAGE_STORAGE): для
+FallbackStorage это cookie, а сессия читается, только если сообщения не
+поместились в cookie.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .catalog import changed_at, current_version
+
+REVISION_PREFIX = 'pizzeria:cart-revision:'
+CLIENT_PREFIX = 'pizzeria:page-client:'
+# Посетитель без сессии: корзины нет, страница одинакова для всех
+ANONYMOUS = 'anon'
+
+
+def _client_cache():
+    # Не кеш версий каталога: вытеснение ключей посетителей не должно задевать версии
+    return caches[getattr(settings, 'CLIENT_CACHE_ALIAS', 'default')]
+
+
+def cart_owner(cart):
+    if cart.user_id:
+        return f'u{cart.user_id}'
+    return f's{cart.session_key}'
+
+
+def _set_revision(owner):
+    _client_cache().set(REVISION_PREFIX + owner, time.time(), settings.SESSION_COOKIE_AGE)
+
+
+def touch_cart(cart):
+    """Отметить изменение корзины; вызывается после записи в БД"""
+    owner = cart_owner(cart)
+    transaction.on_commit(lambda: _set_revision(owner))
+
+
+async def atouch_cart(cart):
+    """Асинхронный вариант touch_cart() (вне транзакции)"""
+    await _client_cache().aset(REVISION_PREFIX + cart_owner(cart), time.time(), settings.SESSION_COOKIE_AGE)
+
+
+def cart_revision(owner):
+    if owner == ANONYMOUS:
+        return 0.0
+    cache = _client_cache()
+    key = REVISION_PREFIX + owner
+    revision = cache.get(key)
+    if revision is None:
+        # Ревизия вытеснена из кеша: новая не совпадёт ни с одним ETag
+        cache.add(key, time.time(), settings.SESSION_COOKIE_AGE)
+        revision = cache.get(key)
+    return revision
+
+
+def _session_key(request):
+    return request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+
+
+def _known_client(request):
+    """(владелец, с какого времени) для сессии запроса без чтения сессии"""
+    session_key = _session_key(request)
+    if not session_key:
+        return ANONYMOUS, 0.0
+    return _client_cache().get(CLIENT_PREFIX + session_key)
+
+
+def _remember_client(request):
+    # Вызывается после рендера: пользователь и сессия уже загружены
+    session_key = request.session.session_key
+    if not session_key:
+        return
+    if request.user.is_authenticated:
+        owner = f'u{request.user.pk}'
+    else:
+        owner = f's{session_key}'
+    cache = _client_cache()
+    key = CLIENT_PREFIX + session_key
+    known = cache.get(key)
+    if known is None or known[0] != owner:
+        cache.set(key, (owner, time.time()), settings.SESSION_COOKIE_AGE)
+
+
+def page_validators(request):
+    """(etag, last_modified) страницы или None, если клиент ещё неизвестен"""
+    client = _known_client(request)
+    if client is None:
+        return None
+    owner, since = client
+    from . import cart_storage
+    revision = cart_revision(owner)
+    version = current_version()
+    parts = (version, _session_key(request) or '', owner, repr(revision), request.META.get('CSRF_COOKIE', ''),
+             cart_storage.etag_part(request))
+    etag = '"%s"' % hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest()
+    return etag, max(changed_at(), revision, since)
+
+
+def _patch(response, validators):
+    etag, last_modified = validators
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ('Cookie',))
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _has_pending_messages(request):
+    storage = getattr(request, '_messages', None)
+    # len() загружает сообщения, но не помечает их показанными
+    return storage is not None and len(storage) > 0
+
+
+def conditional_page(view):
+    """Декоратор представления страницы каталога: ETag, Last-Modified и 304"""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or _has_pending_messages(request):
+            return view(request, *args, **kwargs)
+
+        # Валидаторы читаются до рендера: если каталог или корзина изменятся
+        # во время рендера, ETag окажется старым и следующий запрос не получит 304
+        validators = page_validators(request)
+        if validators is not None:
+            etag, last_modified = validators
+            not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+            if not_modified is not None:
+                return _patch(not_modified, validators)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if hasattr(response, 'add_post_render_callback'):
+            response.add_post_render_callback(lambda rendered: _remember_client(request))
+        else:
+            _remember_client(request)
+        if validators is not None:
+            _patch(response, validators)
+        return response
+
+    return wrapper
@@ -1,12 +1,19 @@
-from .utils import get_cart
+from django.utils.functional import SimpleLazyObject
+
+from .utils import peek_cart
 
 def cart_context(request):
-    cart = get_cart(request)
-    cart_total = cart.total_price() if cart else 0
-    cart_quantity = cart.total_quantity() if cart else 0
+    """Корзина для шаблонов.
+    
+    Все значения ленивые: запрос к БД выполняется только если шаблон
+    действительно обращается к корзине, а сессия и строка Cart при
+    чтении не создаются.
+    """
+    cart = SimpleLazyObject(lambda: peek_cart(request))
+    summary = SimpleLazyObject(lambda: cart.summary())
     
     return {
         'cart': cart,
-        'cart_total': cart_total,
-        'cart_quantity': cart_quantity,
+        'cart_total': SimpleLazyObject(lambda: summary.total_price),
+        'cart_quantity': SimpleLazyObject(lambda: summary.total_quantity),
     }
\ No newline at end of file
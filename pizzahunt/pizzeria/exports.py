@@ -0,0 +1,123 @@
+"""Потоковая выгрузка заказов с позициями в CSV и JSON Lines.
+
+Заказы читаются порциями по первичному ключу (keyset, без OFFSET), позиции
+подтягиваются одним запросом на порцию. Каждая порция превращается в один
+кусок ответа и сразу отдаётся клиенту, поэтому память не растёт с числом
+заказов. Под ASGI порции читаются в потоке через sync_to_async: синхронный
+итератор StreamingHttpResponse там сначала собрал бы весь ответ в список.
+"""
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import OrderItem
+
+ORDER_COLUMNS = (
+    'order_id', 'created_at', 'status', 'payment_method', 'payment_status',
+    'name', 'phone', 'email', 'address', 'comment', 'user_id', 'order_total',
+)
+ITEM_COLUMNS = ('item_type', 'item_name', 'size', 'quantity', 'unit_price', 'item_total')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def chunk_size():
+    return getattr(settings, 'ORDER_EXPORT_CHUNK_SIZE', 1000)
+
+
+def order_chunks(queryset, size=None):
+    """Порции заказов по возрастанию id с уже загруженными позициями"""
+    size = size or chunk_size()
+    queryset = queryset.order_by('pk')
+    items = Prefetch('items', queryset=OrderItem.objects.order_by('pk'))
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        orders = list(page[:size])
+        if not orders:
+            return
+        prefetch_related_objects(orders, items)
+        yield orders
+        if len(orders) < size:
+            return
+        last_pk = orders[-1].pk
+
+
+def _order_values(order):
+    return (
+        order.pk, timezone.localtime(order.created_at).isoformat(), order.status, order.payment_method,
+        order.payment_status, order.name, order.phone, order.email, order.address, order.comment,
+        order.user_id, str(order.total_price),
+    )
+
+
+def _item_values(item):
+    return (item.item_type, item.item_name, item.size, item.quantity, str(item.unit_price), str(item.total_price))
+
+
+def csv_chunks(queryset):
+    """CSV: строка на каждую позицию, заказ без позиций - одной строкой"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM: Excel иначе открывает кириллицу в неверной кодировке
+    buffer.write('\ufeff')
+    writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)
+    for orders in order_chunks(queryset):
+        for order in orders:
+            values = _order_values(order)
+            items = order.items.all()
+            if not items:
+                writer.writerow(values + ('',) * len(ITEM_COLUMNS))
+            for item in items:
+                writer.writerow(values + _item_values(item))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def jsonl_chunks(queryset):
+    """JSON Lines: объект на заказ, позиции - вложенным списком"""
+    for orders in order_chunks(queryset):
+        lines = []
+        for order in orders:
+            record = dict(zip(ORDER_COLUMNS, _order_values(order)))
+            record['items'] = [dict(zip(ITEM_COLUMNS, _item_values(item))) for item in order.items.all()]
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield '\n'.join(lines) + '\n'
+
+
+async def _in_thread(chunks):
+    iterator = iter(chunks)
+    sentinel = object()
+    while True:
+        chunk = await sync_to_async(next)(iterator, sentinel)
+        if chunk is sentinel:
+            return
+        yield chunk
+
+
+def export_response(queryset, fmt='csv', asynchronous=None):
+    """StreamingHttpResponse с выгрузкой заказов queryset"""
+    chunks = csv_chunks(queryset) if fmt == 'csv' else jsonl_chunks(queryset)
+    if asynchronous is None:
+        asynchronous = getattr(settings, 'ASYNC_VIEWS', False)
+    response = StreamingHttpResponse(
+        _in_thread(chunks) if asynchronous else chunks,
+        content_type=CONTENT_TYPES[fmt],
+    )
+    filename = f'orders-{timezone.localtime():%Y%m%d-%H%M}.{fmt}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,4 +1,7 @@
+from datetime import datetime, time, timedelta
+
 from django import forms
+from django.utils import timezone
 from .models import Feedback, Order, UserProfile
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
@@ -139,4 +142,42 @@ class OrderForm(forms.ModelForm):
                 'class': 'form-select',
                 'required': True
             }),
-        }
\ No newline at end of file
+        }
+
+
+class OrderExportForm(forms.Form):
+    """Фильтры выгрузки заказов для бухгалтерии"""
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    ]
+    
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
+    date_from = forms.DateField(required=False, label="С даты")
+    date_to = forms.DateField(required=False, label="По дату")
+    status = forms.MultipleChoiceField(choices=Order.STATUS_CHOICES, required=False, label="Статус")
+    payment_method = forms.MultipleChoiceField(choices=Order.PAYMENT_CHOICES, required=False, label="Способ оплаты")
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError("Начальная дата позже конечной")
+        return cleaned_data
+    
+    def filter(self, queryset):
+        """Применить фильтры; даты - включительно, по местному времени"""
+        data = self.cleaned_data
+        if data.get('date_from'):
+            queryset = queryset.filter(
+                created_at__gte=timezone.make_aware(datetime.combine(data['date_from'], time.min))
+            )
+        if data.get('date_to'):
+            queryset = queryset.filter(
+                created_at__lt=timezone.make_aware(datetime.combine(data['date_to'] + timedelta(days=1), time.min))
+            )
+        if data.get('status'):
+            queryset = queryset.filter(status__in=data['status'])
+        if data.get('payment_method'):
+            queryset = queryset.filter(payment_method__in=data['payment_method'])
+        return queryset
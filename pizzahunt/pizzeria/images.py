@@ -0,0 +1,167 @@
+"""Уменьшенные копии загруженных изображений.
+
+Для картинок комбо, акций и аватаров после сохранения строятся копии
+нескольких ширин (IMAGE_DERIVATIVE_WIDTHS) в WebP и JPEG. Они лежат рядом
+с оригиналом в подкаталоге derivatives/ и получают имена вида
+photo.png-320w.webp (с расширением оригинала, чтобы у photo.jpg и
+photo.png были разные копии), поэтому srcset собирается по имени
+оригинала без обращений к БД. Копии строит пул потоков: запрос, сохранивший модель,
+их не ждёт. Пересобрать копии для всех файлов можно командой
+build_image_derivatives.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save
+
+from .models import Combo, Promotion, UserProfile
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+# Поля с изображениями, для которых строятся копии
+IMAGE_FIELDS = ((Combo, 'image'), (Promotion, 'image'), (UserProfile, 'avatar'))
+
+
+def widths():
+    return tuple(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (320, 640, 1024)))
+
+
+def formats():
+    return tuple(getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', ('webp', 'jpeg')))
+
+
+def derivative_name(name, width, fmt):
+    directory, filename = os.path.split(name)
+    return os.path.join(directory, 'derivatives', f'{filename}-{width}w.{EXTENSIONS[fmt]}')
+
+
+def srcset(name, fmt, storage=default_storage):
+    """Значение srcset из готовых копий; пустая строка, если их ещё нет"""
+    if not name:
+        return ''
+    return ', '.join(
+        f'{storage.url(derivative)} {width}w'
+        for width in widths()
+        for derivative in [derivative_name(name, width, fmt)]
+        if storage.exists(derivative)
+    )
+
+
+def srcsets(name, storage=default_storage):
+    """{'webp': ..., 'jpeg': ...} для шаблонов"""
+    return {fmt: srcset(name, fmt, storage) for fmt in formats()}
+
+
+def build(name, storage=default_storage, force=False):
+    """Построить копии одного файла. Возвращает имена записанных файлов"""
+    from PIL import Image, ImageOps
+
+    with storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    written = []
+    for width in widths():
+        if width >= image.width:
+            # Увеличивать не нужно: для крупных экранов есть оригинал
+            continue
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+        for fmt in formats():
+            target = derivative_name(name, width, fmt)
+            if storage.exists(target):
+                if not force:
+                    continue
+                storage.delete(target)
+            pil_format, options = FORMATS[fmt]
+            frame = resized
+            if pil_format == 'JPEG' and frame.mode not in ('RGB', 'L'):
+                frame = frame.convert('RGB')
+            buffer = io.BytesIO()
+            frame.save(buffer, pil_format, **options)
+            written.append(storage.save(target, ContentFile(buffer.getvalue())))
+    return written
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_WORKERS', 2),
+                thread_name_prefix='image-derivatives',
+            )
+        return _executor
+
+
+def _build_in_background(name, on_done):
+    try:
+        if build(name) and on_done is not None:
+            on_done()
+    except Exception:
+        logger.exception('Не удалось построить копии изображения %s', name)
+
+
+def schedule(name, on_done=None):
+    """Поставить построение копий в пул потоков"""
+    future = _get_executor().submit(_build_in_background, name, on_done)
+    _pending.add(future)
+    future.add_done_callback(_pending.discard)
+    return future
+
+
+def wait_pending(timeout=None):
+    """Дождаться построения всех поставленных копий (для тестов и команд)"""
+    for future in list(_pending):
+        future.result(timeout)
+
+
+def _bump_catalog():
+    # Снимок каталога хранит srcset комбо и акций: после появления
+    # копий его нужно перестроить
+    from .catalog import bump_version
+    bump_version()
+
+
+def _image_field(sender):
+    return next(field for model, field in IMAGE_FIELDS if model is sender)
+
+
+def _image_pre_save(sender, instance, raw=False, **kwargs):
+    # Новый загруженный файл ещё не записан в хранилище: копии нужны
+    # только для него, а не при каждом сохранении модели
+    file = getattr(instance, _image_field(sender))
+    instance._image_uploaded = not raw and bool(file) and not file._committed
+
+
+def _image_saved(sender, instance, **kwargs):
+    if not getattr(instance, '_image_uploaded', False):
+        return
+    instance._image_uploaded = False
+    name = getattr(instance, _image_field(sender)).name
+    on_done = _bump_catalog if sender in (Combo, Promotion) else None
+    transaction.on_commit(lambda: schedule(name, on_done))
+
+
+for _model, _field in IMAGE_FIELDS:
+    pre_save.connect(_image_pre_save, sender=_model, dispatch_uid=f'images_pre_save_{_model.__name__}')
+    post_save.connect(_image_saved, sender=_model, dispatch_uid=f'images_saved_{_model.__name__}')
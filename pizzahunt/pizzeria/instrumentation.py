@@ -0,0 +1,269 @@
+"""Замеры запросов: время в БД, шаблонах, обращения к кешу.
+
+RequestTimingMiddleware заводит на каждый запрос объект RequestMetrics в
+contextvar, поэтому замеры работают и для async-представлений, чьи
+запросы к БД выполняются в потоках sync_to_async. Итоги запроса уходят
+в скользящие окна по имени маршрута, из которых страница /myadmin/perf/
+считает p50/p95/p99, и в заголовок Server-Timing, если он включён
+(SERVER_TIMING_HEADER, по умолчанию только при DEBUG).
+
+Классы Django не подменяются: запросы к БД считает execute_wrapper
+соединений, шаблоны - бэкенд TimedDjangoTemplates из TEMPLATES,
+обращения к кешу - обёртка над get() экземпляров из CACHES.
+"""
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db.backends.signals import connection_created
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template as DjangoTemplate
+
+_current = contextvars.ContextVar('pizzeria_request_metrics', default=None)
+
+# Границы столбцов гистограммы на странице производительности, мс
+HISTOGRAM_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class RequestMetrics:
+    __slots__ = ('db_time', 'queries', 'template_time', 'template_depth', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.queries = 0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+def current_metrics():
+    return _current.get()
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries += 1
+
+
+def _install_db_wrapper(connection, **kwargs):
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+class TimedTemplate(DjangoTemplate):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        # Вложенные render_to_string внутри шаблона не считаем дважды
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if metrics.template_depth == 0:
+                metrics.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, замеряющий время рендера (см. TEMPLATES)"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _counted_get(get):
+    @functools.wraps(get)
+    def wrapper(key, default=None, version=None):
+        value = get(key, default, version)
+        metrics = _current.get()
+        if metrics is not None:
+            if value is default:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return value
+    wrapper._pizzeria_counted = True
+    return wrapper
+
+
+def _count_cache_gets():
+    """Обернуть get() кешей из CACHES.
+
+    Экземпляры кешей создаются отдельно для каждого потока (и заново после
+    смены CACHES), поэтому проверка идёт на каждом запросе; обёртка ставится
+    на экземпляр, классы бэкендов не меняются.
+    """
+    for alias in settings.CACHES:
+        cache = caches[alias]
+        if not getattr(cache.get, '_pizzeria_counted', False):
+            cache.get = _counted_get(cache.get)
+
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def install():
+    """Подключить замеры запросов к БД (один раз на процесс)"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        connection_created.connect(_install_db_wrapper, dispatch_uid='pizzeria_instrumentation')
+        for connection in connections.all(initialized_only=True):
+            _install_db_wrapper(connection)
+        _installed = True
+
+
+class TimingWindow:
+    """Последние N замеров одного маршрута"""
+
+    def __init__(self, size):
+        self.total = deque(maxlen=size)
+        self.db = deque(maxlen=size)
+        self.queries = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, total, db, queries):
+        self.total.append(total)
+        self.db.append(db)
+        self.queries.append(queries)
+        self.count += 1
+
+    def summary(self):
+        samples = sorted(self.total)
+        if not samples:
+            return None
+
+        def percentile(fraction):
+            return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+        histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        for sample in samples:
+            bucket = 0
+            while bucket < len(HISTOGRAM_BOUNDS) and sample > HISTOGRAM_BOUNDS[bucket]:
+                bucket += 1
+            histogram[bucket] += 1
+        db = list(self.db)
+        queries = list(self.queries)
+        return {
+            'count': self.count,
+            'window': len(samples),
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'max': samples[-1],
+            'db_avg': sum(db) / len(db),
+            'queries_avg': sum(queries) / len(queries),
+            'histogram': histogram,
+        }
+
+
+class TimingRegistry:
+    """Скользящие окна замеров по имени маршрута"""
+
+    def __init__(self, window_size=None):
+        self.window_size = window_size
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, total, db, queries):
+        window = self._windows.get(route)
+        if window is None:
+            with self._lock:
+                size = self.window_size or getattr(settings, 'PERF_WINDOW_SIZE', 1000)
+                window = self._windows.setdefault(route, TimingWindow(size))
+        window.add(total, db, queries)
+
+    def snapshot(self):
+        """Сводка по маршрутам, самые медленные по p95 - первыми"""
+        rows = []
+        for route, window in list(self._windows.items()):
+            summary = window.summary()
+            if summary is not None:
+                rows.append(dict(summary, route=route))
+        rows.sort(key=lambda row: row['p95'], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._windows = {}
+
+
+registry = TimingRegistry()
+
+
+def _server_timing(metrics, total):
+    return (
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+        f'tpl;dur={metrics.template_time * 1000:.1f}, '
+        f'cache;desc="hit {metrics.cache_hits} miss {metrics.cache_misses}", '
+        f'total;dur={total:.1f}'
+    )
+
+
+class RequestTimingMiddleware:
+    """Замеряет каждый запрос, пополняет registry и при включённом SERVER_TIMING_HEADER
+    добавляет Server-Timing"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        _count_cache_gets()
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        _count_cache_gets()
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics, started)
+
+    def _finish(self, request, response, metrics, started):
+        total = (time.perf_counter() - started) * 1000
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match is not None else '<unresolved>'
+        registry.record(route, total, metrics.db_time * 1000, metrics.queries)
+        # Время БД и число запросов - внутренние сведения, по умолчанию только при DEBUG
+        if getattr(settings, 'SERVER_TIMING_HEADER', settings.DEBUG):
+            response['Server-Timing'] = _server_timing(metrics, total)
+        return response
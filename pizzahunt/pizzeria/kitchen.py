@@ -0,0 +1,312 @@
+"""Очередь кухни: что готовить дальше и какие пиццы ставить в печь вместе.
+
+Подтверждённые заказы лежат в KitchenQueue по обещанному времени
+(Order.promised_at): это куча heapq по слоту обещанного времени
+(KITCHEN_SLOT_SECONDS), внутри слота заказы идут в порядке поступления.
+Добавление и извлечение занимают O(log n). Отменённый или изменённый
+заказ не ищется в куче, а помечается устаревшим и выбрасывается, когда
+доходит до её вершины; если устаревших записей становится больше, чем
+актуальных, куча пересобирается. Обход очереди для экрана кухни
+сортирует копию кучи.
+
+plan_batches() раскладывает одинаковые пиццы (название и размер) из
+ожидающих заказов по загрузкам печи на KITCHEN_OVEN_CAPACITY штук;
+загрузки идут в порядке самого раннего обещанного времени.
+
+KitchenBoard держит в процессе очередь и заказы в работе и сверяется
+с БД, когда меняется версия живой статистики (live.stats_version: её
+меняет любое изменение заказов, в том числе в других процессах), но не
+реже чем раз в KITCHEN_RESYNC_INTERVAL секунд. Каждое изменение заказа
+получает номер ревизии, по которому экран кухни забирает только изменения.
+"""
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from django.conf import settings
+
+from . import live
+from .models import Order, OrderItem
+from .rollups import update_order_status
+
+# Статусы заказов, которые видит кухня: ожидают печи и уже готовятся
+WAITING = 'confirmed'
+COOKING = 'preparing'
+ACTIVE_STATUSES = (WAITING, COOKING)
+# Сколько последних изменений помнит экран кухни для запросов с курсором
+LOG_SIZE = 1000
+
+
+def promised_from(start):
+    """Обещанное время для заказа, оформленного в start"""
+    return start + timedelta(minutes=getattr(settings, 'KITCHEN_PROMISE_MINUTES', 45))
+
+
+class Ticket(NamedTuple):
+    order_id: int
+    status: str
+    promised_at: datetime
+    comment: str
+    # (тип, название, размер, количество) по строкам заказа
+    items: tuple
+
+    def as_dict(self):
+        return {
+            'id': self.order_id,
+            'status': self.status,
+            'promised_at': self.promised_at.isoformat(),
+            'comment': self.comment,
+            'items': [[name, size, quantity] for _, name, size, quantity in self.items],
+        }
+
+
+class KitchenQueue:
+    """Очередь заказов по обещанному времени"""
+
+    def __init__(self, slot_seconds=None):
+        self.slot_seconds = slot_seconds or getattr(settings, 'KITCHEN_SLOT_SECONDS', 60)
+        # (слот, номер поступления, билет); номер делает записи различимыми
+        self._heap = []
+        self._counter = itertools.count()
+        # Актуальный билет каждого заказа; остальные билеты в куче устарели
+        self._tickets = {}
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def __contains__(self, order_id):
+        return order_id in self._tickets
+
+    def _slot(self, ticket):
+        return int(ticket.promised_at.timestamp()) // self.slot_seconds
+
+    def _is_current(self, ticket):
+        return self._tickets.get(ticket.order_id) is ticket
+
+    def push(self, ticket):
+        """Добавить заказ или заменить его прежний билет"""
+        self._tickets[ticket.order_id] = ticket
+        heapq.heappush(self._heap, (self._slot(ticket), next(self._counter), ticket))
+        if len(self._heap) > 2 * len(self._tickets) + 16:
+            self._heap = [entry for entry in self._heap if self._is_current(entry[2])]
+            heapq.heapify(self._heap)
+
+    def discard(self, order_id):
+        return self._tickets.pop(order_id, None)
+
+    def peek(self):
+        """Первый актуальный билет; устаревшие записи с вершины кучи выбрасываются"""
+        while self._heap:
+            ticket = self._heap[0][2]
+            if self._is_current(ticket):
+                return ticket
+            heapq.heappop(self._heap)
+        return None
+
+    def pop(self):
+        ticket = self.peek()
+        if ticket is None:
+            return None
+        heapq.heappop(self._heap)
+        del self._tickets[ticket.order_id]
+        return ticket
+
+    def __iter__(self):
+        """Актуальные билеты в порядке очереди (без извлечения)"""
+        for _, _, ticket in sorted(self._heap):
+            if self._is_current(ticket):
+                yield ticket
+
+
+class Batch(NamedTuple):
+    name: str
+    size: str
+    quantity: int
+    # (id заказа, сколько штук из него) в порядке очереди
+    orders: tuple
+    due: datetime
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'size': self.size,
+            'quantity': self.quantity,
+            'orders': [list(part) for part in self.orders],
+            'due': self.due.isoformat(),
+        }
+
+
+def plan_batches(tickets, capacity=None):
+    """Загрузки печи для билетов в порядке очереди.
+
+    Одинаковые пиццы из разных заказов идут в одну загрузку, пока она не
+    заполнится; заказ может разойтись по нескольким загрузкам. Состав
+    комбо в заказе не хранится, поэтому комбо в загрузки не попадают.
+    """
+    capacity = capacity or getattr(settings, 'KITCHEN_OVEN_CAPACITY', 6)
+    groups = {}
+    for ticket in tickets:
+        for item_type, name, size, quantity in ticket.items:
+            if item_type == 'pizza':
+                groups.setdefault((name, size), []).append((ticket.order_id, quantity, ticket.promised_at))
+
+    batches = []
+    for (name, size), lines in groups.items():
+        parts, filled, due = [], 0, None
+        for order_id, quantity, promised_at in lines:
+            while quantity:
+                taken = min(quantity, capacity - filled)
+                parts.append((order_id, taken))
+                filled += taken
+                quantity -= taken
+                due = due or promised_at
+                if filled == capacity:
+                    batches.append(Batch(name, size, filled, tuple(parts), due))
+                    parts, filled, due = [], 0, None
+        if parts:
+            batches.append(Batch(name, size, filled, tuple(parts), due))
+    batches.sort(key=lambda batch: batch.due)
+    return batches
+
+
+class KitchenBoard:
+    """Состояние кухни в процессе: очередь, заказы в работе и журнал изменений"""
+
+    def __init__(self, version=live.stats_version):
+        self.version = version
+        self.id = uuid.uuid4().hex[:8]
+        self.queue = KitchenQueue()
+        self.tickets = {}
+        self.revision = 0
+        self._log = deque(maxlen=LOG_SIZE)
+        self._seen = object()
+        self._synced_at = None
+        self._lock = threading.RLock()
+
+    def refresh(self, force=False):
+        """Сверить состояние с БД, если заказы менялись или сверка давно не проводилась"""
+        with self._lock:
+            current = self.version()
+            interval = getattr(settings, 'KITCHEN_RESYNC_INTERVAL', 30)
+            if (not force and current == self._seen and self._synced_at is not None
+                    and time.monotonic() - self._synced_at < interval):
+                return
+            self._seen = current
+            self._synced_at = time.monotonic()
+            self._sync()
+
+    def _sync(self):
+        rows = {
+            row[0]: row for row in Order.objects.filter(status__in=ACTIVE_STATUSES)
+            .values_list('id', 'status', 'promised_at', 'created_at', 'comment')
+        }
+        # Строки заказа не меняются, поэтому читаются только для новых заказов
+        items = defaultdict(list)
+        new_ids = [order_id for order_id in rows if order_id not in self.tickets]
+        if new_ids:
+            for order_id, *item in (OrderItem.objects.filter(order_id__in=new_ids).order_by('id')
+                                    .values_list('order_id', 'item_type', 'item_name', 'size', 'quantity')):
+                items[order_id].append(tuple(item))
+
+        changed = [order_id for order_id in self.tickets if order_id not in rows]
+        for order_id in changed:
+            self._drop(order_id)
+        for order_id, status, promised_at, created_at, comment in rows.values():
+            old = self.tickets.get(order_id)
+            promised_at = promised_at or promised_from(created_at)
+            if old is not None and (old.status, old.promised_at, old.comment) == (status, promised_at, comment):
+                continue
+            self._put(Ticket(order_id, status, promised_at, comment,
+                             old.items if old is not None else tuple(items[order_id])))
+            changed.append(order_id)
+        self._record(changed)
+
+    def _put(self, ticket):
+        self.tickets[ticket.order_id] = ticket
+        if ticket.status == WAITING:
+            self.queue.push(ticket)
+        else:
+            self.queue.discard(ticket.order_id)
+
+    def _drop(self, order_id):
+        self.tickets.pop(order_id, None)
+        self.queue.discard(order_id)
+
+    def _record(self, order_ids):
+        for order_id in order_ids:
+            self.revision += 1
+            self._log.append((self.revision, order_id))
+
+    def take_next(self):
+        """Взять в работу ближайший по обещанному времени заказ; None, если ждущих нет"""
+        self.refresh()
+        while True:
+            with self._lock:
+                ticket = self.queue.pop()
+            if ticket is None:
+                return None
+            taken = update_order_status(Order.objects.filter(pk=ticket.order_id, status=WAITING), COOKING)
+            with self._lock:
+                if taken:
+                    ticket = ticket._replace(status=COOKING)
+                    self._put(ticket)
+                else:
+                    # Заказ отменён или взят в другом процессе: его настоящее
+                    # состояние подтянет следующая сверка
+                    self._drop(ticket.order_id)
+                self._record([ticket.order_id])
+            if taken:
+                return ticket
+
+    def mark_ready(self, order_id):
+        """Заказ испечён и передан в доставку"""
+        ready = update_order_status(Order.objects.filter(pk=order_id, status=COOKING), 'delivering')
+        if ready:
+            with self._lock:
+                self._drop(order_id)
+                self._record([order_id])
+        return bool(ready)
+
+    def state(self):
+        """Полное состояние: заказы по ключам order:<id> и загрузки печи"""
+        with self._lock:
+            state = {f'order:{order_id}': ticket.as_dict() for order_id, ticket in self.tickets.items()}
+            state['batches'] = [batch.as_dict() for batch in plan_batches(self.queue)]
+        return state
+
+    def collect(self):
+        """Источник для live.Broadcaster: он сам следит за версией"""
+        self.refresh(force=True)
+        return self.state()
+
+    def cursor(self):
+        return f'{self.id}:{self.revision}'
+
+    def changes_since(self, cursor=None):
+        """Изменения после курсора; полное состояние, если курсор чужой или слишком старый.
+
+        Курсор привязан к процессу: другой рабочий процесс нумерует
+        изменения по-своему и на такой курсор отвечает полным состоянием.
+        """
+        self.refresh()
+        with self._lock:
+            board_id, _, revision = (cursor or '').partition(':')
+            oldest = self._log[0][0] if self._log else self.revision + 1
+            if board_id != self.id or not revision.isdigit() or int(revision) < oldest - 1:
+                return {'cursor': self.cursor(), 'full': True, 'changes': self.state()}
+            order_ids = {order_id for number, order_id in self._log if number > int(revision)}
+            changes = {}
+            for order_id in order_ids:
+                ticket = self.tickets.get(order_id)
+                changes[f'order:{order_id}'] = ticket.as_dict() if ticket else None
+            if order_ids:
+                changes['batches'] = [batch.as_dict() for batch in plan_batches(self.queue)]
+            return {'cursor': self.cursor(), 'full': False, 'changes': changes}
+
+
+board = KitchenBoard()
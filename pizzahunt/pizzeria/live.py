@@ -0,0 +1,135 @@
+"""Рассылка живой статистики в админ-панель через Server-Sent Events.
+
+На процесс работает один производитель: он раз в LIVE_STATS_POLL_INTERVAL
+секунд читает общую версию статистики из кеша и, только если она
+изменилась, один раз пересчитывает данные и раздаёт изменения всем
+подписчикам. Поэтому нагрузка не растёт с числом открытых вкладок.
+Версию меняет сигнал sales_changed из сводок продаж, в том числе в
+других рабочих процессах.
+"""
+import asyncio
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .rollups import sales_changed
+
+VERSION_KEY = 'pizzeria:stats:version'
+HEARTBEAT_INTERVAL = 15
+# Сообщение в очереди подписчика, после которого его поток завершается
+CLOSE = None
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def stats_version():
+    return _cache().get(VERSION_KEY)
+
+
+def bump_stats_version(**kwargs):
+    _cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _sales_changed(sender, **kwargs):
+    transaction.on_commit(bump_stats_version)
+
+
+sales_changed.connect(_sales_changed, dispatch_uid='live_sales_changed')
+
+
+class Broadcaster:
+    """Один опрос источника на процесс, раздача изменений всем подписчикам"""
+
+    def __init__(self, collect, version=stats_version, interval=None):
+        self.collect = collect
+        self.version = version
+        self.interval = interval
+        self._subscribers = set()
+        self._task = None
+        self._last = None
+
+    @property
+    def poll_interval(self):
+        if self.interval is not None:
+            return self.interval
+        return getattr(settings, 'LIVE_STATS_POLL_INTERVAL', 2.0)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=16)
+        if self._last is not None:
+            queue.put_nowait(self._last)
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def _publish(self, message):
+        for queue in list(self._subscribers):
+            if queue.full():
+                # Медленный клиент: без пропущенного изменения его экран уже
+                # не сойдётся, поэтому поток закрывается. EventSource
+                # переподключится и первым сообщением получит полное состояние
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(CLOSE)
+                continue
+            queue.put_nowait(message)
+
+    async def _run(self):
+        seen = object()
+        while self._subscribers:
+            current = await sync_to_async(self.version)()
+            if current != seen:
+                seen = current
+                stats = await sync_to_async(self.collect)()
+                previous = self._last or {}
+                delta = {key: value for key, value in stats.items() if previous.get(key) != value}
+                # Пропавший ключ (например, заказ ушёл с кухни) приходит как null
+                delta.update((key, None) for key in previous if key not in stats)
+                self._last = stats
+                if delta:
+                    self._publish(delta)
+            await asyncio.sleep(self.poll_interval)
+        self._task = None
+
+
+async def event_stream(broadcaster, event='stats'):
+    """Поток SSE: первое сообщение - полное состояние, дальше только изменения"""
+    queue = broadcaster.subscribe()
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            if message is CLOSE:
+                return
+            yield f'event: {event}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n'
+    finally:
+        broadcaster.unsubscribe(queue)
+
+
+def stream_response(broadcaster, event='stats'):
+    """Ответ SSE; без ASGI - 204, после которого EventSource не переподключается.
+
+    Под WSGI бесконечный асинхронный поток не отдаётся по частям: Django
+    сначала дочитывает его целиком, и запрос занимает поток навсегда.
+    """
+    if not getattr(settings, 'ASYNC_VIEWS', False):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(event_stream(broadcaster, event), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
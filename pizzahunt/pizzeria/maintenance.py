@@ -0,0 +1,89 @@
+"""Обслуживание базы SQLite (команда db_maintenance).
+
+Шаги выполняются по порядку, каждый отдельным оператором в режиме
+автокоммита, и возвращаются списком (шаг, результат, секунды):
+
+- ANALYZE - статистика для планировщика по всем таблицам и индексам;
+- PRAGMA optimize - то, что SQLite сама считает полезным перестроить;
+- incremental_vacuum - возврат свободных страниц в файловую систему.
+  Работает только при auto_vacuum=INCREMENTAL; перевести базу в этот
+  режим можно один раз полным VACUUM (enable_incremental=True), который
+  перезаписывает весь файл и на время блокирует запись;
+- wal_checkpoint - перенос WAL в основной файл и усечение журнала
+  (только в режиме WAL, см. SQLITE_PRAGMAS в settings).
+"""
+import time
+
+AUTO_VACUUM_INCREMENTAL = 2
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+
+class MaintenanceError(Exception):
+    """Обслуживание невозможно для этой базы"""
+
+
+def pragma(connection, name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA {name}')
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def status(connection):
+    """Основные параметры файла базы"""
+    return {
+        name: pragma(connection, name)
+        for name in ('journal_mode', 'auto_vacuum', 'page_size', 'page_count', 'freelist_count')
+    }
+
+
+def _step(steps, name, action):
+    started = time.monotonic()
+    result = action()
+    steps.append((name, result if isinstance(result, str) else 'готово', time.monotonic() - started))
+
+
+def _execute(connection, sql):
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        # incremental_vacuum и wal_checkpoint работают, пока читаются строки результата
+        return cursor.fetchall()
+
+
+def _vacuum(connection, pages, enable_incremental):
+    before = pragma(connection, 'freelist_count')
+    if pragma(connection, 'auto_vacuum') != AUTO_VACUUM_INCREMENTAL:
+        if not enable_incremental:
+            return 'пропущено: auto_vacuum не INCREMENTAL'
+        _execute(connection, 'PRAGMA auto_vacuum=INCREMENTAL')
+        _execute(connection, 'VACUUM')
+        return f'полный VACUUM, свободных страниц {before} -> {pragma(connection, "freelist_count")}'
+    _execute(connection, f'PRAGMA incremental_vacuum({int(pages)})')
+    return f'свободных страниц {before} -> {pragma(connection, "freelist_count")}'
+
+
+def _checkpoint(connection, mode):
+    if pragma(connection, 'journal_mode') != 'wal':
+        return 'пропущено: журнал не WAL'
+    busy, log_pages, checkpointed = _execute(connection, f'PRAGMA wal_checkpoint({mode})')[0]
+    return f'страниц в журнале {log_pages}, перенесено {checkpointed}' + (', база занята' if busy else '')
+
+
+def run(connection, analyze=True, vacuum_pages=0, enable_incremental=False, checkpoint='TRUNCATE'):
+    """Выполнить обслуживание; vacuum_pages=0 - освободить все свободные страницы"""
+    if connection.vendor != 'sqlite':
+        raise MaintenanceError(f'Обслуживание поддерживается только для SQLite, а не {connection.vendor}')
+    if checkpoint and checkpoint.upper() not in CHECKPOINT_MODES:
+        raise MaintenanceError(f'Неизвестный режим checkpoint: {checkpoint}')
+    if connection.in_atomic_block:
+        raise MaintenanceError('VACUUM и checkpoint нельзя выполнять внутри транзакции')
+
+    steps = []
+    if analyze:
+        _step(steps, 'ANALYZE', lambda: _execute(connection, 'ANALYZE'))
+    _step(steps, 'optimize', lambda: _execute(connection, 'PRAGMA optimize'))
+    if vacuum_pages is not None:
+        _step(steps, 'incremental_vacuum', lambda: _vacuum(connection, vacuum_pages, enable_incremental))
+    if checkpoint:
+        _step(steps, 'wal_checkpoint', lambda: _checkpoint(connection, checkpoint.upper()))
+    return steps
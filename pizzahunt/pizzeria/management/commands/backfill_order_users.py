@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from pizzeria.models import Cart, Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполнить Order.user у старых заказов по владельцу корзины заказа. '
+        'Заказы обрабатываются порциями по первичному ключу, каждая порция - '
+        'отдельной транзакцией. Обрабатываются только заказы без user, поэтому '
+        'прерванный запуск можно просто повторить; --start-id продолжает с '
+        'последнего выведенного id.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Сколько заказов обновлять за одну транзакцию (по умолчанию 1000)',
+        )
+        parser.add_argument(
+            '--start-id', type=int, default=0,
+            help='Начать с заказов, id которых больше указанного',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help='Пауза между порциями в секундах, чтобы не мешать рабочей нагрузке',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = options['start_id']
+        cart_owner = Subquery(Cart.objects.filter(id=OuterRef('cart_id')).values('user_id')[:1])
+        pending = Order.objects.filter(user__isnull=True, cart__user__isnull=False)
+        started = time.monotonic()
+        updated = 0
+
+        while True:
+            ids = list(
+                pending.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                # Повторная проверка user IS NULL: заказ мог получить владельца
+                # при оформлении, пока шла обработка
+                updated += Order.objects.filter(id__in=ids, user__isnull=True).update(user=cart_owner)
+            last_id = ids[-1]
+            self.stdout.write(f'Обновлено заказов: {updated}, последний id: {last_id}')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        orphaned = Order.objects.filter(user__isnull=True, cart__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с: обновлено заказов {updated}'
+        ))
+        if orphaned:
+            self.stdout.write(self.style.WARNING(
+                f'Заказов без корзины, владельца которых не восстановить: {orphaned}'
+            ))
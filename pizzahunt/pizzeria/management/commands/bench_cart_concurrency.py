@@ -0,0 +1,142 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import include, path
+
+from pizzeria import views
+from pizzeria.catalog import invalidate_catalog
+from pizzeria.models import Category, Pizza
+
+
+def _urlconf(name, cart, add):
+    # Корзина на выбранных представлениях, остальные адреса - из проекта,
+    # чтобы шаблон корзины мог разрешить все ссылки
+    module = types.ModuleType(name)
+    module.urlpatterns = [
+        path('cart/', cart, name='cart'),
+        path('cart/add/', add, name='add_to_cart'),
+        path('', include('pizzahunt.urls')),
+    ]
+    return module
+
+
+SYNC_URLS = _urlconf('bench_sync_urls', views.cart_view, views.add_to_cart_view)
+ASYNC_URLS = _urlconf('bench_async_urls', views.cart_view_async, views.add_to_cart_view_async)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнить пропускную способность корзины под WSGI и ASGI: '
+        'N клиентов одновременно добавляют пиццы и открывают корзину. '
+        'Запросы проходят через обработчики Django в одном процессе, '
+        'на временной копии базы данных.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100,
+                            help='Число одновременных клиентов (по умолчанию 100)')
+        parser.add_argument('--requests', type=int, default=10,
+                            help='Запросов на клиента (по умолчанию 10)')
+
+    def handle(self, *args, **options):
+        clients, per_client = options['clients'], options['requests']
+        fd, db_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = db_path
+        # Сотня пишущих клиентов: ждём блокировку SQLite, а не падаем сразу
+        connection.settings_dict.setdefault('OPTIONS', {}).update(
+            timeout=60, transaction_mode='IMMEDIATE',
+        )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            pizza_ids = self._fill_menu()
+            for label, run in (('WSGI', self._run_sync), ('ASGI', self._run_async)):
+                latencies, elapsed = run(clients, per_client, pizza_ids)
+                self._report(label, latencies, elapsed)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if os.path.exists(db_path):
+                os.remove(db_path)
+
+    def _fill_menu(self):
+        category = Category.objects.create(name='Пиццы', slug='bench-pizzas')
+        pizzas = Pizza.objects.bulk_create([
+            Pizza(name=f'Пицца {i}', slug=f'bench-pizza-{i}', description='', ingredients='',
+                  price_30=Decimal('500'), price_35=Decimal('600'), price_40=Decimal('700'),
+                  category=category, order=i)
+            for i in range(20)
+        ])
+        invalidate_catalog()
+        return [pizza.id for pizza in pizzas]
+
+    def _requests(self, number, per_client, pizza_ids):
+        """Сценарий клиента: добавления в корзину, каждый пятый запрос - страница корзины"""
+        for step in range(per_client):
+            if step % 5 == 4:
+                yield 'get', '/cart/', {}
+            else:
+                yield 'post', '/cart/add/', {
+                    'item_type': 'pizza',
+                    'item_id': pizza_ids[(number + step) % len(pizza_ids)],
+                    'size': '30',
+                }
+
+    def _run_sync(self, clients, per_client, pizza_ids):
+        def client_session(number):
+            client = Client(headers={'X-Requested-With': 'XMLHttpRequest'})
+            latencies = []
+            for method, url, data in self._requests(number, per_client, pizza_ids):
+                started = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                latencies.append((time.perf_counter() - started, response.status_code >= 400))
+            connection.close()
+            return latencies
+
+        with override_settings(ROOT_URLCONF=SYNC_URLS):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                results = list(pool.map(client_session, range(clients)))
+            elapsed = time.perf_counter() - started
+        return [latency for result in results for latency in result], elapsed
+
+    def _run_async(self, clients, per_client, pizza_ids):
+        async def client_session(number):
+            client = AsyncClient(headers={'X-Requested-With': 'XMLHttpRequest'})
+            latencies = []
+            for method, url, data in self._requests(number, per_client, pizza_ids):
+                started = time.perf_counter()
+                response = await getattr(client, method)(url, data)
+                latencies.append((time.perf_counter() - started, response.status_code >= 400))
+            return latencies
+
+        async def run_all():
+            return await asyncio.gather(*(client_session(number) for number in range(clients)))
+
+        with override_settings(ROOT_URLCONF=ASYNC_URLS):
+            started = time.perf_counter()
+            results = asyncio.run(run_all())
+            elapsed = time.perf_counter() - started
+        return [latency for result in results for latency in result], elapsed
+
+    def _report(self, label, results, elapsed):
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(failed for _, failed in results)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f'{label}: {len(latencies)} запросов за {elapsed:.2f} с, '
+            f'{len(latencies) / elapsed:.0f} запросов/с, '
+            f'p50 {statistics.median(latencies) * 1000:.1f} мс, p95 {p95 * 1000:.1f} мс, '
+            f'ошибок {errors}'
+        )
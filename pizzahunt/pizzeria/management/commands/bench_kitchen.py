@@ -0,0 +1,80 @@
+import heapq
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pizzeria.kitchen import KitchenQueue, Ticket, plan_batches
+
+SIZES = ('30', '35', '40')
+
+
+def _stream(rng, count, pizzas, start):
+    """Синтетический поток заказов: обещанное время от -10 до +90 минут"""
+    for order_id in range(1, count + 1):
+        items = tuple(
+            ('pizza', f'Пицца {rng.randint(1, pizzas)}', rng.choice(SIZES), rng.randint(1, 3))
+            for _ in range(rng.randint(1, 4))
+        )
+        promised_at = start + timedelta(seconds=rng.randint(-600, 5400))
+        yield Ticket(order_id, 'confirmed', promised_at, '', items)
+
+
+class Command(BaseCommand):
+    help = (
+        'Измерить очередь кухни без БД на синтетическом потоке заказов: '
+        'добавление, отмену и извлечение в KitchenQueue (для сравнения - голый heapq '
+        'без учёта отмен: разница - цена ленивого удаления) '
+        'и раскладку по загрузкам печи.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500, help='Заказов в очереди (по умолчанию 500)')
+        parser.add_argument('--pizzas', type=int, default=20, help='Разных пицц в меню (по умолчанию 20)')
+        parser.add_argument('--cancel', type=float, default=0.1, help='Доля отменённых заказов (по умолчанию 0.1)')
+        parser.add_argument('--rounds', type=int, default=20, help='Повторов (по умолчанию 20)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        start = timezone.now()
+        timings = {'очередь': [], 'heapq': [], 'загрузки печи': []}
+        for _ in range(options['rounds']):
+            tickets = list(_stream(rng, options['orders'], options['pizzas'], start))
+            cancelled = [ticket.order_id for ticket in tickets if rng.random() < options['cancel']]
+
+            started = time.perf_counter()
+            queue = KitchenQueue()
+            for ticket in tickets:
+                queue.push(ticket)
+            for order_id in cancelled:
+                queue.discard(order_id)
+            queued = time.perf_counter()
+            planned = plan_batches(queue)
+            popping = time.perf_counter()
+            while queue.pop() is not None:
+                pass
+            timings['загрузки печи'].append(popping - queued)
+            timings['очередь'].append(queued - started + time.perf_counter() - popping)
+
+            started = time.perf_counter()
+            heap = [(ticket.promised_at, ticket.order_id, ticket) for ticket in tickets]
+            heapq.heapify(heap)
+            skip = set(cancelled)
+            while heap:
+                _, order_id, _ = heapq.heappop(heap)
+                if order_id in skip:
+                    continue
+            timings['heapq'].append(time.perf_counter() - started)
+
+        operations = options['orders'] * 2 + len(cancelled)
+        for label, values in timings.items():
+            median = statistics.median(values) * 1000
+            line = f'{label}: медиана {median:.2f} мс на {options["orders"]} заказов'
+            if label != 'загрузки печи':
+                line += f' ({median * 1000 / operations:.2f} мкс на операцию)'
+            self.stdout.write(line)
+        self.stdout.write(f'Загрузок печи в последнем прогоне: {len(planned)}')
@@ -0,0 +1,103 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from pizzeria.catalog import Catalog, ComboEntry, PizzaEntry, PromotionEntry
+from pizzeria.models import CartItem
+from pizzeria.pricing import SIZES, RuleSet, quote
+
+KINDS = ('percent', 'fixed', 'n_for_m', 'order_percent', 'order_fixed', 'free_delivery')
+
+
+def _catalog(rng, pizzas, combos, rules):
+    pizza_entries = [
+        PizzaEntry(i, f'Пицца {i}', f'pizza-{i}', '', '', Decimal(400 + i), Decimal(500 + i), Decimal(600 + i),
+                   i % 5 + 1, False, False, False, False, '', i)
+        for i in range(1, pizzas + 1)
+    ]
+    combo_entries = [
+        ComboEntry(i, f'Комбо {i}', '', Decimal(1200 + i), '', '', i, {})
+        for i in range(1, combos + 1)
+    ]
+    end_date = timezone.now() + timedelta(days=1)
+    promotions = []
+    for i in range(1, rules + 1):
+        kind = KINDS[i % len(KINDS)]
+        # Разные правила нацелены на всё меню, категорию, пиццу, размер или комбо
+        target = rng.choice(('all', 'category', 'pizza', 'size', 'combo'))
+        promotions.append(PromotionEntry(
+            i, f'Акция {i}', '', '', end_date, {}, kind,
+            'combo' if target == 'combo' else 'all',
+            rng.randint(1, 5) if target == 'category' else None,
+            rng.randint(1, pizzas) if target == 'pizza' else None,
+            rng.choice(SIZES) if target == 'size' else '',
+            rng.randint(1, combos) if target == 'combo' else None,
+            Decimal(rng.randint(5, 30)), 3, 2, Decimal(rng.randint(0, 3000)),
+        ))
+    return Catalog('bench', [], pizza_entries, combo_entries, promotions)
+
+
+def _cart(rng, lines, pizzas, combos):
+    items = []
+    for _ in range(lines):
+        if rng.random() < 0.8:
+            item = CartItem(item_type='pizza', pizza_id=rng.randint(1, pizzas), size=rng.choice(SIZES))
+        else:
+            item = CartItem(item_type='combo', combo_id=rng.randint(1, combos))
+        item.quantity = rng.randint(1, 5)
+        # Цены в корзине приходят из with_prices(); здесь - без БД
+        item.line_unit_price = Decimal(rng.randint(400, 1500))
+        items.append(item)
+    return items
+
+
+class Command(BaseCommand):
+    help = (
+        'Измерить расчёт корзины с акциями (pricing.quote) без БД: '
+        'синтетическое меню, N активных правил и корзина из M строк.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=50, help='Строк в корзине (по умолчанию 50)')
+        parser.add_argument('--rules', type=int, default=40, help='Активных акций (по умолчанию 40)')
+        parser.add_argument('--pizzas', type=int, default=60, help='Пицц в меню (по умолчанию 60)')
+        parser.add_argument('--combos', type=int, default=10, help='Комбо в меню (по умолчанию 10)')
+        parser.add_argument('--iterations', type=int, default=2000, help='Расчётов (по умолчанию 2000)')
+        parser.add_argument('--max-ms', type=float, default=None,
+                            help='Завершиться ошибкой, если p95 расчёта дольше, мс')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        catalog = _catalog(rng, options['pizzas'], options['combos'], options['rules'])
+
+        started = time.perf_counter()
+        rules = RuleSet.compile(catalog)
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        items = _cart(rng, options['lines'], options['pizzas'], options['combos'])
+        quote(items, rules)
+        timings = []
+        for _ in range(options['iterations']):
+            started = time.perf_counter()
+            result = quote(items, rules)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+        self.stdout.write(
+            f'Сборка правил: {compile_ms:.2f} мс ({options["rules"]} акций, '
+            f'{len(rules.pizza_rules)} пар пицца/размер и {len(rules.combo_rules)} комбо с правилами)'
+        )
+        self.stdout.write(
+            f'Расчёт корзины из {options["lines"]} строк: среднее {statistics.mean(timings):.3f} мс, '
+            f'медиана {statistics.median(timings):.3f} мс, p95 {p95:.3f} мс '
+            f'(скидка {result.discount_total} ₽ из {result.subtotal} ₽)'
+        )
+        if options['max_ms'] is not None and p95 > options['max_ms']:
+            raise CommandError(f'p95 {p95:.3f} мс больше {options["max_ms"]} мс')
@@ -0,0 +1,127 @@
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from pizzeria import maintenance
+from pizzeria.catalog import invalidate_catalog
+from pizzeria.models import Category, Order, Pizza
+
+ORDER_DATA = {
+    'name': 'Тест',
+    'phone': '+7 999 000-00-00',
+    'email': '',
+    'address': 'ул. Тестовая, 1',
+    'comment': '',
+    'payment_method': 'cash',
+}
+
+# Настройки соединения до и после: профиль по умолчанию и SQLITE_PRODUCTION
+PROFILES = (
+    ('по умолчанию', {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}}),
+    ('production', settings.SQLITE_PRODUCTION),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнить оформление заказов параллельными клиентами на SQLite с настройками '
+        'по умолчанию и с профилем production (WAL, PRAGMA, BEGIN IMMEDIATE, постоянные '
+        'соединения). Каждый клиент добавляет пиццы в корзину и оформляет заказ; '
+        'каждый профиль работает на своей временной базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=20,
+                            help='Число одновременных клиентов (по умолчанию 20)')
+        parser.add_argument('--orders', type=int, default=10,
+                            help='Заказов на клиента (по умолчанию 10)')
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        saved = {key: settings_dict.get(key) for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS', 'OPTIONS')}
+        saved_test_name = settings_dict.setdefault('TEST', {}).get('NAME')
+        setup_test_environment()
+        try:
+            for label, profile in PROFILES:
+                connection.close()
+                settings_dict.update(profile)
+                self._report(label, *self._run_profile(options['writers'], options['orders']))
+        finally:
+            connection.close()
+            settings_dict.update(saved)
+            settings_dict['TEST']['NAME'] = saved_test_name
+            teardown_test_environment()
+
+    def _run_profile(self, writers, orders):
+        fd, db_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        connection.settings_dict['TEST']['NAME'] = db_path
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            pizza_ids = self._fill_menu()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=writers) as pool:
+                results = list(pool.map(lambda number: self._writer(number, orders, pizza_ids), range(writers)))
+            elapsed = time.perf_counter() - started
+            placed = Order.objects.count()
+            journal_mode = maintenance.pragma(connection, 'journal_mode')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            for path in (db_path, db_path + '-wal', db_path + '-shm'):
+                if os.path.exists(path):
+                    os.remove(path)
+        return [latency for result in results for latency in result], elapsed, placed, journal_mode
+
+    def _fill_menu(self):
+        category = Category.objects.create(name='Пиццы', slug='bench-pizzas')
+        pizzas = Pizza.objects.bulk_create([
+            Pizza(name=f'Пицца {i}', slug=f'bench-pizza-{i}', description='', ingredients='',
+                  price_30=Decimal('500'), price_35=Decimal('600'), price_40=Decimal('700'),
+                  category=category, order=i)
+            for i in range(20)
+        ])
+        invalidate_catalog()
+        return [pizza.id for pizza in pizzas]
+
+    def _writer(self, number, orders, pizza_ids):
+        client = Client(headers={'X-Requested-With': 'XMLHttpRequest'})
+        latencies = []
+        for step in range(orders):
+            started = time.perf_counter()
+            failed = False
+            try:
+                for offset in range(2):
+                    client.post(reverse('add_to_cart'), {
+                        'item_type': 'pizza',
+                        'item_id': pizza_ids[(number + step + offset) % len(pizza_ids)],
+                        'size': '30',
+                    })
+                response = client.post(reverse('order'), ORDER_DATA)
+                failed = response.status_code != 302
+            except Exception:
+                # "database is locked" и прочие ошибки БД доходят до клиента исключением
+                failed = True
+            latencies.append((time.perf_counter() - started, failed))
+        connection.close()
+        return latencies
+
+    def _report(self, label, results, elapsed, placed, journal_mode):
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(failed for _, failed in results)
+        p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+        self.stdout.write(
+            f'{label} (journal_mode={journal_mode}): заказов {placed} из {len(latencies)} за {elapsed:.2f} с, '
+            f'{placed / elapsed:.1f} заказов/с, '
+            f'p50 {statistics.median(latencies) * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс, '
+            f'ошибок {errors}'
+        )
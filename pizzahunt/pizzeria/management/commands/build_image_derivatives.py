@@ -0,0 +1,55 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from pizzeria import images
+from pizzeria.catalog import bump_version
+
+
+class Command(BaseCommand):
+    help = (
+        'Построить уменьшенные копии (WebP/JPEG нескольких ширин) для всех изображений '
+        'комбо, акций и аватаров. Файлы обрабатываются параллельно.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 2,
+            help='Число параллельных обработчиков (по умолчанию - число ядер)',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать уже существующие копии',
+        )
+
+    def handle(self, *args, **options):
+        names = set()
+        for model, field in images.IMAGE_FIELDS:
+            names.update(
+                model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                .values_list(field, flat=True)
+            )
+
+        started = time.monotonic()
+        written = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {
+                pool.submit(images.build, name, default_storage, options['force']): name
+                for name in sorted(names)
+            }
+            for future in as_completed(futures):
+                try:
+                    written += len(future.result())
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {error}')
+
+        if written:
+            bump_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с: изображений {len(names)}, '
+            f'записано копий {written}, ошибок {failed}'
+        ))
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pizzeria.cleanup import collect
+
+
+class Command(BaseCommand):
+    help = (
+        'Удалить анонимные корзины с истёкшей сессией или без изменений дольше TTL, '
+        'затем истёкшие сессии и истёкшие корзины гостей в кеше. Удаление идёт порциями '
+        'в коротких транзакциях, поэтому команду можно запускать в рабочее время.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl-days', type=int, default=None,
+            help='Через сколько дней без изменений корзина считается брошенной '
+                 f'(по умолчанию CART_TTL_DAYS = {getattr(settings, "CART_TTL_DAYS", 30)})',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Сколько строк удалять за одну транзакцию (по умолчанию CART_GC_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=getattr(settings, 'CART_GC_PAUSE', 0.05),
+            help='Пауза между порциями в секундах, чтобы пропустить запись заказов',
+        )
+
+    def handle(self, *args, **options):
+        result = collect(
+            ttl_days=options['ttl_days'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            stdout=self.stdout if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {result['seconds']:.1f} с: удалено корзин {result['carts']}, "
+            f"строк корзин {result['cart_items']}, сессий {result['sessions']}, "
+            f"корзин в кеше {result['cached_carts']}"
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from pizzeria import maintenance
+
+
+class Command(BaseCommand):
+    help = (
+        'Обслуживание базы SQLite: ANALYZE, PRAGMA optimize, incremental VACUUM и '
+        'checkpoint журнала WAL. Команду можно запускать по расписанию в рабочее время, '
+        'кроме --enable-incremental-vacuum: полный VACUUM перезаписывает весь файл.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Псевдоним базы (по умолчанию default)')
+        parser.add_argument('--skip-analyze', action='store_true', help='Не выполнять ANALYZE')
+        parser.add_argument(
+            '--vacuum-pages', type=int, default=0,
+            help='Сколько свободных страниц вернуть за запуск (0 - все)',
+        )
+        parser.add_argument('--skip-vacuum', action='store_true', help='Не выполнять incremental_vacuum')
+        parser.add_argument(
+            '--enable-incremental-vacuum', action='store_true',
+            help='Перевести базу в auto_vacuum=INCREMENTAL полным VACUUM (один раз)',
+        )
+        parser.add_argument(
+            '--checkpoint', choices=maintenance.CHECKPOINT_MODES + ('NONE',), default='TRUNCATE',
+            help='Режим wal_checkpoint (по умолчанию TRUNCATE; NONE - не выполнять)',
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        try:
+            steps = maintenance.run(
+                connection,
+                analyze=not options['skip_analyze'],
+                vacuum_pages=None if options['skip_vacuum'] else options['vacuum_pages'],
+                enable_incremental=options['enable_incremental_vacuum'],
+                checkpoint=None if options['checkpoint'] == 'NONE' else options['checkpoint'],
+            )
+        except maintenance.MaintenanceError as error:
+            raise CommandError(str(error))
+
+        for name, result, seconds in steps:
+            self.stdout.write(f'{name}: {result} ({seconds * 1000:.0f} мс)')
+        info = maintenance.status(connection)
+        self.stdout.write(self.style.SUCCESS(
+            'Готово: ' + ', '.join(f'{name}={value}' for name, value in info.items())
+        ))
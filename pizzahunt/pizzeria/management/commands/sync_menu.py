@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pizzeria import menu_sync
+
+
+class Command(BaseCommand):
+    help = (
+        'Синхронизировать меню с файлом CSV или JSON: категории и пиццы сопоставляются '
+        'по slug, комбо - по названию. Сравниваются только поля, которые есть в файле. '
+        'Изменения применяются одной транзакцией через bulk_create/bulk_update, версия '
+        'каталога меняется один раз в конце.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл меню (.json или .csv)')
+        parser.add_argument(
+            '--format', choices=('json', 'csv'), default=None,
+            help='Формат файла (по умолчанию - по расширению)',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать изменения, ничего не записывая',
+        )
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Удалить строки разделов файла, которых в файле нет. '
+                 'Удаление пиццы удаляет её и из корзин',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            data = menu_sync.load(options['path'], options['format'])
+            diff = menu_sync.plan(data, delete=options['delete'])
+        except (OSError, menu_sync.MenuSyncError) as error:
+            raise CommandError(str(error))
+
+        if options['dry_run'] or options['verbosity'] > 1:
+            for line in diff.report():
+                self.stdout.write(line)
+        if not diff:
+            self.stdout.write(self.style.SUCCESS('Меню уже совпадает с файлом'))
+            return
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Пробный запуск: изменения не записаны'))
+            return
+
+        counts = menu_sync.apply(diff)
+        summary = ', '.join(
+            f'{name}: +{created} ~{updated} -{deleted}'
+            for name, (created, updated, deleted) in counts.items()
+        )
+        self.stdout.write(self.style.SUCCESS(f'Готово за {time.monotonic() - started:.2f} с ({summary})'))
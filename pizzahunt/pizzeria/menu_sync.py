@@ -0,0 +1,272 @@
+"""Массовая синхронизация меню из файла (команда sync_menu).
+
+Файл описывает категории, пиццы и комбо. Строки сопоставляются с базой
+по ключу: slug у категорий и пицц, название у комбо (своего slug у
+комбо нет). Сравниваются только поля, которые есть в файле, поэтому
+для смены цен достаточно CSV из колонок slug,price_30,price_35,price_40.
+
+plan() строит разницу без записи в БД, apply() применяет её одной
+транзакцией через bulk_create/bulk_update и меняет версию каталога
+один раз в конце, а не на каждую строку.
+
+Форматы:
+
+- JSON: {"categories": [...], "pizzas": [...], "combos": [...]};
+  отсутствующий раздел не трогается;
+- CSV: только пиццы, строка на пиццу, категория - по slug в колонке
+  category.
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .catalog import batch_changes
+from .models import Category, Combo, Pizza
+
+
+class MenuSyncError(Exception):
+    """Файл меню не может быть применён"""
+
+
+@dataclass(frozen=True)
+class Section:
+    name: str
+    model: type
+    key: str
+    fields: tuple
+    required: tuple
+
+
+SECTIONS = (
+    Section('categories', Category, 'slug', ('name', 'description', 'order'), ('name',)),
+    Section(
+        'pizzas', Pizza, 'slug',
+        ('name', 'description', 'ingredients', 'price_30', 'price_35', 'price_40', 'category',
+         'is_popular', 'is_new', 'is_spicy', 'is_vegetarian', 'image_url', 'order'),
+        ('name', 'description', 'ingredients', 'price_30', 'price_35', 'price_40', 'category'),
+    ),
+    Section('combos', Combo, 'name', ('description', 'price', 'includes', 'order'),
+            ('description', 'price', 'includes')),
+)
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'да', '+'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'нет', '-', ''}
+
+
+@dataclass
+class SectionDiff:
+    section: Section
+    created: list = field(default_factory=list)
+    # (объект, {поле: (было, стало)})
+    updated: list = field(default_factory=list)
+    deleted: list = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.created or self.updated or self.deleted)
+
+
+@dataclass
+class MenuDiff:
+    sections: list
+    category_slugs: object = None
+
+    def __bool__(self):
+        return any(self.sections)
+
+    def counts(self):
+        return {
+            diff.section.name: (len(diff.created), len(diff.updated), len(diff.deleted))
+            for diff in self.sections
+        }
+
+    def report(self):
+        """Строки отчёта для --dry-run"""
+        lines = []
+        for diff in self.sections:
+            label = diff.section.name
+            for instance in diff.created:
+                lines.append(f'+ {label} {getattr(instance, diff.section.key)}')
+            for instance, changes in diff.updated:
+                details = ', '.join(f'{name}: {old} -> {new}' for name, (old, new) in changes.items())
+                lines.append(f'~ {label} {getattr(instance, diff.section.key)}: {details}')
+            for instance in diff.deleted:
+                lines.append(f'- {label} {getattr(instance, diff.section.key)}')
+        return lines
+
+
+def load(path, fmt=None):
+    """Прочитать файл меню в словарь разделов"""
+    fmt = fmt or ('csv' if str(path).lower().endswith('.csv') else 'json')
+    with open(path, encoding='utf-8-sig', newline='') as menu_file:
+        if fmt == 'csv':
+            return {'pizzas': [dict(row) for row in csv.DictReader(menu_file)]}
+        try:
+            data = json.load(menu_file)
+        except ValueError as error:
+            raise MenuSyncError(f'Некорректный JSON: {error}')
+    if not isinstance(data, dict):
+        raise MenuSyncError('Ожидается объект с разделами categories, pizzas, combos')
+    return data
+
+
+def _convert(model, name, value):
+    model_field = model._meta.get_field(name)
+    if model_field.get_internal_type() == 'BooleanField' and not isinstance(value, bool):
+        normalized = str(value).strip().lower()
+        if normalized in TRUE_VALUES:
+            return True
+        if normalized in FALSE_VALUES:
+            return False
+        raise MenuSyncError(f'{model.__name__}.{name}: не логическое значение {value!r}')
+    try:
+        return model_field.to_python(value.strip() if isinstance(value, str) else value)
+    except ValidationError as error:
+        raise MenuSyncError(f'{model.__name__}.{name}: {"; ".join(error.messages)}')
+
+
+def _plan_section(section, rows, delete, category_slugs):
+    diff = SectionDiff(section)
+    if rows is None:
+        return diff
+    if not isinstance(rows, list):
+        raise MenuSyncError(f'Раздел {section.name} должен быть списком')
+
+    model = section.model
+    existing = {getattr(instance, section.key): instance for instance in model.objects.all()}
+    seen = set()
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict) or not row.get(section.key):
+            raise MenuSyncError(f'{section.name}, строка {number}: нет ключа {section.key}')
+        key = str(row[section.key]).strip()
+        if key in seen:
+            raise MenuSyncError(f'{section.name}: ключ {key} встречается дважды')
+        seen.add(key)
+
+        values = {}
+        for name in section.fields:
+            if name not in row:
+                continue
+            if name == 'category':
+                slug = str(row[name]).strip()
+                if slug not in category_slugs:
+                    raise MenuSyncError(f'{section.name} {key}: нет категории {slug}')
+                values[name] = slug
+            else:
+                values[name] = _convert(model, name, row[name])
+
+        instance = existing.get(key)
+        if instance is None:
+            missing = [name for name in section.required if name not in values]
+            if missing:
+                raise MenuSyncError(f'{section.name} {key}: для новой строки нужны поля {", ".join(missing)}')
+            instance = model(**{section.key: key})
+            instance._sync_values = values
+            diff.created.append(instance)
+            continue
+
+        changes = {}
+        for name, value in values.items():
+            current = category_slugs.current(instance.category_id) if name == 'category' else getattr(instance, name)
+            if current != value:
+                changes[name] = (current, value)
+        if changes:
+            instance._sync_values = {name: new for name, (_, new) in changes.items()}
+            diff.updated.append((instance, changes))
+
+    if delete:
+        diff.deleted = [instance for key, instance in existing.items() if key not in seen]
+    return diff
+
+
+class _CategorySlugs:
+    """Slug категорий: существующие и из файла; id новых известны после вставки"""
+
+    def __init__(self, file_rows, delete):
+        self.by_id = dict(Category.objects.values_list('id', 'slug'))
+        self.ids = {slug: pk for pk, slug in self.by_id.items()}
+        file_slugs = {str(row.get('slug', '')).strip() for row in file_rows or () if isinstance(row, dict)}
+        if delete and file_rows is not None:
+            self.available = file_slugs
+        else:
+            self.available = set(self.ids) | file_slugs
+
+    def __contains__(self, slug):
+        return slug in self.available
+
+    def current(self, category_id):
+        return self.by_id.get(category_id)
+
+
+def plan(data, delete=False):
+    """Разница между файлом и базой; в БД ничего не пишется"""
+    category_slugs = _CategorySlugs(data.get('categories'), delete)
+    sections = [
+        _plan_section(section, data.get(section.name), delete, category_slugs)
+        for section in SECTIONS
+    ]
+    diff = MenuDiff(sections, category_slugs)
+    _check_orphans(*sections[:2])
+    for section_diff in sections:
+        for instance in section_diff.created + [instance for instance, _ in section_diff.updated]:
+            _assign(instance, category_slugs, resolve=False)
+            exclude = ['category', 'image'] if section_diff.section.model is not Category else []
+            try:
+                instance.clean_fields(exclude=exclude)
+            except ValidationError as error:
+                key = getattr(instance, section_diff.section.key)
+                raise MenuSyncError(f'{section_diff.section.name} {key}: {"; ".join(error.messages)}')
+    return diff
+
+
+def _check_orphans(categories, pizzas):
+    # Удаление категории каскадом удалило бы пиццы, которых нет в файле
+    deleted = {instance.pk for instance in categories.deleted}
+    if not deleted:
+        return
+    kept = Pizza.objects.filter(category_id__in=deleted).exclude(
+        pk__in={instance.pk for instance in pizzas.deleted}
+        | {instance.pk for instance, changes in pizzas.updated if 'category' in changes}
+    )
+    names = list(kept.values_list('slug', flat=True)[:5])
+    if names:
+        raise MenuSyncError(f'Удаляемые категории ещё используются пиццами: {", ".join(names)}')
+
+
+def _assign(instance, category_slugs, resolve=True):
+    for name, value in instance._sync_values.items():
+        if name == 'category':
+            if resolve:
+                instance.category_id = category_slugs.ids[value]
+        else:
+            setattr(instance, name, value)
+
+
+def apply(diff):
+    """Применить разницу одной транзакцией; версия каталога меняется один раз"""
+    category_slugs = diff.category_slugs
+    with batch_changes(), transaction.atomic():
+        for section_diff in reversed(diff.sections):
+            # Сначала удаления (пиццы раньше категорий), затем вставки и
+            # обновления в прямом порядке: новым пиццам нужны id категорий
+            if section_diff.deleted:
+                section_diff.section.model.objects.filter(
+                    pk__in=[instance.pk for instance in section_diff.deleted]
+                ).delete()
+        for section_diff in diff.sections:
+            model = section_diff.section.model
+            if section_diff.created:
+                for instance in section_diff.created:
+                    _assign(instance, category_slugs)
+                model.objects.bulk_create(section_diff.created)
+                if model is Category:
+                    category_slugs.ids.update((instance.slug, instance.pk) for instance in section_diff.created)
+            if section_diff.updated:
+                changed = set()
+                for instance, changes in section_diff.updated:
+                    _assign(instance, category_slugs)
+                    changed.update(changes)
+                model.objects.bulk_update([instance for instance, _ in section_diff.updated], sorted(changed))
+    return diff.counts()
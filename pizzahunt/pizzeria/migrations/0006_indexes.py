@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-18 13:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0005_userprofile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['session_key'], name='cart_session_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pizza',
+            index=models.Index(condition=models.Q(('is_popular', True)), fields=['order', 'name'], name='pizza_popular_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pizza',
+            index=models.Index(condition=models.Q(('is_new', True)), fields=['order', 'name'], name='pizza_new_order_idx'),
+        ),
+        # Новые пользователи за день в админ-панели: auth_user не наша модель,
+        # поэтому индекс по date_joined создаётся вручную
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS auth_user_date_joined_idx ON auth_user (date_joined);',
+            'DROP INDEX IF EXISTS auth_user_date_joined_idx;',
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0006_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('item_type', models.CharField(max_length=10, verbose_name='Тип товара')),
+                ('item_name', models.CharField(max_length=200, verbose_name='Название товара')),
+                ('size', models.CharField(blank=True, max_length=10, verbose_name='Размер')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Количество')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Выручка')),
+            ],
+            options={
+                'verbose_name': 'Продажи товара за день',
+                'verbose_name_plural': 'Продажи товаров по дням',
+                'ordering': ['-day'],
+                'unique_together': {('day', 'item_type', 'item_name', 'size')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Час'), ('day', 'День')], max_length=4, verbose_name='Период')),
+                ('period_start', models.DateTimeField(verbose_name='Начало периода')),
+                ('status', models.CharField(choices=[('new', 'Новый'), ('confirmed', 'Подтвержден'), ('preparing', 'Готовится'), ('delivering', 'Доставляется'), ('completed', 'Завершен'), ('cancelled', 'Отменен')], max_length=20, verbose_name='Статус')),
+                ('payment_method', models.CharField(choices=[('cash', 'Наличными при получении'), ('card_online', 'Картой онлайн'), ('card_courier', 'Картой курьеру')], max_length=20, verbose_name='Способ оплаты')),
+                ('orders_count', models.IntegerField(default=0, verbose_name='Заказов')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Выручка')),
+            ],
+            options={
+                'verbose_name': 'Сводка продаж',
+                'verbose_name_plural': 'Сводки продаж',
+                'ordering': ['-period_start'],
+                'unique_together': {('granularity', 'period_start', 'status', 'payment_method')},
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:48
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0008_order_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promotion',
+            name='buy_quantity',
+            field=models.PositiveSmallIntegerField(default=2, verbose_name='N (берёте)'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='pizzeria.category', verbose_name='Категория пицц'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='combo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='pizzeria.combo', verbose_name='Комбо'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='kind',
+            field=models.CharField(choices=[('banner', 'Только баннер'), ('percent', 'Скидка в процентах на товары'), ('fixed', 'Скидка в рублях на каждый товар'), ('n_for_m', 'N товаров по цене M'), ('order_percent', 'Скидка в процентах на заказ'), ('order_fixed', 'Скидка в рублях на заказ'), ('free_delivery', 'Бесплатная доставка')], default='banner', max_length=20, verbose_name='Тип акции'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='min_subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Минимальная сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='pay_quantity',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='M (платите)'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='pizza',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='pizzeria.pizza', verbose_name='Пицца'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='size',
+            field=models.CharField(blank=True, choices=[('30', '30 см'), ('35', '35 см'), ('40', '40 см')], max_length=10, verbose_name='Размер пиццы'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='target',
+            field=models.CharField(choices=[('all', 'Все товары'), ('pizza', 'Пиццы'), ('combo', 'Комбо')], default='all', max_length=10, verbose_name='Товары'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='value',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Размер скидки'),
+        ),
+    ]
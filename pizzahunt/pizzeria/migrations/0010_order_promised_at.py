@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0009_promotion_rules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='promised_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Обещан к'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0010_order_promised_at'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='promotion',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('kind', 'n_for_m'), _negated=True), models.Q(('buy_quantity__gt', models.F('pay_quantity')), ('pay_quantity__gte', 0)), _connector='OR'), name='promotion_n_for_m_quantities'),
+        ),
+    ]
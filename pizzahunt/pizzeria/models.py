@@ -1,5 +1,10 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Case, When, F, Value, ExpressionWrapper
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
@@ -20,6 +25,11 @@ class UserProfile(models.Model):
     
     def __str__(self):
         return f"Профиль {self.user.username}"
+    
+    @property
+    def avatar_srcset(self):
+        from .images import srcsets
+        return srcsets(self.avatar.name if self.avatar else '')
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -71,6 +81,10 @@ class Pizza(models.Model):
         verbose_name = "Пицца"
         verbose_name_plural = "Пиццы"
         ordering = ['order', 'name']
+        indexes = [
+            models.Index(fields=['order', 'name'], condition=models.Q(is_popular=True), name='pizza_popular_order_idx'),
+            models.Index(fields=['order', 'name'], condition=models.Q(is_new=True), name='pizza_new_order_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -84,6 +98,35 @@ class Pizza(models.Model):
             return self.price_40
         return self.price_30
 
+FREE_DELIVERY_THRESHOLD = Decimal('1000')
+DELIVERY_FEE = Decimal('200')
+
+class CartSummary:
+    """Итоги корзины, посчитанные по одной выборке строк с ценами.
+    
+    Суммы, скидки и доставку считает pricing.quote(); total_price - сумма
+    товаров после скидок, без доставки.
+    """
+    
+    def __init__(self, lines, rules=None):
+        from .pricing import quote
+        self.lines = list(lines)
+        self.quote = quote(self.lines, rules)
+        self.total_quantity = self.quote.total_quantity
+        self.subtotal = self.quote.subtotal
+        self.discounts = self.quote.discounts
+        self.discount_total = self.quote.discount_total
+        self.total_price = self.quote.total_price
+        self.delivery_fee = self.quote.delivery_fee
+        self.grand_total = self.quote.grand_total
+    
+    def get_line(self, item_id):
+        """Строка расчёта (pricing.QuoteLine) для позиции корзины"""
+        for line in self.quote.lines:
+            if str(line.item.id) == str(item_id):
+                return line
+        return None
+
 class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Пользователь")
     session_key = models.CharField(max_length=40, null=True, blank=True, verbose_name="Ключ сессии")
@@ -93,17 +136,53 @@ class Cart(models.Model):
     class Meta:
         verbose_name = "Корзина"
         verbose_name_plural = "Корзины"
+        indexes = [
+            models.Index(fields=['session_key'], name='cart_session_key_idx'),
+        ]
     
     def __str__(self):
         if self.user:
             return f"Корзина пользователя {self.user.username}"
         return f"Корзина (сессия: {self.session_key})"
     
+    def summary(self):
+        """Итоги корзины; считаются одним запросом и запоминаются на объекте"""
+        cached = getattr(self, '_summary', None)
+        if cached is None:
+            if self.pk is None:
+                # Несохранённая корзина из peek_cart() всегда пуста
+                cached = CartSummary([])
+            else:
+                cached = CartSummary(self.items.with_prices().order_by('added_at', 'id'))
+            self._summary = cached
+        return cached
+    
+    async def asummary(self):
+        """Асинхронный вариант summary()"""
+        from asgiref.sync import sync_to_async
+        from .pricing import get_rules
+        cached = getattr(self, '_summary', None)
+        if cached is None:
+            # Правила акций могут потребовать перестройки снимка каталога из БД
+            rules = await sync_to_async(get_rules)()
+            if self.pk is None:
+                cached = CartSummary([], rules)
+            else:
+                cached = CartSummary([
+                    line async for line in self.items.with_prices().order_by('added_at', 'id')
+                ], rules)
+            self._summary = cached
+        return cached
+    
+    def invalidate_summary(self):
+        """Сбросить запомненные итоги после изменения состава корзины"""
+        self._summary = None
+    
     def total_price(self):
-        return sum(item.total_price() for item in self.items.all())
+        return self.summary().total_price
     
     def total_quantity(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.summary().total_quantity
 
 
 class Order(models.Model):
@@ -129,11 +208,18 @@ class Order(models.Model):
     comment = models.TextField(blank=True, verbose_name="Комментарий к заказу")
     
     cart = models.ForeignKey(Cart, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Корзина")
+    # Отдельный индекс по user не нужен: его заменяет order_user_created_idx
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='orders', db_index=False, verbose_name="Пользователь")
     total_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Общая сумма")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='new', verbose_name="Статус")
     payment_method = models.CharField(max_length=20, choices=PAYMENT_CHOICES, default='cash', verbose_name="Способ оплаты")
     payment_status = models.BooleanField(default=False, verbose_name="Оплачен")
     
+    # Когда заказ обещан клиенту; по нему кухня выбирает, что готовить дальше.
+    # Для заказов без него - время создания плюс KITCHEN_PROMISE_MINUTES
+    promised_at = models.DateTimeField(null=True, blank=True, verbose_name="Обещан к")
+    
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
     
@@ -141,9 +227,70 @@ class Order(models.Model):
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"Заказ #{self.id} - {self.name} ({self.get_status_display()})"
+    
+    ROLLUP_FIELDS = ('status', 'payment_method', 'total_price', 'created_at')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем загруженные значения, чтобы сводки продаж могли
+        # перенести заказ из старой группы в новую при сохранении
+        loaded = dict(zip(field_names, values))
+        if all(field in loaded for field in cls.ROLLUP_FIELDS):
+            instance._loaded_rollup_state = instance.rollup_state()
+        return instance
+    
+    def rollup_state(self):
+        return tuple(getattr(self, field) for field in self.ROLLUP_FIELDS)
+
+class SalesRollup(models.Model):
+    """Количество заказов и выручка за час или день по статусу и способу оплаты"""
+    GRANULARITY_CHOICES = [
+        ('hour', 'Час'),
+        ('day', 'День'),
+    ]
+    
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES, verbose_name="Период")
+    period_start = models.DateTimeField(verbose_name="Начало периода")
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name="Статус")
+    payment_method = models.CharField(max_length=20, choices=Order.PAYMENT_CHOICES, verbose_name="Способ оплаты")
+    orders_count = models.IntegerField(default=0, verbose_name="Заказов")
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Выручка")
+    
+    class Meta:
+        verbose_name = "Сводка продаж"
+        verbose_name_plural = "Сводки продаж"
+        ordering = ['-period_start']
+        unique_together = [['granularity', 'period_start', 'status', 'payment_method']]
+    
+    def __str__(self):
+        return f"{self.get_granularity_display()} {self.period_start:%d.%m.%Y %H:%M} - {self.orders_count} заказов"
+
+class ItemSalesRollup(models.Model):
+    """Проданное количество товара за день"""
+    day = models.DateField(verbose_name="День")
+    item_type = models.CharField(max_length=10, verbose_name="Тип товара")
+    item_name = models.CharField(max_length=200, verbose_name="Название товара")
+    size = models.CharField(max_length=10, blank=True, verbose_name="Размер")
+    quantity = models.IntegerField(default=0, verbose_name="Количество")
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Выручка")
+    
+    class Meta:
+        verbose_name = "Продажи товара за день"
+        verbose_name_plural = "Продажи товаров по дням"
+        ordering = ['-day']
+        unique_together = [['day', 'item_type', 'item_name', 'size']]
+    
+    def __str__(self):
+        return f"{self.day:%d.%m.%Y} {self.item_name} - {self.quantity} шт."
 
 class OrderItem(models.Model):
     ITEM_TYPE_CHOICES = [
@@ -184,6 +331,12 @@ class Combo(models.Model):
             return self.image.url
         return None
     
+    @property
+    def image_srcset(self):
+        """srcset уменьшенных копий по форматам: {'webp': ..., 'jpeg': ...}"""
+        from .images import srcsets
+        return srcsets(self.image.name)
+    
     class Meta:
         verbose_name = "Комбо"
         verbose_name_plural = "Комбо"
@@ -192,6 +345,26 @@ class Combo(models.Model):
     def __str__(self):
         return self.name
 
+class CartItemQuerySet(models.QuerySet):
+    def with_prices(self):
+        """Подтянуть товары и посчитать цену строки на стороне БД с учётом размера"""
+        price_field = models.DecimalField(max_digits=8, decimal_places=2)
+        unit_price = Case(
+            When(item_type='pizza', size='35', then=F('pizza__price_35')),
+            When(item_type='pizza', size='40', then=F('pizza__price_40')),
+            When(item_type='pizza', then=F('pizza__price_30')),
+            When(item_type='combo', then=F('combo__price')),
+            output_field=price_field,
+        )
+        return self.select_related('pizza', 'combo').annotate(
+            line_unit_price=Coalesce(unit_price, Value(Decimal('0')), output_field=price_field),
+        ).annotate(
+            line_total_price=ExpressionWrapper(
+                F('line_unit_price') * F('quantity'),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
+
 class CartItem(models.Model):
     ITEM_TYPE_CHOICES = [
         ('pizza', 'Пицца'),
@@ -209,6 +382,8 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)], verbose_name="Количество")
     added_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата добавления")
     
+    objects = CartItemQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Элемент корзины"
         verbose_name_plural = "Элементы корзины"
@@ -224,35 +399,74 @@ class CartItem(models.Model):
             return f"{self.combo.name} - {self.quantity} шт."
         return "Неизвестный товар"
     
+    def get_product(self):
+        """Пицца или комбо строки.
+        
+        Если товар не подтянут запросом, он берётся из снимка каталога,
+        а не отдельным запросом к БД.
+        """
+        if self.item_type == 'pizza':
+            if self.pizza_id is None or CartItem.pizza.is_cached(self):
+                return self.pizza
+            from .catalog import get_catalog
+            return get_catalog().get_pizza(self.pizza_id)
+        elif self.item_type == 'combo':
+            if self.combo_id is None or CartItem.combo.is_cached(self):
+                return self.combo
+            from .catalog import get_catalog
+            return get_catalog().get_combo(self.combo_id)
+        return None
+    
     def get_name(self):
         """Получить название товара"""
-        if self.item_type == 'pizza' and self.pizza:
-            return self.pizza.name
-        elif self.item_type == 'combo' and self.combo:
-            return self.combo.name
+        product = self.get_product()
+        if product:
+            return product.name
         return "Неизвестный товар"
     
     def get_image_url(self):
         """Получить URL изображения"""
-        if self.item_type == 'pizza' and self.pizza and self.pizza.image_url:
-            return self.pizza.image_url
-        elif self.item_type == 'combo' and self.combo and self.combo.image_url:
-            return self.combo.image_url
+        product = self.get_product()
+        if product and product.image_url:
+            return product.image_url
         return None
     
     def unit_price(self):
         """Получить цену за единицу"""
-        if self.item_type == 'pizza' and self.pizza:
-            return self.pizza.get_price_by_size(self.size)
-        elif self.item_type == 'combo' and self.combo:
-            return self.combo.price
+        if hasattr(self, 'line_unit_price'):
+            return self.line_unit_price
+        product = self.get_product()
+        if self.item_type == 'pizza' and product:
+            return product.get_price_by_size(self.size)
+        elif self.item_type == 'combo' and product:
+            return product.price
         return 0
     
     def total_price(self):
         """Получить общую цену"""
+        if hasattr(self, 'line_total_price'):
+            return self.line_total_price
         return self.unit_price() * self.quantity
 
 class Promotion(models.Model):
+    KIND_CHOICES = [
+        ('banner', 'Только баннер'),
+        ('percent', 'Скидка в процентах на товары'),
+        ('fixed', 'Скидка в рублях на каждый товар'),
+        ('n_for_m', 'N товаров по цене M'),
+        ('order_percent', 'Скидка в процентах на заказ'),
+        ('order_fixed', 'Скидка в рублях на заказ'),
+        ('free_delivery', 'Бесплатная доставка'),
+    ]
+    LINE_KINDS = ('percent', 'fixed', 'n_for_m')
+    ORDER_KINDS = ('order_percent', 'order_fixed')
+    
+    TARGET_CHOICES = [
+        ('all', 'Все товары'),
+        ('pizza', 'Пиццы'),
+        ('combo', 'Комбо'),
+    ]
+    
     title = models.CharField(max_length=200, verbose_name="Заголовок")
     description = models.TextField(verbose_name="Описание")
     image = models.ImageField(upload_to='promotions/', verbose_name="Изображение")
@@ -260,10 +474,52 @@ class Promotion(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="Активна")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='banner', verbose_name="Тип акции")
+    target = models.CharField(max_length=10, choices=TARGET_CHOICES, default='all', verbose_name="Товары")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='promotions', verbose_name="Категория пицц")
+    pizza = models.ForeignKey(Pizza, on_delete=models.CASCADE, null=True, blank=True, related_name='promotions', verbose_name="Пицца")
+    size = models.CharField(max_length=10, choices=Pizza.SIZE_CHOICES, blank=True, verbose_name="Размер пиццы")
+    combo = models.ForeignKey(Combo, on_delete=models.CASCADE, null=True, blank=True, related_name='promotions', verbose_name="Комбо")
+    value = models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[MinValueValidator(0)], verbose_name="Размер скидки")
+    buy_quantity = models.PositiveSmallIntegerField(default=2, verbose_name="N (берёте)")
+    pay_quantity = models.PositiveSmallIntegerField(default=1, verbose_name="M (платите)")
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[MinValueValidator(0)], verbose_name="Минимальная сумма заказа")
+    
+    def clean(self):
+        errors = {}
+        if self.kind in ('percent', 'order_percent') and not 0 < self.value <= 100:
+            errors['value'] = 'Процент скидки должен быть от 0 до 100'
+        elif self.kind in ('fixed', 'order_fixed') and self.value <= 0:
+            errors['value'] = 'Укажите размер скидки'
+        if self.kind == 'n_for_m' and not 0 < self.pay_quantity < self.buy_quantity:
+            errors['pay_quantity'] = 'M должно быть больше нуля и меньше N'
+        if self.kind in self.LINE_KINDS:
+            pizza_filters = self.category_id or self.pizza_id or self.size
+            if pizza_filters and (self.target == 'combo' or self.combo_id):
+                errors['target'] = 'Категория, пицца и размер ограничивают только пиццы'
+            elif self.combo_id and self.target == 'pizza':
+                errors['combo'] = 'Комбо нельзя выбрать для акции на пиццы'
+        if errors:
+            raise ValidationError(errors)
+    
+    @property
+    def image_srcset(self):
+        from .images import srcsets
+        return srcsets(self.image.name)
+    
     class Meta:
         verbose_name = "Акция"
         verbose_name_plural = "Акции"
         ordering = ['-created_at']
+        constraints = [
+            models.CheckConstraint(
+                # N > M >= 0, а значит и N > 0: иначе расчёт скидки делит на ноль
+                condition=~models.Q(kind='n_for_m') | models.Q(
+                    buy_quantity__gt=models.F('pay_quantity'), pay_quantity__gte=0,
+                ),
+                name='promotion_n_for_m_quantities',
+            ),
+        ]
     
     def __str__(self):
         return self.title
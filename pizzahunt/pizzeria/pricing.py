@@ -0,0 +1,254 @@
+"""Расчёт стоимости корзины с учётом акций.
+
+Активные акции из снимка каталога собираются в RuleSet: для каждой пиццы
+каждого размера и для каждого комбо заранее известен список подходящих
+правил, заказные скидки и порог бесплатной доставки тоже считаются один
+раз. Набор правил пересобирается, только когда меняется снимок каталога
+(а значит, и акции) или истекает срок одной из акций.
+
+quote() проходит по строкам корзины один раз:
+
+- на строку действует самая выгодная из подходящих скидок
+  (percent, fixed, n_for_m), скидки на строку не суммируются;
+- на сумму после скидок на строки - самая выгодная заказная скидка
+  (order_percent, order_fixed), если сумма не меньше min_subtotal;
+- доставка бесплатна при сумме товаров после скидок больше
+  FREE_DELIVERY_THRESHOLD или не меньше порога акции free_delivery.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NamedTuple
+
+from django.utils import timezone
+
+from .catalog import get_catalog
+from .models import DELIVERY_FEE, FREE_DELIVERY_THRESHOLD, Pizza, Promotion
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0')
+SIZES = tuple(size for size, _ in Pizza.SIZE_CHOICES)
+
+
+def _money(amount):
+    return amount.quantize(CENT, ROUND_HALF_UP)
+
+
+class Rule(NamedTuple):
+    promotion_id: int
+    title: str
+    kind: str
+    # Для процентных скидок - доля (0.15), для остальных - рубли
+    value: Decimal
+    buy: int
+    pay: int
+    min_subtotal: Decimal
+
+    @classmethod
+    def from_entry(cls, entry):
+        value = Decimal(entry.value)
+        if entry.kind in ('percent', 'order_percent'):
+            value = value / 100
+        return cls(entry.id, entry.title, entry.kind, value, entry.buy_quantity, entry.pay_quantity,
+                   Decimal(entry.min_subtotal))
+
+    def line_discount(self, unit_price, quantity):
+        if self.kind == 'percent':
+            return _money(unit_price * quantity * self.value)
+        if self.kind == 'fixed':
+            return min(self.value, unit_price) * quantity
+        return quantity // self.buy * (self.buy - self.pay) * unit_price
+
+    def order_discount(self, amount):
+        if self.kind == 'order_percent':
+            return _money(amount * self.value)
+        return min(self.value, amount)
+
+
+def _is_valid(entry):
+    # Некорректное правило (N по цене M с N <= M) пропускается, а не
+    # ломает расчёт всех корзин: clean() проверяет только формы
+    return entry.kind != 'n_for_m' or 0 <= entry.pay_quantity < entry.buy_quantity
+
+
+def _pizza_matches(entry, pizza, size):
+    if entry.target == 'combo' or entry.combo_id:
+        return False
+    return (
+        (not entry.category_id or entry.category_id == pizza.category_id)
+        and (not entry.pizza_id or entry.pizza_id == pizza.id)
+        and (not entry.size or entry.size == size)
+    )
+
+
+def _combo_matches(entry, combo):
+    if entry.target == 'pizza' or entry.category_id or entry.pizza_id or entry.size:
+        return False
+    return not entry.combo_id or entry.combo_id == combo.id
+
+
+def _strongest(rules):
+    """Из правил одного вида для товара достаточно самого выгодного.
+
+    Процент и фиксированная скидка растут со значением, у N по цене M
+    выгода зависит только от N и M, поэтому на строку остаётся не больше
+    нескольких правил, сколько бы акций ни было включено.
+    """
+    best = {}
+    for rule in rules:
+        key = (rule.kind, rule.buy, rule.pay) if rule.kind == 'n_for_m' else rule.kind
+        if key not in best or rule.value > best[key].value:
+            best[key] = rule
+    return tuple(best.values())
+
+
+class RuleSet:
+    """Правила акций одного снимка каталога, разложенные по товарам"""
+
+    __slots__ = ('catalog', 'expires_at', 'pizza_rules', 'combo_rules', 'order_rules', 'free_delivery_from')
+
+    def __init__(self, catalog, expires_at, pizza_rules, combo_rules, order_rules, free_delivery_from):
+        self.catalog = catalog
+        self.expires_at = expires_at
+        self.pizza_rules = pizza_rules
+        self.combo_rules = combo_rules
+        self.order_rules = order_rules
+        self.free_delivery_from = free_delivery_from
+
+    @classmethod
+    def compile(cls, catalog, now=None):
+        now = now or timezone.now()
+        entries = [
+            entry for entry in catalog.promotions
+            if entry.kind != 'banner' and (entry.end_date is None or entry.end_date > now) and _is_valid(entry)
+        ]
+        line_entries = [(entry, Rule.from_entry(entry)) for entry in entries if entry.kind in Promotion.LINE_KINDS]
+
+        pizza_rules = {}
+        for pizza in catalog.pizzas:
+            for size in SIZES:
+                rules = _strongest(rule for e, rule in line_entries if _pizza_matches(e, pizza, size))
+                if rules:
+                    pizza_rules[pizza.id, size] = rules
+        combo_rules = {}
+        for combo in catalog.combos:
+            rules = _strongest(rule for e, rule in line_entries if _combo_matches(e, combo))
+            if rules:
+                combo_rules[combo.id] = rules
+
+        order_rules = tuple(Rule.from_entry(e) for e in entries if e.kind in Promotion.ORDER_KINDS)
+        thresholds = [Decimal(e.min_subtotal) for e in entries if e.kind == 'free_delivery']
+        end_dates = [e.end_date for e in entries if e.end_date is not None]
+        return cls(
+            catalog, min(end_dates, default=None), pizza_rules, combo_rules, order_rules,
+            min(thresholds, default=None),
+        )
+
+    def is_fresh(self, catalog, now):
+        return self.catalog is catalog and (self.expires_at is None or now < self.expires_at)
+
+    def free_delivery(self, amount):
+        if amount > FREE_DELIVERY_THRESHOLD:
+            return True
+        return self.free_delivery_from is not None and amount >= self.free_delivery_from
+
+
+_compiled = None
+
+
+def get_rules():
+    """Правила текущего снимка каталога; собираются заново только при его смене"""
+    global _compiled
+    catalog = get_catalog()
+    rules = _compiled
+    if rules is None or not rules.is_fresh(catalog, timezone.now()):
+        rules = _compiled = RuleSet.compile(catalog)
+    return rules
+
+
+class QuoteLine(NamedTuple):
+    item: object
+    unit_price: Decimal
+    quantity: int
+    subtotal: Decimal
+    discount: Decimal
+    total: Decimal
+    promotion: str
+
+
+class Discount(NamedTuple):
+    promotion_id: int
+    title: str
+    amount: Decimal
+
+
+class Quote:
+    """Расчёт корзины: строки, скидки, доставка и итог к оплате"""
+
+    __slots__ = ('lines', 'total_quantity', 'subtotal', 'discounts', 'discount_total',
+                 'total_price', 'delivery_fee', 'grand_total')
+
+    def __init__(self, lines, total_quantity, subtotal, discounts, total_price, delivery_fee):
+        self.lines = lines
+        self.total_quantity = total_quantity
+        self.subtotal = subtotal
+        self.discounts = discounts
+        self.discount_total = subtotal - total_price
+        self.total_price = total_price
+        self.delivery_fee = delivery_fee
+        self.grand_total = total_price + delivery_fee
+
+
+def quote(items, rules=None):
+    """Посчитать корзину за один проход по строкам.
+
+    items - строки корзины (CartItem из with_prices()), rules - RuleSet;
+    по умолчанию берутся правила текущего снимка каталога.
+    """
+    if rules is None:
+        rules = get_rules()
+    pizza_rules, combo_rules = rules.pizza_rules, rules.combo_rules
+    lines = []
+    applied = {}
+    total_quantity = 0
+    subtotal = ZERO
+    amount = ZERO
+    for item in items:
+        quantity = item.quantity
+        unit_price = item.unit_price()
+        line_subtotal = unit_price * quantity
+        if item.item_type == 'pizza':
+            candidates = pizza_rules.get((item.pizza_id, item.size), ())
+        else:
+            candidates = combo_rules.get(item.combo_id, ())
+
+        discount, best = ZERO, None
+        for rule in candidates:
+            value = rule.line_discount(unit_price, quantity)
+            if value > discount:
+                discount, best = value, rule
+        if best is not None:
+            discount = min(discount, line_subtotal)
+            previous = applied.get(best.promotion_id)
+            applied[best.promotion_id] = Discount(
+                best.promotion_id, best.title, discount + (previous.amount if previous else ZERO),
+            )
+
+        total_quantity += quantity
+        subtotal += line_subtotal
+        amount += line_subtotal - discount
+        lines.append(QuoteLine(
+            item, unit_price, quantity, line_subtotal, discount, line_subtotal - discount,
+            best.title if best else '',
+        ))
+
+    order_discount, best = ZERO, None
+    for rule in rules.order_rules:
+        if amount >= rule.min_subtotal:
+            value = rule.order_discount(amount)
+            if value > order_discount:
+                order_discount, best = value, rule
+    if best is not None:
+        applied[best.promotion_id] = Discount(best.promotion_id, best.title, order_discount)
+        amount -= order_discount
+
+    delivery_fee = ZERO if rules.free_delivery(amount) else DELIVERY_FEE
+    return Quote(lines, total_quantity, subtotal, tuple(applied.values()), amount, delivery_fee)
@@ -0,0 +1,273 @@
+"""Сводки продаж для админ-панели.
+
+Вместо пересчёта заказов на каждый запрос поддерживаются почасовые и
+дневные суммы по статусу и способу оплаты (SalesRollup) и дневные
+продажи по товарам (ItemSalesRollup). Сводки обновляются при создании
+заказа, смене его статуса и удалении; полностью пересчитать их по
+истории можно командой rebuild_rollups.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Order, OrderItem, SalesRollup, ItemSalesRollup
+
+# Отправляется при каждом изменении сводок: новый заказ, смена статуса, удаление
+sales_changed = Signal()
+
+
+def period_starts(created_at):
+    """Начало часа и дня заказа в местном часовом поясе"""
+    local = timezone.localtime(created_at)
+    hour = local.replace(minute=0, second=0, microsecond=0)
+    return (('hour', hour), ('day', hour.replace(hour=0)))
+
+
+def _bump(model, key, **deltas):
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        model.objects.filter(**key).update(**updates)
+
+
+def _record_state(state, sign):
+    status, payment_method, total_price, created_at = state
+    for granularity, start in period_starts(created_at):
+        _bump(
+            SalesRollup,
+            {'granularity': granularity, 'period_start': start,
+             'status': status, 'payment_method': payment_method},
+            orders_count=sign,
+            revenue=sign * total_price,
+        )
+
+
+def _record_items(day, items, sign):
+    """Изменить дневные продажи товаров числом запросов, не зависящим от размера заказа"""
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    for item in items:
+        bucket = totals[(item.item_type, item.item_name, item.size)]
+        bucket[0] += sign * item.quantity
+        bucket[1] += sign * item.total_price
+    if not totals:
+        return
+
+    existing = {
+        (row.item_type, row.item_name, row.size): row
+        for row in ItemSalesRollup.objects.filter(
+            day=day, item_name__in={name for _, name, _ in totals},
+        ).only('id', 'item_type', 'item_name', 'size')
+    }
+    to_update = []
+    to_create = []
+    for key, (quantity, revenue) in totals.items():
+        row = existing.get(key)
+        if row is not None:
+            row.quantity = F('quantity') + quantity
+            row.revenue = F('revenue') + revenue
+            to_update.append(row)
+        else:
+            item_type, item_name, size = key
+            to_create.append(ItemSalesRollup(day=day, item_type=item_type, item_name=item_name,
+                                             size=size, quantity=quantity, revenue=revenue))
+    if to_update:
+        ItemSalesRollup.objects.bulk_update(to_update, ['quantity', 'revenue'])
+    if to_create:
+        try:
+            with transaction.atomic():
+                ItemSalesRollup.objects.bulk_create(to_create)
+        except IntegrityError:
+            # Часть строк успел создать параллельный запрос
+            for row in to_create:
+                _bump(ItemSalesRollup,
+                      {'day': day, 'item_type': row.item_type, 'item_name': row.item_name, 'size': row.size},
+                      quantity=row.quantity, revenue=row.revenue)
+
+
+def record_order_items(order, items):
+    """Добавить строки нового заказа в дневные продажи товаров"""
+    _record_items(timezone.localdate(order.created_at), items, 1)
+
+
+def update_order_status(queryset, status):
+    """Массово сменить статус заказов, перенеся их в сводках.
+
+    QuerySet.update() не вызывает сигналы, поэтому сводки корректируются
+    здесь: по одному изменению на группу (час, статус, способ оплаты),
+    а не на каждый заказ. Возвращает число изменённых заказов.
+    """
+    with transaction.atomic():
+        changed = queryset.exclude(status=status)
+        tz = timezone.get_current_timezone()
+        for trunc, granularity in ((TruncHour, 'hour'), (TruncDay, 'day')):
+            groups = (
+                changed.order_by()
+                .annotate(period_start=trunc('created_at', tzinfo=tz))
+                .values('period_start', 'status', 'payment_method')
+                .annotate(orders=Count('id'), revenue=Sum('total_price'))
+            )
+            for group in groups:
+                key = {'granularity': granularity, 'period_start': group['period_start'],
+                       'payment_method': group['payment_method']}
+                _bump(SalesRollup, dict(key, status=group['status']),
+                      orders_count=-group['orders'], revenue=-group['revenue'])
+                _bump(SalesRollup, dict(key, status=status),
+                      orders_count=group['orders'], revenue=group['revenue'])
+        updated = changed.update(status=status)
+        if updated:
+            sales_changed.send(sender=Order)
+        return updated
+
+
+def sales_by_day(since, until=None):
+    """Заказы и выручка по дням: {начало дня: (заказов, выручка)}"""
+    rows = SalesRollup.objects.filter(granularity='day', period_start__gte=since)
+    if until is not None:
+        rows = rows.filter(period_start__lt=until)
+    rows = rows.values('period_start').annotate(orders=Sum('orders_count'), revenue=Sum('revenue'))
+    return {
+        row['period_start']: (row['orders'] or 0, row['revenue'] or Decimal('0'))
+        for row in rows.order_by('period_start')
+    }
+
+
+def sales_breakdown(since, field):
+    """Заказы и выручка с начала периода в разрезе статуса или способа оплаты"""
+    rows = (
+        SalesRollup.objects.filter(granularity='day', period_start__gte=since)
+        .values(field).annotate(orders=Sum('orders_count'), revenue=Sum('revenue'))
+        .order_by(field)
+    )
+    return {row[field]: (row['orders'], row['revenue']) for row in rows if row['orders']}
+
+
+def hourly_sales(day_start):
+    rows = (
+        SalesRollup.objects.filter(
+            granularity='hour', period_start__gte=day_start,
+            period_start__lt=day_start + timedelta(days=1),
+        )
+        .values('period_start').annotate(orders=Sum('orders_count'), revenue=Sum('revenue'))
+        .order_by('period_start')
+    )
+    return [(row['period_start'], row['orders'], row['revenue']) for row in rows]
+
+
+def top_items(since_day, limit=5):
+    return list(
+        ItemSalesRollup.objects.filter(day__gte=since_day)
+        .values('item_name', 'size')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by('-quantity')[:limit]
+    )
+
+
+def rebuild(chunk_size=2000, stdout=None):
+    """Пересчитать сводки по всей истории заказов.
+
+    Заказы и их строки читаются порциями по первичному ключу, суммы
+    копятся в памяти (их размер зависит от числа часов, а не заказов).
+    Весь пересчёт - одна транзакция, и начинается она с удаления сводок:
+    так блокировка на запись берётся до чтения заказов, и новые заказы
+    и смены статуса ждут конца пересчёта, а не теряют свои изменения
+    сводок, которые иначе затёр бы результат.
+    """
+    sales = defaultdict(lambda: [0, Decimal('0')])
+    items = defaultdict(lambda: [0, Decimal('0')])
+    orders_seen = 0
+
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        ItemSalesRollup.objects.all().delete()
+
+        last_id = 0
+        while True:
+            chunk = list(
+                Order.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'status', 'payment_method', 'total_price', 'created_at')[:chunk_size]
+            )
+            if not chunk:
+                break
+            for order_id, status, payment_method, total_price, created_at in chunk:
+                for granularity, start in period_starts(created_at):
+                    bucket = sales[(granularity, start, status, payment_method)]
+                    bucket[0] += 1
+                    bucket[1] += total_price
+            last_id = chunk[-1][0]
+            orders_seen += len(chunk)
+
+            chunk_items = (
+                OrderItem.objects.filter(order_id__gte=chunk[0][0], order_id__lte=last_id)
+                .values_list('order__created_at', 'item_type', 'item_name', 'size', 'quantity', 'total_price')
+            )
+            for created_at, item_type, item_name, size, quantity, total_price in chunk_items:
+                bucket = items[(timezone.localdate(created_at), item_type, item_name, size)]
+                bucket[0] += quantity
+                bucket[1] += total_price
+
+            if stdout is not None:
+                stdout.write(f'Обработано заказов: {orders_seen}')
+
+        SalesRollup.objects.bulk_create([
+            SalesRollup(granularity=granularity, period_start=start, status=status,
+                        payment_method=payment_method, orders_count=count, revenue=revenue)
+            for (granularity, start, status, payment_method), (count, revenue) in sales.items()
+        ], batch_size=500)
+        ItemSalesRollup.objects.bulk_create([
+            ItemSalesRollup(day=day, item_type=item_type, item_name=item_name, size=size,
+                            quantity=quantity, revenue=revenue)
+            for (day, item_type, item_name, size), (quantity, revenue) in items.items()
+        ], batch_size=500)
+
+    return orders_seen, len(sales), len(items)
+
+
+def _order_pre_save(sender, instance, raw=False, **kwargs):
+    # Заказ загружен без нужных полей (например, через only()):
+    # прежние значения для сводок берём из БД
+    if raw or instance.pk is None or hasattr(instance, '_loaded_rollup_state'):
+        return
+    previous = Order.objects.filter(pk=instance.pk).values_list(*Order.ROLLUP_FIELDS).first()
+    instance._loaded_rollup_state = tuple(previous) if previous else None
+
+
+def _order_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    state = instance.rollup_state()
+    previous = None if created else getattr(instance, '_loaded_rollup_state', None)
+    if previous == state:
+        return
+    if previous is not None:
+        _record_state(previous, -1)
+    _record_state(state, 1)
+    instance._loaded_rollup_state = state
+    sales_changed.send(sender=Order)
+
+
+def _order_pre_delete(sender, instance, **kwargs):
+    # Строки заказа удаляются каскадом раньше самого заказа
+    _record_items(timezone.localdate(instance.created_at), instance.items.all(), -1)
+
+
+def _order_deleted(sender, instance, **kwargs):
+    _record_state(getattr(instance, '_loaded_rollup_state', None) or instance.rollup_state(), -1)
+    sales_changed.send(sender=Order)
+
+
+pre_save.connect(_order_pre_save, sender=Order, dispatch_uid='rollups_order_pre_save')
+post_save.connect(_order_saved, sender=Order, dispatch_uid='rollups_order_saved')
+pre_delete.connect(_order_pre_delete, sender=Order, dispatch_uid='rollups_order_pre_delete')
+post_delete.connect(_order_deleted, sender=Order, dispatch_uid='rollups_order_deleted')
@@ -0,0 +1,225 @@
+"""Поиск по меню через инвертированный индекс в памяти.
+
+Индекс строится из снимка каталога по названию, описанию и составу пицц.
+Слова приводятся к нижнему регистру, ё заменяется на е, от слов
+отрезаются типичные русские окончания. Последнее слово запроса ищется
+и по префиксу, чтобы работали подсказки при наборе.
+"""
+import bisect
+import re
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .catalog import PizzaEntry, current_version, get_catalog
+from .models import Pizza
+
+FIELD_WEIGHTS = (
+    ('name', 3.0),
+    ('ingredients', 2.0),
+    ('description', 1.0),
+)
+PREFIX_FACTOR = 0.5
+MIN_STEM_LENGTH = 3
+
+STOP_WORDS = frozenset(['и', 'в', 'во', 'с', 'со', 'на', 'по', 'из', 'для', 'от', 'до', 'или', 'а'])
+
+# Окончания отсортированы по убыванию длины: отрезается самое длинное
+ENDINGS = tuple(sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ую', 'юю', 'ов', 'ев', 'ью',
+    'ы', 'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True))
+
+TOKEN_RE = re.compile(r'[a-zа-я0-9]+')
+
+
+def normalize(text):
+    return text.casefold().replace('ё', 'е')
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """Основы слов текста без стоп-слов"""
+    return [
+        stem(word) for word in TOKEN_RE.findall(normalize(text))
+        if word not in STOP_WORDS
+    ]
+
+
+class SearchIndex:
+    """Инвертированный индекс: основа слова -> {id пиццы: вес}.
+
+    Словари постингов и отсортированный словарь основ при обновлении
+    заменяются целиком, поэтому читать индекс можно без блокировки.
+    """
+
+    def __init__(self, pizzas=(), version=None):
+        self.version = version
+        self.postings = {}
+        self.vocabulary = []
+        self.documents = {}
+        self._lock = threading.Lock()
+        for pizza in pizzas:
+            self._add(pizza)
+        self.vocabulary = sorted(self.postings)
+
+    def _terms(self, pizza):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS:
+            for term in tokenize(getattr(pizza, field)):
+                if weights.get(term, 0) < weight:
+                    weights[term] = weight
+        return weights
+
+    def _add(self, pizza):
+        weights = self._terms(pizza)
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[pizza.id] = weight
+        self.documents[pizza.id] = (pizza, frozenset(weights))
+
+    def update(self, pizza):
+        """Переиндексировать одну пиццу"""
+        with self._lock:
+            old_terms = self.documents.get(pizza.id, (None, frozenset()))[1]
+            weights = self._terms(pizza)
+            for term in old_terms - weights.keys():
+                posting = dict(self.postings[term])
+                posting.pop(pizza.id, None)
+                if posting:
+                    self.postings[term] = posting
+                else:
+                    del self.postings[term]
+            for term, weight in weights.items():
+                posting = dict(self.postings.get(term, {}))
+                posting[pizza.id] = weight
+                self.postings[term] = posting
+            self.documents[pizza.id] = (pizza, frozenset(weights))
+            self.vocabulary = sorted(self.postings)
+
+    def remove(self, pizza_id):
+        with self._lock:
+            entry = self.documents.pop(pizza_id, None)
+            if entry is None:
+                return
+            for term in entry[1]:
+                posting = dict(self.postings[term])
+                posting.pop(pizza_id, None)
+                if posting:
+                    self.postings[term] = posting
+                else:
+                    del self.postings[term]
+            self.vocabulary = sorted(self.postings)
+
+    def _match(self, term, prefix):
+        scores = dict(self.postings.get(term, {}))
+        if prefix:
+            vocabulary = self.vocabulary
+            position = bisect.bisect_left(vocabulary, term)
+            while position < len(vocabulary) and vocabulary[position].startswith(term):
+                candidate = vocabulary[position]
+                if candidate != term:
+                    for pizza_id, weight in self.postings.get(candidate, {}).items():
+                        scores[pizza_id] = max(scores.get(pizza_id, 0), weight * PREFIX_FACTOR)
+                position += 1
+        return scores
+
+    def search(self, query, limit=20):
+        """Пиццы, подходящие под все слова запроса, по убыванию релевантности.
+
+        Возвращает список пар (пицца, оценка).
+        """
+        words = [word for word in TOKEN_RE.findall(normalize(query)) if word not in STOP_WORDS]
+        if not words:
+            return []
+
+        scores = None
+        for position, word in enumerate(words):
+            is_last = position == len(words) - 1
+            matched = self._match(stem(word), prefix=True)
+            if is_last and stem(word) != word:
+                # Недописанное слово: ищем ещё и по префиксу без отрезания окончания
+                for pizza_id, weight in self._match(word, prefix=True).items():
+                    matched[pizza_id] = max(matched.get(pizza_id, 0), weight)
+            if scores is None:
+                scores = matched
+            else:
+                scores = {
+                    pizza_id: score + matched[pizza_id]
+                    for pizza_id, score in scores.items() if pizza_id in matched
+                }
+            if not scores:
+                return []
+
+        documents = self.documents
+        ranked = sorted(
+            scores.items(),
+            key=lambda item: (-item[1], documents[item[0]][0].order, documents[item[0]][0].name),
+        )
+        return [(documents[pizza_id][0], score) for pizza_id, score in ranked[:limit]]
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def get_search_index():
+    """Индекс для текущей версии каталога"""
+    global _index
+    catalog = get_catalog()
+    index = _index
+    if index is not None and index.version == catalog.version:
+        return index
+    with _lock:
+        if _index is None or _index.version != catalog.version:
+            _index = SearchIndex(catalog.pizzas, version=catalog.version)
+        return _index
+
+
+def invalidate_search_index():
+    """Сбросить индекс текущего процесса"""
+    global _index
+    _index = None
+
+
+def search_pizzas(query, limit=20):
+    return get_search_index().search(query, limit)
+
+
+def _apply_on_commit(index, change):
+    # Индекс меняется только после коммита: при откате транзакции (ошибка в
+    # форме админки, упавшая порция sync_menu) незакоммиченный текст не
+    # должен попасть в поиск. К этому моменту общая версия каталога уже
+    # сменена этим же коммитом, индекс обновлён точечно и перестраивать
+    # его целиком не нужно
+    def apply():
+        if _index is index:
+            change()
+            index.version = current_version()
+    transaction.on_commit(apply)
+
+
+def _pizza_saved(sender, instance, **kwargs):
+    index = _index
+    if index is not None:
+        entry = PizzaEntry.from_instance(instance)
+        _apply_on_commit(index, lambda: index.update(entry))
+
+
+def _pizza_deleted(sender, instance, **kwargs):
+    index = _index
+    if index is not None:
+        pizza_id = instance.id
+        _apply_on_commit(index, lambda: index.remove(pizza_id))
+
+
+post_save.connect(_pizza_saved, sender=Pizza, dispatch_uid='search_pizza_saved')
+post_delete.connect(_pizza_deleted, sender=Pizza, dispatch_uid='search_pizza_deleted')
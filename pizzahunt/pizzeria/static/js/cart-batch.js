@@ -0,0 +1,106 @@
+// Пакетная синхронизация корзины.
+// Операции, накопившиеся за DELAY мс после последнего клика, уходят на
+// /cart/batch/ одним запросом. Повторные добавления одного товара
+// складываются, из нескольких изменений количества строки остаётся
+// последнее. Каждая операция возвращает Promise с ответом всего пакета.
+(function () {
+  const URL = "/cart/batch/";
+  const DELAY = 400;
+
+  let operations = [];
+  let waiters = [];
+  let timer = null;
+
+  function sameLine(a, b) {
+    if (a.op === "add" && b.op === "add") {
+      return (
+        a.item_type === b.item_type &&
+        String(a.item_id) === String(b.item_id) &&
+        a.size === b.size
+      );
+    }
+    return a.op !== "add" && b.op !== "add" && String(a.item_id) === String(b.item_id);
+  }
+
+  function enqueue(operation) {
+    const previous = operations.find((op) => sameLine(op, operation));
+    if (previous && operation.op === "add") {
+      previous.quantity += operation.quantity;
+    } else if (previous) {
+      // Новое количество или удаление заменяет прежнюю операцию строки
+      operations = operations.filter((op) => op !== previous);
+      operations.push(operation);
+    } else {
+      operations.push(operation);
+    }
+
+    clearTimeout(timer);
+    timer = setTimeout(flush, DELAY);
+    return new Promise((resolve, reject) => {
+      waiters.push({ resolve, reject });
+    });
+  }
+
+  function flush() {
+    clearTimeout(timer);
+    timer = null;
+    if (!operations.length) {
+      return;
+    }
+    const batch = operations;
+    const pending = waiters;
+    operations = [];
+    waiters = [];
+
+    fetch(URL, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-Requested-With": "XMLHttpRequest",
+        "X-CSRFToken": getCookie("csrftoken"),
+      },
+      body: JSON.stringify({ operations: batch }),
+      // Пакет, отправленный при уходе со страницы, не обрывается
+      keepalive: true,
+    })
+      .then((response) => response.json())
+      .then((data) => pending.forEach((waiter) => waiter.resolve(data)))
+      .catch((error) => pending.forEach((waiter) => waiter.reject(error)));
+  }
+
+  function getCookie(name) {
+    let cookieValue = null;
+    if (document.cookie && document.cookie !== "") {
+      const cookies = document.cookie.split(";");
+      for (let i = 0; i < cookies.length; i++) {
+        const cookie = cookies[i].trim();
+        if (cookie.substring(0, name.length + 1) === name + "=") {
+          cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+          break;
+        }
+      }
+    }
+    return cookieValue;
+  }
+
+  window.addEventListener("pagehide", flush);
+
+  window.CartBatch = {
+    add(itemType, itemId, size, quantity) {
+      return enqueue({
+        op: "add",
+        item_type: itemType,
+        item_id: itemId,
+        size: size || "30",
+        quantity: quantity || 1,
+      });
+    },
+    update(itemId, quantity) {
+      return enqueue({ op: "update", item_id: itemId, quantity: quantity });
+    },
+    remove(itemId) {
+      return enqueue({ op: "remove", item_id: itemId });
+    },
+    flush: flush,
+  };
+})();
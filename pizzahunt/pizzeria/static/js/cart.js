@@ -44,45 +44,17 @@ document.addEventListener("DOMContentLoaded", function () {
     });
   });
 
-  // Функция обновления количества товара
+  // Функция обновления количества товара: частые клики по +/-
+  // уходят на сервер одним пакетом (см. cart-batch.js)
   function updateCartItem(itemId, quantity) {
-    fetch("/cart/update/", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "X-Requested-With": "XMLHttpRequest",
-        "X-CSRFToken": getCookie("csrftoken"),
-      },
-      body: `item_id=${itemId}&quantity=${quantity}`,
-    })
-      .then((response) => response.json())
+    CartBatch.update(itemId, quantity)
       .then((data) => {
         if (data.success) {
           document.querySelectorAll(".cart-count").forEach((el) => {
             el.textContent = data.cart_quantity;
           });
 
-          const itemElement = document.querySelector(
-            `.cart-item[data-item-id="${itemId}"]`
-          );
-          if (itemElement) {
-            const totalPriceElement = itemElement.querySelector(".total-price");
-            if (totalPriceElement && data.item_total) {
-              totalPriceElement.textContent = `${data.item_total.toFixed(2)} ₽`;
-            }
-          }
-
-          const cartTotalElements = document.querySelectorAll(".cart-total");
-          cartTotalElements.forEach((el) => {
-            if (el.classList.contains("summary-value")) {
-              el.textContent = `${data.cart_total.toFixed(2)} ₽`;
-            } else if (el.classList.contains("summary-total")) {
-              const deliveryCost = data.cart_total > 1000 ? 0 : 200;
-              el.textContent = `${(data.cart_total + deliveryCost).toFixed(
-                2
-              )} ₽`;
-            }
-          });
+          renderTotals(data);
         }
       })
       .catch((error) => {
@@ -90,17 +62,36 @@ document.addEventListener("DOMContentLoaded", function () {
       });
   }
 
+  // Итоги считает сервер (скидки по акциям и доставка), страница только
+  // показывает их. Скидки на строки меняют и суммы других позиций
+  function renderTotals(data) {
+    Object.entries(data.items || {}).forEach(([id, total]) => {
+      const element = document.querySelector(
+        `.cart-item[data-item-id="${id}"] .total-price`
+      );
+      if (element) {
+        element.textContent = `${Math.round(total)} ₽`;
+      }
+    });
+
+    document.querySelectorAll("[data-total]").forEach((el) => {
+      const value = data[el.dataset.total];
+      if (el.dataset.total === "delivery_fee" && !value) {
+        el.innerHTML = '<span style="color: #4CAF50;">Бесплатно</span>';
+      } else {
+        el.textContent = `${Math.round(value)} ₽`;
+      }
+    });
+
+    const discountRow = document.querySelector('[data-row="discount"]');
+    if (discountRow) {
+      discountRow.hidden = !data.discount;
+    }
+  }
+
   // Функция удаления товара
   function removeCartItem(itemId) {
-    fetch(`/cart/remove/${itemId}/`, {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "X-Requested-With": "XMLHttpRequest",
-        "X-CSRFToken": getCookie("csrftoken"),
-      },
-    })
-      .then((response) => response.json())
+    CartBatch.remove(itemId)
       .then((data) => {
         if (data.success) {
           const itemElement = document.querySelector(
@@ -116,6 +107,8 @@ document.addEventListener("DOMContentLoaded", function () {
 
           if (data.cart_quantity === 0) {
             location.reload();
+          } else {
+            renderTotals(data);
           }
         }
       })
@@ -123,19 +116,4 @@ document.addEventListener("DOMContentLoaded", function () {
         console.error("Error:", error);
       });
   }
-
-  function getCookie(name) {
-    let cookieValue = null;
-    if (document.cookie && document.cookie !== "") {
-      const cookies = document.cookie.split(";");
-      for (let i = 0; i < cookies.length; i++) {
-        const cookie = cookies[i].trim();
-        if (cookie.substring(0, name.length + 1) === name + "=") {
-          cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
-          break;
-        }
-      }
-    }
-    return cookieValue;
-  }
 });
@@ -0,0 +1,134 @@
+"""Сборка и раздача статики с хешами в именах и заранее сжатыми копиями.
+
+collectstatic с CompressedManifestStaticFilesStorage записывает файлы с
+хешем содержимого в имени (main.3f2a9c1b7d4e.css) и рядом с текстовыми
+файлами кладёт .gz и, если установлен пакет brotli, .br. serve_static
+отдаёт их без DEBUG: выбирает сжатую копию по Accept-Encoding, а файлам
+с хешем в имени ставит Cache-Control: immutable на год.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage, staticfiles_storage
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli необязателен
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.map')
+# Сжатая копия не пишется, если она экономит меньше этой доли размера
+MIN_SAVING = 0.05
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def compress(content):
+    """Сжатые варианты содержимого: {'.gz': bytes, '.br': bytes}"""
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    return {
+        suffix: data for suffix, data in variants.items()
+        if len(data) <= len(content) * (1 - MIN_SAVING)
+    }
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage, дописывающий .gz/.br рядом с файлами"""
+
+    def url(self, name, force=False):
+        if not self.hashed_files and not force:
+            # collectstatic ещё не запускался (разработка, тесты):
+            # ссылки на файлы без хеша, как у обычного хранилища
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name, hashed_name in self.hashed_files.items():
+            for target in {name, hashed_name}:
+                if not target.endswith(COMPRESSIBLE_EXTENSIONS) or not self.exists(target):
+                    continue
+                with self.open(target) as original:
+                    content = original.read()
+                for suffix, data in compress(content).items():
+                    if self.exists(target + suffix):
+                        self.delete(target + suffix)
+                    self._save(target + suffix, ContentFile(data))
+
+
+def _is_hashed(path):
+    # Манифест читается один раз при создании хранилища
+    return path in getattr(staticfiles_storage, 'hashed_files', {}).values()
+
+
+def accepted_encodings(header):
+    """Кодировки из ENCODINGS, которые допускает Accept-Encoding.
+
+    q=0 означает "нельзя"; '*' относится ко всем кодировкам, не названным
+    явно. Некорректное значение q считается нулём.
+    """
+    weights = {}
+    for token in header.split(','):
+        coding, _, params = token.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return {name for name, _ in ENCODINGS if weights.get(name, weights.get('*', 0)) > 0}
+
+
+def _set_cache_headers(response, path):
+    # Одинаковые у 200 и 304: 304 обновляет сохранённый ответ в кеше
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE if _is_hashed(path) else REVALIDATE
+    return response
+
+
+def serve_static(request, path):
+    """Отдать файл из STATIC_ROOT, по возможности сжатую копию"""
+    path = posixpath.normpath(path).lstrip('/')
+    # Выход за пределы STATIC_ROOT: SuspiciousFileOperation, ответ 400
+    fullpath = safe_join(settings.STATIC_ROOT, path)
+    if not os.path.isfile(fullpath) or path.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+        raise Http404
+
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    encoding = None
+    served = fullpath
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(fullpath + suffix):
+            encoding, served = name, fullpath + suffix
+            break
+
+    stat = os.stat(served)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return _set_cache_headers(HttpResponseNotModified(), path)
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    response = FileResponse(open(served, 'rb'), content_type=content_type or 'application/octet-stream')
+    response.headers['Last-Modified'] = http_date(stat.st_mtime)
+    _set_cache_headers(response, path)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
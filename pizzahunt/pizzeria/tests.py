@@ -1,3 +1,1650 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import importlib
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import types
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.template import RequestContext, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, include, path, reverse
+from django.utils import timezone
+
+from .catalog import Catalog, get_catalog, invalidate_catalog
+from .search import SearchIndex, invalidate_search_index, search_pizzas, tokenize
+from .models import Category, Combo, Feedback, Pizza, Promotion, Cart, CartItem, Order, OrderItem, SalesRollup, ItemSalesRollup
+from . import cache_backends, cart_storage, cleanup, exports, images, kitchen, instrumentation, live, maintenance, pricing, rollups, staticfiles, views
+from .utils import merge_carts
+
+
+def make_pizzas(count):
+    category = Category.objects.create(name='Классические', slug='classic')
+    return Pizza.objects.bulk_create([
+        Pizza(
+            name=f'Пицца {i}', slug=f'pizza-{i}', description='Описание',
+            ingredients='Тесто, сыр', category=category,
+            price_30=Decimal('400'), price_35=Decimal('500'), price_40=Decimal('600'),
+        )
+        for i in range(count)
+    ])
+
+
+def fill_cart(cart, pizzas, size='35', quantity=2):
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, item_type='pizza', pizza=pizza, size=size, quantity=quantity)
+        for pizza in pizzas
+    ])
+
+
+class OrderPlacementTests(TestCase):
+    ORDER_DATA = {
+        'name': 'Иван',
+        'phone': '+7 999 123-45-67',
+        'email': '',
+        'address': 'ул. Ленина, 1',
+        'comment': '',
+        'payment_method': 'cash',
+    }
+
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(50)
+
+    def checkout(self, lines):
+        session = self.client.session
+        session.save()
+        cart = Cart.objects.create(session_key=session.session_key)
+        fill_cart(cart, self.pizzas[:lines])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('order'), self.ORDER_DATA)
+        self.assertRedirects(response, reverse('order_success'), fetch_redirect_response=False)
+        return cart, len(queries)
+
+    def test_order_items_and_totals(self):
+        cart, _ = self.checkout(3)
+        order = Order.objects.get()
+        self.assertEqual(order.cart, cart)
+        self.assertEqual(order.total_price, Decimal('3000'))
+        self.assertEqual(order.items.count(), 3)
+        item = order.items.first()
+        self.assertEqual((item.size, item.quantity, item.unit_price, item.total_price),
+                         ('35', 2, Decimal('500'), Decimal('1000')))
+        self.assertFalse(cart.items.exists())
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        # Первый заказ за день создаёт строки сводок продаж, дальше они обновляются
+        self.checkout(50)
+        counts = []
+        for lines in (1, 10, 50):
+            self.client = self.client_class()
+            counts.append(self.checkout(lines)[1])
+        self.assertEqual(len(set(counts)), 1, counts)
+        self.assertEqual(OrderItem.objects.count(), 111)
+
+    def test_empty_cart_creates_no_order(self):
+        response = self.client.post(reverse('order'), self.ORDER_DATA)
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+
+class CartQueryCountTests(TestCase):
+    ajax = {'headers': {'X-Requested-With': 'XMLHttpRequest'}}
+
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(51)
+
+    def count_queries(self, lines):
+        """Число запросов страницы корзины и AJAX-ответов при корзине из lines строк"""
+        self.client = self.client_class()
+        session = self.client.session
+        session.save()
+        cart = Cart.objects.create(session_key=session.session_key)
+        fill_cart(cart, self.pizzas[:lines])
+        item = cart.items.first()
+
+        requests = {
+            'page': lambda: self.client.get(reverse('cart')),
+            'add': lambda: self.client.post(reverse('add_to_cart'), {
+                'item_type': 'pizza', 'item_id': self.pizzas[50].id, 'size': '30'}, **self.ajax),
+            'update': lambda: self.client.post(reverse('update_cart'), {
+                'item_id': item.id, 'quantity': 3}, **self.ajax),
+            'remove': lambda: self.client.post(reverse('remove_from_cart', args=[item.id]), **self.ajax),
+        }
+        counts = {}
+        for name, send in requests.items():
+            with CaptureQueriesContext(connection) as queries:
+                response = send()
+            self.assertEqual(response.status_code, 200)
+            counts[name] = len(queries)
+        self.assertEqual(cart.items.count(), lines)
+        return counts
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        # Первый проход заполняет кеш каталога
+        self.count_queries(1)
+        counts = [self.count_queries(lines) for lines in (1, 10, 50)]
+        self.assertEqual(counts[1], counts[0])
+        self.assertEqual(counts[2], counts[0])
+
+
+class CartContextTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(3)
+
+    def test_anonymous_pages_create_no_session_or_cart(self):
+        for url in (reverse('home'), reverse('menu')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+
+    def test_context_processor_queries_only_when_cart_is_used(self):
+        session = self.client.session
+        session.save()
+        fill_cart(Cart.objects.create(session_key=session.session_key), self.pizzas, quantity=1)
+        request = RequestFactory().get(reverse('about'))
+        request.user = AnonymousUser()
+        request.session = self.client.session
+
+        with self.assertNumQueries(0):
+            html = Template('{{ title }}').render(RequestContext(request, {'title': 'О нас'}))
+        self.assertEqual(html, 'О нас')
+        with CaptureQueriesContext(connection) as queries:
+            html = Template('{{ cart_quantity }}').render(RequestContext(request))
+        self.assertEqual(html, '3')
+        self.assertTrue(queries)
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        self.pizzas = make_pizzas(3)
+        # Тест идёт внутри транзакции: данные setUp считаем закоммиченными
+        invalidate_catalog()
+
+    def test_menu_reads_no_queries_in_steady_state(self):
+        self.client.get(reverse('menu'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('menu'), {'sort': 'price-desc'})
+        self.assertContains(response, 'Пицца 2')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('home'))
+
+    def test_saving_pizza_rebuilds_snapshot(self):
+        catalog = get_catalog()
+        pizza = self.pizzas[0]
+        pizza.price_30 = Decimal('450')
+        pizza.save()
+        self.assertIsNot(get_catalog(), catalog)
+        self.assertEqual(get_catalog().get_pizza(pizza.id).price_30, Decimal('450'))
+
+    def test_deleted_pizza_disappears_from_menu(self):
+        self.pizzas[1].delete()
+        response = self.client.get(reverse('menu'))
+        self.assertNotContains(response, 'Пицца 1')
+
+    def test_rolled_back_change_is_not_cached(self):
+        catalog = get_catalog()
+        pizza = self.pizzas[0]
+        try:
+            with transaction.atomic():
+                pizza.price_30 = Decimal('1')
+                pizza.save()
+                self.assertEqual(get_catalog().get_pizza(pizza.id).price_30, Decimal('1'))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(get_catalog().version, catalog.version)
+        self.assertEqual(get_catalog().get_pizza(pizza.id).price_30, Decimal('400'))
+
+
+class MenuSearchTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        invalidate_search_index()
+        category = Category.objects.create(name='Сырные', slug='cheese')
+        prices = dict(price_30=Decimal('400'), price_35=Decimal('500'), price_40=Decimal('600'))
+        self.margherita = Pizza.objects.create(
+            name='Маргарита', slug='margherita', category=category, order=1,
+            description='Классическая итальянская пицца', ingredients='Томаты, моцарелла, базилик', **prices)
+        self.four_cheese = Pizza.objects.create(
+            name='Четыре сыра', slug='four-cheese', category=category, order=2,
+            description='Для любителей сыра', ingredients='Моцарелла, пармезан, горгонзола, чеддер', **prices)
+        self.pepperoni = Pizza.objects.create(
+            name='Пепперони', slug='pepperoni', category=category, order=3,
+            description='Острая пицца с сырной корочкой', ingredients='Пепперони, моцарелла, перец', **prices)
+
+    def test_tokenize_normalizes_case_yo_and_endings(self):
+        self.assertEqual(tokenize('Сырная Ёлка сыры'), ['сырн', 'елк', 'сыр'])
+
+    def test_name_matches_rank_above_description(self):
+        names = [pizza.name for pizza, score in SearchIndex(get_catalog().pizzas).search('сыр')]
+        self.assertEqual(names, ['Четыре сыра', 'Пепперони'])
+
+    def test_all_words_must_match_and_last_is_prefix(self):
+        index = SearchIndex(get_catalog().pizzas)
+        self.assertEqual([p.slug for p, _ in index.search('моцарелла перец')], ['pepperoni'])
+        self.assertEqual([p.slug for p, _ in index.search('пармез')], ['four-cheese'])
+        self.assertEqual(index.search('ананас'), [])
+
+    def test_saved_pizza_is_reindexed(self):
+        self.client.get(reverse('menu_search'), {'q': 'базилик'})
+        self.margherita.ingredients = 'Томаты, моцарелла, орегано'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.margherita.save()
+        response = self.client.get(reverse('menu_search'), {'q': 'орегано', 'format': 'json'})
+        self.assertEqual([r['slug'] for r in response.json()['results']], ['margherita'])
+        response = self.client.get(reverse('menu_search'), {'q': 'базилик', 'format': 'json'})
+        self.assertEqual(response.json()['results'], [])
+
+    def test_rolled_back_save_is_not_searchable(self):
+        self.client.get(reverse('menu_search'), {'q': 'базилик'})
+        self.margherita.ingredients = 'Томаты, моцарелла, орегано'
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(ValidationError):
+            with transaction.atomic():
+                self.margherita.save()
+                raise ValidationError('ошибка в форме')
+        response = self.client.get(reverse('menu_search'), {'q': 'орегано', 'format': 'json'})
+        self.assertEqual(response.json()['results'], [])
+
+    def test_html_results(self):
+        response = self.client.get(reverse('menu_search'), {'q': 'пепперони'})
+        self.assertContains(response, 'Пепперони')
+        self.assertNotContains(response, 'Маргарита')
+
+
+class QueryPlanTests(TestCase):
+    """Горячие запросы из views.py и utils.py не должны сканировать таблицу целиком"""
+
+    FULL_SCAN = re.compile(r'\bSCAN \w+(?!\w| USING (COVERING )?INDEX)')
+
+    def assertUsesIndex(self, queryset):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN проверяется только на SQLite')
+        plan = queryset.explain()
+        self.assertIsNone(self.FULL_SCAN.search(plan), f'{queryset.query}\n{plan}')
+
+    def test_hot_queries_use_indexes(self):
+        now = timezone.now()
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        user = User.objects.create_user('ivan')
+        hot_queries = {
+            'get_cart by session': Cart.objects.filter(session_key='abc'),
+            'get_cart by user': Cart.objects.filter(user=user),
+            'cart summary': CartItem.objects.filter(cart_id=1).with_prices(),
+            'orders today': Order.objects.filter(created_at__range=[day_start, now]),
+            'orders week': Order.objects.filter(created_at__gte=now - timedelta(days=7)),
+            'recent orders': Order.objects.order_by('-created_at')[:10],
+            'orders by status': Order.objects.filter(status='new').order_by('-created_at'),
+            'profile orders': Order.objects.filter(user=user).order_by('-created_at', '-id')[:5],
+            'order history page': Order.objects.filter(user=user, created_at__lt=now).order_by('-created_at', '-id')[:11],
+            'new users today': User.objects.filter(date_joined__range=[day_start, now]),
+            'popular pizzas': Pizza.objects.filter(is_popular=True).order_by('order', 'name'),
+            'new pizzas': Pizza.objects.filter(is_new=True).order_by('order', 'name'),
+        }
+        for name, queryset in hot_queries.items():
+            with self.subTest(name):
+                self.assertUsesIndex(queryset)
+
+
+class SalesRollupTests(TestCase):
+    def make_order(self, total, payment_method='cash', **fields):
+        order = Order.objects.create(name='Иван', phone='1', address='ул. Ленина, 1',
+                                     total_price=Decimal(total), payment_method=payment_method, **fields)
+        items = OrderItem.objects.bulk_create([
+            OrderItem(order=order, item_type='pizza', item_name='Маргарита', size='30',
+                      quantity=2, unit_price=Decimal(total) / 2, total_price=Decimal(total)),
+        ])
+        rollups.record_order_items(order, items)
+        return order
+
+    def snapshot(self):
+        return (
+            sorted(SalesRollup.objects.filter(orders_count__gt=0).values_list(
+                'granularity', 'period_start', 'status', 'payment_method', 'orders_count', 'revenue')),
+            sorted(ItemSalesRollup.objects.filter(quantity__gt=0).values_list('day', 'item_name', 'size', 'quantity', 'revenue')),
+        )
+
+    def test_incremental_rollups_match_rebuild(self):
+        first = self.make_order('1000')
+        self.make_order('500', payment_method='card_online')
+        old = self.make_order('700')
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=20))
+        SalesRollup.objects.all().delete()
+        ItemSalesRollup.objects.all().delete()
+        rollups.rebuild(chunk_size=2)
+
+        rollups.update_order_status(Order.objects.filter(pk=first.pk), 'confirmed')
+        order = Order.objects.get(pk=first.pk)
+        order.status = 'completed'
+        order.save()
+        Order.objects.get(pk=old.pk).delete()
+        incremental = self.snapshot()
+
+        rollups.rebuild(chunk_size=2)
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_rebuild_takes_write_lock_before_reading_orders(self):
+        self.make_order('1000')
+        with CaptureQueriesContext(connection) as queries:
+            rollups.rebuild(chunk_size=2)
+        statements = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        # Первая запись в транзакции блокирует базу для других писателей до коммита
+        self.assertTrue(statements[0].startswith('DELETE'), statements[0])
+        first_read = next(i for i, sql in enumerate(statements) if 'FROM "pizzeria_order"' in sql)
+        self.assertLess(max(i for i, sql in enumerate(statements) if sql.startswith('DELETE')), first_read)
+        self.assertEqual(SalesRollup.objects.filter(granularity='day').count(), 1)
+
+    def test_dashboard_reads_rollups(self):
+        self.make_order('1000')
+        self.make_order('500', status='cancelled')
+        staff = User.objects.create_user('admin', password='x', is_staff=True)
+        self.client.force_login(staff)
+
+        data = self.client.get(reverse('admin_stats'), {'range': 'quarter'}).json()
+        self.assertEqual((data['orders_today'], data['revenue_today']), (2, 1500.0))
+        self.assertEqual(data['by_status']['cancelled']['orders'], 1)
+        self.assertEqual(sum(hour['orders'] for hour in data['hourly']), 2)
+
+        response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.context['stats']['orders_week'], 2)
+        self.assertEqual(response.context['top_items'][0]['quantity'], 4)
+
+
+class LiveStatsTests(SimpleTestCase):
+    async def test_one_collect_per_change_fanned_out_as_deltas(self):
+        state = {'version': 1, 'collects': 0, 'orders_today': 3}
+
+        def collect():
+            state['collects'] += 1
+            return {'orders_today': state['orders_today'], 'total_users': 10}
+
+        broadcaster = live.Broadcaster(collect, version=lambda: state['version'], interval=0.01)
+        queues = [broadcaster.subscribe() for _ in range(20)]
+        first = await asyncio.wait_for(queues[0].get(), 1)
+        self.assertEqual(first, {'orders_today': 3, 'total_users': 10})
+
+        state['orders_today'] = 4
+        state['version'] = 2
+        deltas = [await asyncio.wait_for(queue.get(), 1) for queue in queues[1:]]
+        self.assertEqual(deltas[0], {'orders_today': 3, 'total_users': 10})
+        deltas = [await asyncio.wait_for(queue.get(), 1) for queue in queues]
+        self.assertTrue(all(delta == {'orders_today': 4} for delta in deltas))
+        self.assertEqual(state['collects'], 2)
+
+        for queue in queues:
+            broadcaster.unsubscribe(queue)
+        await asyncio.sleep(0.05)
+        self.assertIsNone(broadcaster._task)
+
+    async def test_late_subscriber_gets_full_state(self):
+        broadcaster = live.Broadcaster(lambda: {'orders_today': 1}, version=lambda: 1, interval=0.01)
+        early = broadcaster.subscribe()
+        await asyncio.wait_for(early.get(), 1)
+        late = broadcaster.subscribe()
+        self.assertEqual(await asyncio.wait_for(late.get(), 1), {'orders_today': 1})
+        broadcaster.unsubscribe(early)
+        broadcaster.unsubscribe(late)
+
+    async def test_overflowing_subscriber_is_closed_to_reconnect(self):
+        broadcaster = live.Broadcaster(lambda: {'orders_today': 1}, version=lambda: 1, interval=0.01)
+        stream = live.event_stream(broadcaster)
+        self.assertIn('"orders_today": 1', await asyncio.wait_for(stream.__anext__(), 1))
+        fast = broadcaster.subscribe()
+        for number in range(20):
+            broadcaster._publish({'orders_today': number})
+            if fast.qsize() > 1:
+                fast.get_nowait()
+        # Пропущенные изменения не отдаются по частям: поток просто заканчивается
+        self.assertEqual([message async for message in stream], [])
+        self.assertEqual(broadcaster._subscribers, {fast})
+        broadcaster.unsubscribe(fast)
+
+
+class LiveStatsEndpointTests(TestCase):
+    def test_stream_requires_staff(self):
+        response = self.client.get(reverse('admin_stats_stream'))
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(ASYNC_VIEWS=False)
+    def test_stream_is_disabled_under_wsgi(self):
+        # Иначе синхронный обработчик дочитывает бесконечный поток и не завершает запрос
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('admin_stats_stream'))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+        self.assertContains(self.client.get(reverse('admin_dashboard')), 'window.EventSource && false')
+
+    def test_order_change_bumps_stats_version(self):
+        before = live.stats_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(name='Иван', phone='1', address='ул. Ленина, 1', total_price=Decimal('100'))
+        self.assertNotEqual(live.stats_version(), before)
+
+
+async_cart_urls = types.ModuleType('async_cart_urls')
+async_cart_urls.urlpatterns = [
+    path('cart/', views.cart_view_async, name='cart'),
+    path('cart/add/', views.add_to_cart_view_async, name='add_to_cart'),
+    path('cart/update/', views.update_cart_view_async, name='update_cart'),
+    path('cart/remove/<int:item_id>/', views.remove_from_cart_view_async, name='remove_from_cart'),
+    path('', include('pizzahunt.urls')),
+]
+
+
+class AsyncCartViewTests(TestCase):
+    ajax = {'headers': {'X-Requested-With': 'XMLHttpRequest'}}
+
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(2)
+        self.additions = [
+            {'item_type': 'pizza', 'item_id': self.pizzas[0].id, 'size': '30'},
+            {'item_type': 'pizza', 'item_id': self.pizzas[0].id, 'size': '30'},
+            {'item_type': 'pizza', 'item_id': self.pizzas[1].id, 'size': '40'},
+        ]
+
+    def sync_scenario(self):
+        responses = [self.client.post('/cart/add/', data, **self.ajax) for data in self.additions]
+        item = CartItem.objects.get(pizza=self.pizzas[0])
+        responses.append(self.client.post('/cart/update/', {'item_id': item.id, 'quantity': 5}, **self.ajax))
+        responses.append(self.client.post(f'/cart/remove/{item.id}/', **self.ajax))
+        return [response.json() for response in responses]
+
+    async def async_scenario(self):
+        client = self.async_client
+        responses = [await client.post('/cart/add/', data, **self.ajax) for data in self.additions]
+        item = await CartItem.objects.aget(pizza=self.pizzas[0])
+        responses.append(await client.post('/cart/update/', {'item_id': item.id, 'quantity': 5}, **self.ajax))
+        responses.append(await client.post(f'/cart/remove/{item.id}/', **self.ajax))
+        page = await client.get('/cart/')
+        self.assertContains(page, self.pizzas[1].name)
+        return [response.json() for response in responses]
+
+    def test_async_views_match_sync_views(self):
+        expected = self.sync_scenario()
+        CartItem.objects.all().delete()
+        with override_settings(ROOT_URLCONF=async_cart_urls):
+            actual = async_to_sync(self.async_scenario)()
+        self.assertEqual(actual, expected)
+        self.assertEqual(Cart.objects.count(), 2)
+
+    async def test_peek_does_not_create_cart(self):
+        with override_settings(ROOT_URLCONF=async_cart_urls):
+            response = await self.async_client.get('/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(await Cart.objects.aexists())
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ivan', password='secret-pass-1')
+        cart = Cart.objects.create(user=self.user)
+        orders = Order.objects.bulk_create([
+            Order(name='Иван', phone='1', address='ул. Ленина, 1', total_price=Decimal('100'),
+                  cart=cart, user=self.user)
+            for _ in range(25)
+        ])
+        # Часть заказов с одинаковым временем: курсор должен различать их по id
+        moment = timezone.now()
+        for position, order in enumerate(orders):
+            order.created_at = moment - timedelta(minutes=position // 3)
+            for _ in range(2):
+                OrderItem(order=order, item_type='pizza', item_name='Пицца', size='30',
+                          quantity=1, unit_price=Decimal('50'), total_price=Decimal('50')).save()
+        Order.objects.bulk_update(orders, ['created_at'])
+        self.expected = [order.id for order in sorted(orders, key=lambda o: (o.created_at, o.id), reverse=True)]
+        self.client.force_login(self.user)
+
+    def test_pages_cover_all_orders_once(self):
+        seen = []
+        response = self.client.get(reverse('order_history'))
+        self.assertEqual(len(response.context['orders']), 10)
+        seen += [order.id for order in response.context['orders']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            with self.assertNumQueries(4):  # сессия, пользователь, заказы, строки заказов
+                data = self.client.get(reverse('order_history'), {'cursor': cursor, 'format': 'json'}).json()
+            seen += [int(order_id) for order_id in re.findall(r'Заказ #(\d+)', data['html'])]
+            cursor = data['next_cursor']
+        self.assertEqual(seen, self.expected)
+
+    def test_bad_cursor_returns_first_page(self):
+        response = self.client.get(reverse('order_history'), {'cursor': 'garbage'})
+        self.assertEqual([order.id for order in response.context['orders']], self.expected[:10])
+
+    def test_profile_shows_latest_five_and_totals(self):
+        response = self.client.get(reverse('profile'))
+        self.assertEqual([order.id for order in response.context['orders']], self.expected[:5])
+        self.assertEqual(response.context['orders_count'], 25)
+        self.assertEqual(response.context['total_spent'], Decimal('2500'))
+        self.assertTrue(response.context['has_more_orders'])
+
+
+class OrderUserTests(TestCase):
+    def test_checkout_sets_user(self):
+        user = User.objects.create_user('ivan', password='secret-pass-1')
+        self.client.force_login(user)
+        fill_cart(Cart.objects.create(user=user), make_pizzas(1))
+        self.client.post(reverse('order'), {
+            'name': 'Иван', 'phone': '1', 'address': 'ул. Ленина, 1', 'payment_method': 'cash',
+        })
+        self.assertEqual(Order.objects.get().user, user)
+
+    def test_backfill_from_carts_is_resumable(self):
+        users = [User.objects.create_user(f'user{i}') for i in range(3)]
+        carts = [Cart.objects.create(user=user) for user in users]
+        orders = Order.objects.bulk_create([
+            Order(name='Иван', phone='1', address='ул. Ленина, 1', total_price=Decimal('100'),
+                  cart=carts[i % 3])
+            for i in range(10)
+        ] + [Order(name='Аноним', phone='1', address='ул. Ленина, 1', total_price=Decimal('100'))])
+
+        call_command('backfill_order_users', chunk_size=3, start_id=orders[4].id, stdout=StringIO())
+        self.assertEqual(Order.objects.filter(user__isnull=False).count(), 5)
+        call_command('backfill_order_users', chunk_size=3, stdout=StringIO())
+        for order in Order.objects.filter(cart__isnull=False).select_related('cart'):
+            self.assertEqual(order.user_id, order.cart.user_id)
+        self.assertEqual(Order.objects.filter(user__isnull=True).count(), 1)
+
+
+class CartMergeTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(75)
+        self.combo = Combo.objects.create(name='Комбо', description='', price=Decimal('900'), includes='')
+        self.user = User.objects.create_user('ivan', password='secret-pass-1')
+
+    def anonymous_cart(self):
+        session = self.client.session
+        session.save()
+        return Cart.objects.create(session_key=session.session_key)
+
+    def test_login_merges_session_cart(self):
+        user_cart = Cart.objects.create(user=self.user)
+        fill_cart(user_cart, self.pizzas[:2], quantity=1)
+        anonymous = self.anonymous_cart()
+        fill_cart(anonymous, self.pizzas[1:3], quantity=2)
+        CartItem.objects.create(cart=anonymous, item_type='combo', combo=self.combo, size='', quantity=1)
+
+        self.client.post(reverse('login'), {'username': 'ivan', 'password': 'secret-pass-1'})
+
+        self.assertFalse(Cart.objects.filter(pk=anonymous.pk).exists())
+        lines = {(item.pizza_id or item.combo_id, item.quantity) for item in user_cart.items.all()}
+        self.assertEqual(lines, {(self.pizzas[0].id, 1), (self.pizzas[1].id, 3),
+                                 (self.pizzas[2].id, 2), (self.combo.id, 1)})
+
+    def test_session_cart_adopted_with_its_orders(self):
+        anonymous = self.anonymous_cart()
+        fill_cart(anonymous, self.pizzas[:2])
+        order = Order.objects.create(name='Иван', phone='1', address='ул. Ленина, 1',
+                                     total_price=Decimal('100'), cart=anonymous)
+
+        self.client.post(reverse('login'), {'username': 'ivan', 'password': 'secret-pass-1'})
+
+        anonymous.refresh_from_db()
+        self.assertEqual((anonymous.user, anonymous.session_key), (self.user, None))
+        self.assertEqual(anonymous.items.count(), 2)
+        order.refresh_from_db()
+        self.assertEqual(order.user, self.user)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for lines in (1, 10, 50):
+            user = User.objects.create_user(f'user{lines}')
+            # Половина строк совпадает с корзиной пользователя, половина новая
+            fill_cart(Cart.objects.create(user=user), self.pizzas[:lines], quantity=1)
+            anonymous = Cart.objects.create(session_key=f'session{lines}')
+            fill_cart(anonymous, self.pizzas[lines // 2:lines // 2 + lines], quantity=1)
+            with CaptureQueriesContext(connection) as queries:
+                cart = merge_carts(anonymous.session_key, user)
+            counts.append(len(queries))
+            self.assertEqual(cart.items.count(), lines // 2 + lines)
+        self.assertEqual(len(set(counts)), 1, counts)
+
+
+class CartCleanupTests(TestCase):
+    def make_session(self, key, expires_in):
+        return Session.objects.create(session_key=key, session_data='', expire_date=timezone.now() + expires_in)
+
+    def test_collects_abandoned_carts_and_expired_sessions(self):
+        pizzas = make_pizzas(2)
+        self.make_session('live', timedelta(days=1))
+        self.make_session('expired', -timedelta(days=1))
+        self.make_session('idle', timedelta(days=1))
+        user = User.objects.create_user('ivan')
+
+        kept = [Cart.objects.create(session_key='live'), Cart.objects.create(user=user)]
+        removed = [Cart.objects.create(session_key=key) for key in ('expired', 'missing', 'idle')]
+        Cart.objects.filter(session_key='idle').update(updated_at=timezone.now() - timedelta(days=31))
+        for cart in kept + removed:
+            fill_cart(cart, pizzas)
+        order = Order.objects.create(name='Иван', phone='1', address='ул. Ленина, 1',
+                                     total_price=Decimal('100'), cart=removed[0])
+
+        out = StringIO()
+        call_command('cleanup_carts', ttl_days=30, batch_size=2, pause=0, stdout=out)
+
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {cart.id for cart in kept})
+        self.assertEqual(CartItem.objects.count(), 4)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True).order_by('pk')),
+                         ['idle', 'live'])
+        order.refresh_from_db()
+        self.assertIsNone(order.cart)
+        self.assertIn('удалено корзин 3, строк корзин 6, сессий 1', out.getvalue())
+
+    @override_settings(CART_GC_INTERVAL=3600)
+    def test_periodic_collector_starts_only_from_serving_entry_point(self):
+        self.assertIsNone(cleanup._collector)
+
+        apps.get_app_config('pizzeria').ready()
+        self.assertIsNone(cleanup._collector)
+
+        importlib.reload(importlib.import_module('pizzahunt.wsgi'))
+        collector = cleanup._collector
+        self.addCleanup(setattr, cleanup, '_collector', None)
+        self.addCleanup(collector.stop)
+        self.assertIsNotNone(collector)
+
+
+# Путь к JSON-отчёту о бюджетах; без переменной отчёт не пишется
+BUDGET_REPORT = os.environ.get('PIZZAHUNT_BUDGET_REPORT')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EndpointBudgetTests(TestCase):
+    """Бюджет SQL-запросов на каждый адрес из pizzeria/urls.py.
+
+    Адреса, зависящие от корзины, проверяются при 1, 10 и 50 строках:
+    число запросов не должно меняться. Время ответа и число запросов
+    записываются в JSON-отчёт по пути из PIZZAHUNT_BUDGET_REPORT (если
+    переменная задана), который удобно сравнивать между коммитами.
+    """
+
+    CART_SIZES = (1, 10, 50)
+    AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+    # имя: (роль, метод, адрес, данные, зависит ли от корзины, бюджет запросов)
+    ENDPOINTS = {
+        'home': ('customer', 'get', '/', None, True, 4),
+        'about': ('customer', 'get', '/about/', None, True, 4),
+        'menu': ('customer', 'get', '/menu/', None, True, 4),
+        'menu filtered': ('customer', 'get', '/menu/?category=cheese&sort=price-asc', None, True, 4),
+        'menu search': ('customer', 'get', '/menu/search/?q=пицца', None, True, 4),
+        'menu search json': ('customer', 'get', '/menu/search/?q=пиц&format=json', None, False, 0),
+        'feedback': ('customer', 'get', '/feedback/', None, True, 4),
+        'cart': ('customer', 'get', '/cart/', None, True, 4),
+        'cart add': ('customer', 'ajax', '/cart/add/',
+                     {'item_type': 'pizza', 'item_id': '{pizza_id}', 'size': '40'}, True, 9),
+        'cart update': ('customer', 'ajax', '/cart/update/', {'item_id': '{item_id}', 'quantity': 3}, True, 6),
+        'cart remove': ('customer', 'ajax', '/cart/remove/{item_id}/', {}, True, 6),
+        'cart batch': ('customer', 'json', '/cart/batch/', {'operations': [
+            {'op': 'add', 'item_type': 'pizza', 'item_id': '{pizza_id}', 'size': '40'},
+            {'op': 'add', 'item_type': 'pizza', 'item_id': '{pizza_id}', 'size': '40'},
+            {'op': 'update', 'item_id': '{item_id}', 'quantity': 3},
+            {'op': 'remove', 'item_id': '{item_id}'},
+        ]}, True, 9),
+        'cart clear': ('customer', 'post', '/cart/clear/', {}, True, 4),
+        'order form': ('customer', 'get', '/order/', None, True, 4),
+        'order submit': ('customer', 'post', '/order/', OrderPlacementTests.ORDER_DATA, True, 17),
+        'order success': ('customer', 'get', '/order/success/', None, True, 4),
+        'order detail': ('customer', 'get', '/order/{order_id}/', None, True, 6),
+        'register': ('anonymous', 'get', '/register/', None, False, 3),
+        'login': ('anonymous', 'get', '/login/', None, False, 3),
+        'login submit': ('anonymous', 'post', '/login/',
+                         {'username': 'customer', 'password': 'secret-pass-1'}, True, 26),
+        'logout': ('customer', 'get', '/logout/', None, False, 4),
+        'profile': ('customer', 'get', '/profile/', None, True, 8),
+        'profile edit': ('customer', 'get', '/profile/edit/', None, True, 5),
+        'order history': ('customer', 'get', '/profile/orders/', None, True, 6),
+        'order history json': ('customer', 'get', '/profile/orders/?format=json', None, False, 4),
+        'admin dashboard': ('staff', 'get', '/myadmin/dashboard/', None, False, 10),
+        'admin stats': ('staff', 'get', '/myadmin/stats/?range=week', None, False, 8),
+        'admin perf': ('staff', 'get', '/myadmin/perf/', None, False, 3),
+        'admin orders export': ('staff', 'get', '/myadmin/orders/export/?format=jsonl&status=new', None, False, 2),
+        'admin kitchen': ('staff', 'get', '/myadmin/kitchen/', None, False, 3),
+        'admin kitchen take': ('staff', 'post', '/myadmin/kitchen/', {'action': 'take'}, False, 6),
+        'admin kitchen state': ('staff', 'get', '/myadmin/kitchen/state/', None, False, 4),
+    }
+    SKIPPED = {
+        # Бесконечные потоки SSE; проверяются в LiveStatsEndpointTests
+        'admin_stats_stream', 'admin_kitchen_stream',
+        # Шаблонов pizzeria/auth/password_reset*.html в проекте пока нет
+        'password_reset', 'password_reset_done', 'password_reset_confirm', 'password_reset_complete',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Сырные', slug='cheese')
+        cls.pizzas = [
+            Pizza.objects.create(
+                name=f'Пицца {i}', slug=f'pizza-{i}', description='Описание', ingredients='Тесто, сыр',
+                category=category, price_30=Decimal('400'), price_35=Decimal('500'), price_40=Decimal('600'),
+                is_popular=i % 3 == 0, is_new=i % 5 == 0, order=i,
+            )
+            for i in range(60)
+        ]
+        for i in range(4):
+            Combo.objects.create(name=f'Комбо {i}', description='', price=Decimal('900'), includes='', order=i)
+            Promotion.objects.create(title=f'Акция {i}', description='', end_date=timezone.now() + timedelta(days=7))
+
+        cls.customer = User.objects.create_user('customer', password='secret-pass-1')
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cart = Cart.objects.create(user=cls.customer)
+        for i in range(30):
+            order = Order.objects.create(name='Иван', phone='1', address='ул. Ленина, 1',
+                                         total_price=Decimal('1000'), cart=cart, user=cls.customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, item_type='pizza', item_name=pizza.name, size='30',
+                          quantity=1, unit_price=Decimal('500'), total_price=Decimal('500'))
+                for pizza in cls.pizzas[i:i + 2]
+            ])
+        cls.order = order
+        User.objects.bulk_create([User(username=f'user{i}') for i in range(20)])
+
+    def setUp(self):
+        invalidate_catalog()
+        invalidate_search_index()
+
+    def prepare(self, role, lines):
+        """Новый клиент нужной роли и корзина из lines строк"""
+        client = self.client_class()
+        cart = Cart.objects.get(user=self.customer)
+        CartItem.objects.filter(cart=cart).delete()
+        fill_cart(cart, self.pizzas[:lines], quantity=1)
+        if role == 'customer':
+            client.force_login(self.customer)
+        elif role == 'staff':
+            client.force_login(self.staff)
+        else:
+            # Анонимная корзина того же размера: при входе её нужно слить
+            session = client.session
+            session.save()
+            Cart.objects.filter(user__isnull=True).delete()
+            fill_cart(Cart.objects.create(session_key=session.session_key),
+                      self.pizzas[lines // 2:lines // 2 + lines], quantity=1)
+        return client, {
+            'pizza_id': self.pizzas[-1].id,
+            'item_id': CartItem.objects.filter(cart=cart).values_list('id', flat=True).first(),
+            'order_id': self.order.id,
+        }
+
+    def fill(self, data, values):
+        if isinstance(data, dict):
+            return {key: self.fill(value, values) for key, value in data.items()}
+        if isinstance(data, list):
+            return [self.fill(value, values) for value in data]
+        return str(data).format(**values)
+
+    def request(self, client, method, url, data):
+        if method == 'get':
+            return client.get(url)
+        if method == 'ajax':
+            return client.post(url, data, headers=self.AJAX)
+        if method == 'json':
+            return client.post(url, json.dumps(data), content_type='application/json', headers=self.AJAX)
+        return client.post(url, data)
+
+    def measure(self, name, lines):
+        role, method, url, data, _, _ = self.ENDPOINTS[name]
+        client, values = self.prepare(role, lines)
+        url = url.format(**values)
+        data = self.fill(data or {}, values)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self.request(client, method, url, data)
+            elapsed = time.perf_counter() - started
+        self.assertLess(response.status_code, 400, f'{name}: {response.status_code}')
+        return {'status': response.status_code, 'queries': len(queries), 'ms': round(elapsed * 1000, 2)}
+
+    def test_every_route_is_covered(self):
+        names = {pattern.name for pattern in get_resolver('pizzeria.urls').url_patterns}
+        urls = {self.ENDPOINTS[name][2].split('?')[0] for name in self.ENDPOINTS}
+        for pattern in get_resolver('pizzeria.urls').url_patterns:
+            if pattern.name in self.SKIPPED:
+                continue
+            route = '/' + str(pattern.pattern)
+            with self.subTest(pattern.name):
+                self.assertTrue(any(re.fullmatch(re.sub(r'<[^>]+>', '[^/]+', route), url) for url in urls), route)
+        self.assertTrue(self.SKIPPED <= names)
+
+    def test_query_budgets(self):
+        report = {}
+        for name, (_, _, _, _, sized, budget) in self.ENDPOINTS.items():
+            sizes = self.CART_SIZES if sized else self.CART_SIZES[:1]
+            # Прогрев: снимок каталога, поисковый индекс и строки сводок
+            # продаж за сегодня, которые создаёт первый заказ дня
+            self.measure(name, self.CART_SIZES[-1])
+            results = {lines: self.measure(name, lines) for lines in sizes}
+            report[name] = {
+                'budget': budget,
+                'cart_lines': {str(lines): result for lines, result in results.items()},
+            }
+            counts = {result['queries'] for result in results.values()}
+            with self.subTest(name):
+                self.assertEqual(len(counts), 1, f'{name}: число запросов зависит от размера корзины {results}')
+                self.assertLessEqual(max(counts), budget, f'{name}: {results}')
+
+        if BUDGET_REPORT:
+            with open(BUDGET_REPORT, 'w', encoding='utf-8') as report_file:
+                json.dump(report, report_file, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+@override_settings(SERVER_TIMING_HEADER=True)
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        make_pizzas(3)
+        instrumentation.registry.reset()
+
+    def test_server_timing_header_and_registry(self):
+        response = self.client.get(reverse('menu'))
+        header = response['Server-Timing']
+        self.assertRegex(header, r'db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, '
+                                 r'cache;desc="hit \d+ miss \d+", total;dur=[\d.]+')
+        self.assertGreater(float(re.search(r'tpl;dur=([\d.]+)', header).group(1)), 0)
+
+        for _ in range(19):
+            self.client.get(reverse('menu'))
+        row = next(row for row in instrumentation.registry.snapshot() if row['route'] == 'menu')
+        self.assertEqual((row['count'], sum(row['histogram'])), (20, 20))
+        self.assertLessEqual(row['p50'], row['p95'])
+        self.assertLessEqual(row['p95'], row['p99'])
+
+    def test_header_is_off_by_default_and_classes_are_not_patched(self):
+        with override_settings(SERVER_TIMING_HEADER=False):
+            response = self.client.get(reverse('menu'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(instrumentation.registry.snapshot()[0]['route'], 'menu')
+        cache = caches['default']
+        self.assertTrue(cache.get._pizzeria_counted)
+        self.assertFalse(hasattr(type(cache).get, '_pizzeria_counted'))
+
+    def test_query_count_matches_captured_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart'))
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+
+    def test_async_view_queries_are_counted(self):
+        pizza = Pizza.objects.first()
+        with override_settings(ROOT_URLCONF=async_cart_urls):
+            response = async_to_sync(self.async_client.post)(
+                '/cart/add/', {'item_type': 'pizza', 'item_id': pizza.id}, headers={'X-Requested-With': 'XMLHttpRequest'},
+            )
+        queries = int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+        self.assertGreater(queries, 0)
+
+    def test_perf_page_is_staff_only(self):
+        self.client.get(reverse('menu'))
+        self.assertEqual(self.client.get(reverse('admin_perf')).status_code, 302)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('admin_perf'))
+        self.assertContains(response, '<code>menu</code>', html=False)
+        data = self.client.get(reverse('admin_perf'), {'format': 'json'}).json()
+        self.assertIn('menu', [row['route'] for row in data['routes']])
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name, IMAGE_DERIVATIVE_WIDTHS=(320, 640))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, width=800, height=600, name='photo.png'):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGBA', (width, height), (200, 30, 30, 255)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_upload_builds_derivatives_off_request_thread(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            combo = Combo.objects.create(name='Комбо', description='', price=Decimal('900'),
+                                         includes='', image=self.upload())
+        images.wait_pending(10)
+
+        from PIL import Image
+        for width in (320, 640):
+            for fmt in ('webp', 'jpeg'):
+                with default_storage.open(images.derivative_name(combo.image.name, width, fmt)) as file:
+                    self.assertEqual(Image.open(file).size, (width, width * 3 // 4))
+        srcset = combo.image_srcset
+        self.assertRegex(srcset['webp'], r'^/media/combos/derivatives/photo\S*-320w\.webp 320w, \S+-640w\.webp 640w$')
+        self.assertIn('640w.jpg 640w', srcset['jpeg'])
+
+        invalidate_catalog()
+        self.assertEqual(get_catalog().get_combo(combo.id).image_srcset, srcset)
+
+    def test_small_images_are_not_upscaled_and_resave_does_not_rebuild(self):
+        profile = User.objects.create_user('ivan').profile
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            profile.avatar = self.upload(400, 400)
+            profile.save()
+        images.wait_pending(10)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(profile.avatar_srcset['webp'].count('w,'), 0)
+        self.assertIn('320w.webp 320w', profile.avatar_srcset['webp'])
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            profile.save()
+        self.assertEqual(callbacks, [])
+
+    def test_originals_differing_only_in_extension_get_separate_derivatives(self):
+        self.assertEqual(images.derivative_name('promotions/photo.png', 320, 'webp'),
+                         'promotions/derivatives/photo.png-320w.webp')
+        self.assertNotEqual(images.derivative_name('promotions/photo.jpg', 320, 'webp'),
+                            images.derivative_name('promotions/photo.png', 320, 'webp'))
+
+    def test_command_builds_existing_media(self):
+        name = default_storage.save('promotions/old.png', self.upload())
+        Promotion.objects.create(title='Акция', description='', image=name,
+                                 end_date=timezone.now() + timedelta(days=1))
+        out = StringIO()
+        call_command('build_image_derivatives', workers=2, stdout=out)
+        self.assertIn('записано копий 4', out.getvalue())
+        self.assertTrue(default_storage.exists(images.derivative_name(name, 640, 'webp')))
+
+
+class StaticAssetTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        override = override_settings(STATIC_ROOT=self.root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(self.root.name, 'staticfiles.json')) as file:
+            self.paths = json.load(file)['paths']
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        hashed = self.paths['css/main.css']
+        self.assertRegex(hashed, r'^css/main\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.root.name, hashed), 'rb') as original, \
+                open(os.path.join(self.root.name, hashed + '.gz'), 'rb') as compressed:
+            self.assertEqual(gzip.decompress(compressed.read()), original.read())
+        # Картинки уже сжаты: копии для них не пишутся
+        image = next(name for name in self.paths.values() if name.endswith('.jpg'))
+        self.assertFalse(os.path.exists(os.path.join(self.root.name, image + '.gz')))
+        # Ссылки внутри CSS переписаны на имена с хешем
+        with open(os.path.join(self.root.name, self.paths['css/about.css'])) as file:
+            self.assertIn(self.paths['images/about-hero.jpg'].split('/')[-1], file.read())
+
+    def test_serving_negotiates_encoding_and_caches_hashed_names(self):
+        url = '/static/' + self.paths['css/main.css']
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Cache-Control'], staticfiles.IMMUTABLE)
+        self.assertIn(b'body', gzip.decompress(b''.join(response.streaming_content)))
+
+        plain = self.client.get(url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(self.client.get('/static/css/main.css')['Cache-Control'], staticfiles.REVALIDATE)
+
+        not_modified = self.client.get(url, headers={'If-Modified-Since': plain['Last-Modified']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['Vary'], 'Accept-Encoding')
+        self.assertEqual(not_modified['Cache-Control'], staticfiles.IMMUTABLE)
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 400)
+        self.assertEqual(self.client.get(url + '.gz').status_code, 404)
+
+    def test_accept_encoding_q_values(self):
+        for header, expected in [
+            ('gzip, deflate', {'gzip'}),
+            ('gzip;q=0', set()),
+            ('GZIP; q=0.5, br;q=0', {'gzip'}),
+            ('*', {'gzip', 'br'}),
+            ('*;q=0.1, gzip;q=0', {'br'}),
+            ('xgzip, gzip;q=bad', set()),
+            ('', set()),
+        ]:
+            with self.subTest(header=header):
+                self.assertEqual(staticfiles.accepted_encodings(header), expected)
+
+        url = '/static/' + self.paths['css/main.css']
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ConditionalPageTests(TestCase):
+    ajax = {'headers': {'X-Requested-With': 'XMLHttpRequest'}}
+
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(2)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, headers={'If-None-Match': response['ETag']})
+
+    def test_repeat_visit_gets_304_without_queries(self):
+        for url in ('/', '/menu/?sort=name', '/about/'):
+            with self.subTest(url):
+                first = self.client.get(url)
+                self.assertEqual(first.status_code, 200)
+                self.assertIn('Cookie', first['Vary'])
+                self.assertIn('no-cache', first['Cache-Control'])
+                with self.assertNumQueries(0):
+                    second = self.revalidate(url, first)
+                self.assertEqual(second.status_code, 304)
+                self.assertEqual(second['ETag'], first['ETag'])
+                self.assertEqual(
+                    self.client.get(url, headers={'If-Modified-Since': first['Last-Modified']}).status_code, 304
+                )
+
+    def test_catalog_change_changes_etag(self):
+        first = self.client.get('/menu/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Pizza.objects.filter(pk=self.pizzas[0].pk).first().save()
+        self.assertEqual(self.revalidate('/menu/', first).status_code, 200)
+
+    def test_cart_and_login_change_etag(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_to_cart'), {'item_type': 'pizza', 'item_id': self.pizzas[0].id}, **self.ajax)
+        # Первый ответ для новой сессии запоминает её владельца
+        self.assertFalse(self.client.get('/').has_header('ETag'))
+        page = self.client.get('/')
+        self.assertEqual(self.revalidate('/', page).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_to_cart'), {'item_type': 'pizza', 'item_id': self.pizzas[1].id}, **self.ajax)
+        changed = self.revalidate('/', page)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], page['ETag'])
+
+        User.objects.create_user('ivan', password='secret-pass-1')
+        self.client.login(username='ivan', password='secret-pass-1')
+        self.assertEqual(self.revalidate('/', changed).status_code, 200)
+
+    def test_pending_messages_disable_304(self):
+        feedback = {'name': 'Иван', 'email': 'ivan@example.com', 'phone': '', 'subject': Feedback.SUBJECT_CHOICES[0][0],
+                    'message': 'Спасибо'}
+        for storage in ('fallback.FallbackStorage', 'session.SessionStorage'):
+            with self.subTest(storage), override_settings(MESSAGE_STORAGE=f'django.contrib.messages.storage.{storage}'):
+                self.client = self.client_class()
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(reverse('add_to_cart'), {'item_type': 'pizza', 'item_id': self.pizzas[0].id},
+                                     **self.ajax)
+                self.client.get('/about/')
+                page = self.client.get('/about/')
+                self.assertEqual(self.revalidate('/about/', page).status_code, 304)
+                # Сообщение лежит в cookie или только в сессии
+                self.client.post(reverse('feedback'), feedback)
+                self.assertEqual(self.revalidate('/about/', page).status_code, 200)
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(3)
+        self.user = User.objects.create_user('ivan', password='secret-pass-1')
+        self.client.force_login(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        fill_cart(self.cart, self.pizzas[:2], size='30', quantity=1)
+        self.first, self.second = self.cart.items.order_by('id')
+
+    def batch(self, *operations):
+        return self.client.post(reverse('batch_cart'), json.dumps({'operations': list(operations)}),
+                                content_type='application/json')
+
+    def test_operations_apply_in_order_and_coalesce(self):
+        response = self.batch(
+            {'op': 'add', 'item_type': 'pizza', 'item_id': self.pizzas[2].id, 'size': '40'},
+            {'op': 'add', 'item_type': 'pizza', 'item_id': self.pizzas[2].id, 'size': '40', 'quantity': 2},
+            {'op': 'add', 'item_type': 'pizza', 'item_id': self.pizzas[0].id, 'size': '30'},
+            {'op': 'update', 'item_id': self.first.id, 'quantity': 5},
+            {'op': 'update', 'item_id': self.second.id, 'quantity': 0},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['cart_quantity'], 8)
+        self.assertEqual(data['items'][str(self.first.id)], 2000.0)
+        lines = {(line.pizza_id, line.size): line.quantity for line in self.cart.items.all()}
+        self.assertEqual(lines, {(self.pizzas[0].id, '30'): 5, (self.pizzas[2].id, '40'): 3})
+
+    def test_invalid_operation_rejects_whole_batch(self):
+        stranger = Cart.objects.create(session_key='stranger')
+        foreign = CartItem.objects.create(cart=stranger, item_type='pizza', pizza=self.pizzas[0], size='30')
+        for bad in (
+            {'op': 'remove', 'item_id': foreign.id},
+            {'op': 'add', 'item_type': 'pizza', 'item_id': 999999},
+            {'op': 'add', 'item_type': 'pizza', 'item_id': self.pizzas[2].id, 'size': '99'},
+            {'op': 'explode'},
+        ):
+            with self.subTest(bad):
+                response = self.batch({'op': 'update', 'item_id': self.first.id, 'quantity': 7}, bad)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+                self.assertEqual(response.json()['cart_quantity'], 2)
+        self.assertTrue(CartItem.objects.filter(pk=foreign.pk).exists())
+        self.assertEqual(self.client.post(reverse('batch_cart'), 'not json',
+                                          content_type='application/json').status_code, 400)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('staff'))
+        now = timezone.now()
+        self.orders = []
+        for i in range(7):
+            order = Order.objects.create(name=f'Иван {i}', phone='1', address='ул. Ленина, 1',
+                                         total_price=Decimal('1000'), status='completed' if i % 2 else 'new',
+                                         payment_method='cash' if i < 5 else 'card_online')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, item_type='pizza', item_name=f'Пицца {j}', size='30',
+                          quantity=1, unit_price=Decimal('500'), total_price=Decimal('500'))
+                for j in range(i % 3)
+            ])
+            self.orders.append(order)
+        Order.objects.filter(pk=self.orders[0].pk).update(created_at=now - timedelta(days=10))
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    @override_settings(ORDER_EXPORT_CHUNK_SIZE=2)
+    def test_csv_streams_a_row_per_item_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin_orders_export'), {'format': 'csv'})
+            chunks = list(response.streaming_content)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(len(chunks), 4)
+        # Две выборки на порцию (заказы и позиции), а не запрос на заказ
+        self.assertLessEqual(len([q for q in queries if 'pizzeria_order' in q['sql']]), 8)
+
+        import csv
+        rows = list(csv.DictReader(StringIO(b''.join(chunks).decode().lstrip('\ufeff'))))
+        self.assertEqual(len(rows), sum(max(1, i % 3) for i in range(7)))
+        self.assertEqual([row['order_id'] for row in rows[:3]], [str(order.pk) for order in self.orders[:3]])
+        self.assertEqual(rows[0]['item_name'], '')
+
+    def test_jsonl_filters(self):
+        today = timezone.localdate().isoformat()
+        response = self.client.get(reverse('admin_orders_export'), {
+            'format': 'jsonl', 'date_from': today, 'date_to': today,
+            'status': 'completed', 'payment_method': ['cash', 'card_online'],
+        })
+        records = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([record['order_id'] for record in records], [self.orders[i].pk for i in (1, 3, 5)])
+        self.assertEqual(len(records[0]['items']), 1)
+        self.assertEqual(records[0]['items'][0]['unit_price'], '500.00')
+
+        response = self.client.get(reverse('admin_orders_export'), {'date_from': today, 'date_to': '2000-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_action(self):
+        response = self.client.post('/admin/pizzeria/order/', {
+            'action': 'export_jsonl', '_selected_action': [self.orders[1].pk, self.orders[2].pk],
+        })
+        self.assertEqual(len(self.read(response).splitlines()), 2)
+
+    def test_async_stream(self):
+        response = exports.export_response(Order.objects.all(), 'jsonl', asynchronous=True)
+
+        async def consume():
+            return [chunk async for chunk in response]
+        chunks = async_to_sync(consume)()
+        self.assertEqual(b''.join(chunks).decode().count('\n'), 7)
+
+
+class MenuSyncTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        invalidate_search_index()
+        self.pizzas = make_pizzas(3)
+        Combo.objects.create(name='Старое комбо', description='', price=Decimal('900'), includes='')
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w', encoding='utf-8') as menu_file:
+            menu_file.write(content if isinstance(content, str) else json.dumps(content, ensure_ascii=False))
+        return path
+
+    def sync(self, path, **options):
+        out = StringIO()
+        call_command('sync_menu', path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_dry_run_reports_without_writing(self):
+        path = self.write('menu.csv', 'slug,price_30,is_new\npizza-0,450,да\npizza-1,400.00,нет\n')
+        out = self.sync(path, dry_run=True)
+        self.assertIn('~ pizzas pizza-0: price_30: 400.00 -> 450, is_new: False -> True', out)
+        self.assertNotIn('pizza-1', out)
+        self.assertEqual(Pizza.objects.get(slug='pizza-0').price_30, Decimal('400'))
+
+    def test_apply_in_one_transaction_with_one_catalog_bump(self):
+        path = self.write('menu.json', {
+            'categories': [{'slug': 'classic', 'name': 'Классические'},
+                           {'slug': 'spicy', 'name': 'Острые', 'order': 2}],
+            'pizzas': [
+                {'slug': 'pizza-0', 'price_30': '450', 'price_35': '550', 'price_40': '650', 'order': 3},
+                {'slug': 'pizza-1', 'category': 'spicy', 'is_spicy': True},
+                {'slug': 'diablo', 'name': 'Дьябло', 'description': 'Острая', 'ingredients': 'Чили',
+                 'price_30': '500', 'price_35': '600', 'price_40': '700', 'category': 'spicy'},
+            ],
+            'combos': [{'name': 'Новое комбо', 'description': 'Две пиццы', 'price': '1200', 'includes': '2 пиццы'}],
+        })
+        before = get_catalog().version
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            # Удаление пиццы и комбо проверяет и связанные с ними акции
+            with self.assertNumQueries(18):
+                out = self.sync(path, delete=True)
+        self.assertEqual(len(callbacks), 1)
+        self.assertIn('pizzas: +1 ~2 -1', out)
+        self.assertIn('combos: +1 ~0 -1', out)
+
+        self.assertNotEqual(get_catalog().version, before)
+        self.assertEqual(Pizza.objects.get(slug='pizza-0').price_40, Decimal('650'))
+        self.assertEqual(Pizza.objects.get(slug='pizza-1').category.slug, 'spicy')
+        self.assertEqual(Pizza.objects.get(slug='diablo').category.slug, 'spicy')
+        self.assertFalse(Pizza.objects.filter(slug='pizza-2').exists())
+        self.assertEqual(list(Combo.objects.values_list('name', flat=True)), ['Новое комбо'])
+        self.assertEqual([pizza.name for pizza, _ in search_pizzas('дьябло')], ['Дьябло'])
+
+    def test_invalid_file_changes_nothing(self):
+        for content in (
+            'slug,price_30\npizza-0,дорого\n',
+            'slug,name\nnew-pizza,Новая\n',
+            'slug,category\npizza-0,nope\n',
+            'slug,price_30\npizza-0,1\npizza-0,2\n',
+        ):
+            with self.subTest(content):
+                with self.assertRaises(CommandError):
+                    self.sync(self.write('menu.csv', content))
+        with self.assertRaisesMessage(CommandError, 'pizza-0'):
+            self.sync(self.write('menu.json', {'categories': [{'slug': 'other', 'name': 'Другие'}]}), delete=True)
+        self.assertEqual(Pizza.objects.filter(price_30=Decimal('400')).count(), 3)
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(3)
+        self.combo = Combo.objects.create(name='Комбо', description='Две пиццы', price=Decimal('1000'),
+                                          includes='2 пиццы')
+        self.cart = Cart.objects.create(session_key='pricing')
+
+    def promotion(self, kind, **fields):
+        fields.setdefault('end_date', timezone.now() + timedelta(days=1))
+        return Promotion.objects.create(title=kind, description='', kind=kind, **fields)
+
+    def summary(self):
+        invalidate_catalog()
+        self.cart.invalidate_summary()
+        return self.cart.summary()
+
+    def test_best_line_rule_then_order_discount_and_delivery(self):
+        fill_cart(self.cart, self.pizzas[:2], size='30', quantity=3)
+        CartItem.objects.create(cart=self.cart, item_type='combo', combo=self.combo, quantity=1)
+        self.promotion('percent', value=Decimal('10'), target='pizza')
+        self.promotion('n_for_m', pizza=self.pizzas[0], buy_quantity=3, pay_quantity=2)
+        self.promotion('fixed', value=Decimal('150'), combo=self.combo)
+        self.promotion('order_fixed', value=Decimal('100'), min_subtotal=Decimal('2000'))
+        self.promotion('order_percent', value=Decimal('50'), min_subtotal=Decimal('5000'))
+        self.promotion('banner', value=Decimal('99'))
+
+        summary = self.summary()
+        # 3 x 400 по цене 2; 10% от 1200; 150 с комбо; затем 100 с заказа
+        self.assertEqual([line.discount for line in summary.quote.lines],
+                         [Decimal('400'), Decimal('120.00'), Decimal('150')])
+        self.assertEqual(summary.subtotal, Decimal('3400'))
+        self.assertEqual(summary.total_price, Decimal('2630.00'))
+        self.assertEqual(summary.discount_total, Decimal('770.00'))
+        self.assertEqual([d.title for d in summary.discounts], ['n_for_m', 'percent', 'fixed', 'order_fixed'])
+        self.assertEqual((summary.delivery_fee, summary.grand_total), (Decimal('0'), Decimal('2630.00')))
+
+    def test_rules_follow_promotion_changes_and_expiry(self):
+        fill_cart(self.cart, self.pizzas[:1], size='40', quantity=1)
+        self.assertEqual(self.summary().grand_total, Decimal('800'))
+
+        promotion = self.promotion('free_delivery', min_subtotal=Decimal('500'))
+        self.assertEqual(self.summary().delivery_fee, Decimal('0'))
+        promotion.min_subtotal = Decimal('700')
+        promotion.save()
+        self.assertEqual(self.summary().delivery_fee, Decimal('200'))
+
+        self.promotion('percent', value=Decimal('20'), size='40', end_date=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.summary().discount_total, Decimal('0'))
+
+    def test_views_and_order_use_quote(self):
+        user = User.objects.create_user('ivan', password='secret-pass-1')
+        self.client.force_login(user)
+        self.cart.user = user
+        self.cart.save()
+        fill_cart(self.cart, self.pizzas[:1], size='30', quantity=2)
+        self.promotion('percent', value=Decimal('25'), category=self.pizzas[0].category)
+        invalidate_catalog()
+
+        response = self.client.get(reverse('cart'))
+        self.assertContains(response, '600 ₽')
+        data = self.client.post(reverse('add_to_cart'), {'item_type': 'combo', 'item_id': self.combo.id},
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual((data['cart_subtotal'], data['discount'], data['cart_total']), (1800.0, 200.0, 1600.0))
+        self.assertEqual((data['delivery_fee'], data['grand_total']), (0.0, 1600.0))
+
+        self.client.post(reverse('order'), OrderPlacementTests.ORDER_DATA)
+        order = Order.objects.get()
+        self.assertEqual(order.total_price, Decimal('1600.00'))
+        self.assertEqual(sorted(order.items.values_list('total_price', flat=True)),
+                         [Decimal('600.00'), Decimal('1000.00')])
+
+    def test_invalid_rules_rejected(self):
+        for kind, fields in (
+            ('percent', {'value': Decimal('120')}),
+            ('n_for_m', {'buy_quantity': 2, 'pay_quantity': 2}),
+            ('fixed', {'value': Decimal('50'), 'target': 'combo', 'size': '30'}),
+        ):
+            with self.subTest(kind):
+                promotion = Promotion(title=kind, description='', end_date=timezone.now(), kind=kind, **fields)
+                with self.assertRaises(ValidationError):
+                    promotion.clean()
+
+    def test_invalid_n_for_m_is_rejected_by_db_and_skipped_by_rules(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.promotion('n_for_m', buy_quantity=0, pay_quantity=0)
+
+        # Строка в обход ограничения (например, из старой базы) не ломает расчёт
+        valid = self.promotion('n_for_m', pizza=self.pizzas[0], buy_quantity=2, pay_quantity=1)
+        catalog = get_catalog()
+        entry = next(entry for entry in catalog.promotions if entry.id == valid.id)
+        broken = entry._replace(id=0, buy_quantity=0, pay_quantity=0)
+        rules = pricing.RuleSet.compile(Catalog(catalog.version, catalog.categories, catalog.pizzas,
+                                                catalog.combos, (broken, entry)))
+        self.assertEqual([rule.promotion_id for rule in rules.pizza_rules[self.pizzas[0].id, '30']], [valid.id])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_pricing', iterations=50, stdout=out)
+        self.assertIn('Расчёт корзины из 50 строк', out.getvalue())
+
+
+class DatabaseMaintenanceTests(SimpleTestCase):
+    def connect(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        for suffix in ('', '-wal', '-shm'):
+            self.addCleanup(lambda name=path + suffix: os.path.exists(name) and os.remove(name))
+        wrapper = connections['default'].__class__({**connection.settings_dict, 'NAME': path, **settings.SQLITE_PRODUCTION},
+                                       alias='maintenance')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_production_profile_and_maintenance_steps(self):
+        db = self.connect()
+        self.assertEqual(maintenance.pragma(db, 'journal_mode'), 'wal')
+        self.assertEqual(maintenance.pragma(db, 'synchronous'), 1)
+        self.assertEqual(maintenance.pragma(db, 'busy_timeout'), 20000)
+        self.assertEqual(db.transaction_mode, 'IMMEDIATE')
+
+        with db.cursor() as cursor:
+            cursor.execute('CREATE TABLE junk (id INTEGER PRIMARY KEY, payload TEXT)')
+            cursor.executemany('INSERT INTO junk (payload) VALUES (%s)', [('x' * 1000,)] * 500)
+            cursor.execute('DELETE FROM junk')
+        self.assertGreater(maintenance.pragma(db, 'freelist_count'), 0)
+
+        steps = dict((name, result) for name, result, _ in maintenance.run(db))
+        self.assertEqual(steps['incremental_vacuum'], 'пропущено: auto_vacuum не INCREMENTAL')
+        self.assertIn('перенесено', steps['wal_checkpoint'])
+
+        maintenance.run(db, enable_incremental=True)
+        self.assertEqual(maintenance.pragma(db, 'auto_vacuum'), maintenance.AUTO_VACUUM_INCREMENTAL)
+        self.assertEqual(maintenance.pragma(db, 'freelist_count'), 0)
+
+    def test_invalid_checkpoint_mode(self):
+        with self.assertRaisesMessage(maintenance.MaintenanceError, 'checkpoint'):
+            maintenance.run(self.connect(), checkpoint='SOMETIMES')
+
+
+@override_settings(CART_STORAGE='cookie')
+class CartStorageTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        self.pizzas = make_pizzas(3)
+        self.client.defaults['HTTP_X_REQUESTED_WITH'] = 'XMLHttpRequest'
+
+    def add(self, pizza, size='30', quantity=1):
+        return self.client.post(reverse('add_to_cart'), {
+            'item_type': 'pizza', 'item_id': pizza.id, 'size': size, 'quantity': quantity,
+        })
+
+    def check_anonymous_cart(self):
+        self.add(self.pizzas[0])
+        self.add(self.pizzas[0])
+        response = self.add(self.pizzas[1], size='40')
+        self.assertEqual(response.json()['cart_quantity'], 3)
+        first, second = (line[0] for line in self.stored_lines())
+        self.client.post(reverse('update_cart'), {'item_id': first, 'quantity': 4})
+        response = self.client.post(reverse('remove_from_cart', args=[second]))
+        self.assertEqual(response.json()['cart_quantity'], 4)
+        response = self.client.post(reverse('batch_cart'), json.dumps({'operations': [
+            {'op': 'add', 'item_type': 'pizza', 'item_id': self.pizzas[2].id, 'size': '35'},
+        ]}), content_type='application/json')
+        self.assertEqual(response.json()['cart_quantity'], 5)
+
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+        page = self.client.get(reverse('cart'))
+        self.assertContains(page, self.pizzas[0].name)
+        self.assertContains(page, self.pizzas[2].name)
+        self.assertNotContains(page, self.pizzas[1].name)
+
+    def stored_lines(self):
+        request = RequestFactory().get('/')
+        request.COOKIES = {key: morsel.value for key, morsel in self.client.cookies.items()}
+        return cart_storage.get_store().load(request)['lines']
+
+    def test_cookie_cart_needs_no_database_rows(self):
+        self.check_anonymous_cart()
+
+    @override_settings(CART_STORAGE='cache', CART_CACHE_ALIAS='default')
+    def test_cache_cart_needs_no_database_rows(self):
+        self.check_anonymous_cart()
+
+    def test_login_moves_cart_to_database(self):
+        user = User.objects.create_user('ivan', password='secret-pass-1')
+        self.add(self.pizzas[0], quantity=2)
+        response = self.client.post(reverse('login'), {'username': 'ivan', 'password': 'secret-pass-1'})
+        self.assertEqual(response.status_code, 302)
+        cart = Cart.objects.get(user=user)
+        self.assertEqual([(item.pizza_id, item.quantity) for item in cart.items.all()], [(self.pizzas[0].id, 2)])
+        self.assertEqual(self.client.cookies[settings.CART_COOKIE_NAME].value, '')
+
+    def test_checkout_places_order_and_forgets_cart(self):
+        self.add(self.pizzas[0], size='35', quantity=2)
+        response = self.client.post(reverse('order'), OrderPlacementTests.ORDER_DATA,
+                                    HTTP_X_REQUESTED_WITH='')
+        self.assertRedirects(response, reverse('order_success'), fetch_redirect_response=False)
+        order = Order.objects.get()
+        self.assertEqual(order.total_price, Decimal('1000'))
+        self.assertEqual(self.client.cookies[settings.CART_COOKIE_NAME].value, '')
+        self.assertEqual(self.client.get(reverse('order_detail', args=[order.id])).status_code, 200)
+
+    def test_full_cart_cache_refuses_new_carts_instead_of_culling(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, True)
+        carts = {'BACKEND': 'pizzeria.cache_backends.PersistentFileBasedCache',
+                 'LOCATION': location, 'OPTIONS': {'MAX_ENTRIES': 2}}
+        with override_settings(CACHES={**settings.CACHES, 'carts': carts},
+                               CART_STORAGE='cache', CART_CACHE_ALIAS='carts'):
+            cache = caches['carts']
+            cache.set('expired', 1, timeout=-1)
+            guests = [self.client_class(headers={'X-Requested-With': 'XMLHttpRequest'}) for _ in range(3)]
+            self.client = guests[0]
+            self.assertTrue(self.add(self.pizzas[0]).json()['success'])
+            self.client = guests[1]
+            # Истёкшая запись освобождает место, живые корзины не трогаются
+            self.assertTrue(self.add(self.pizzas[1]).json()['success'])
+            self.client = guests[2]
+            response = self.add(self.pizzas[2])
+            self.assertFalse(response.json()['success'])
+            self.assertNotIn(settings.CART_COOKIE_NAME, response.cookies)
+            self.client = guests[0]
+            self.assertEqual(self.add(self.pizzas[0]).json()['cart_quantity'], 2)
+            self.assertEqual(len(self.stored_lines()), 1)
+            with self.assertRaises(cache_backends.CacheFull):
+                cache.set('another', 1)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.add(self.pizzas[0])
+        self.client.cookies[settings.CART_COOKIE_NAME] = self.client.cookies[settings.CART_COOKIE_NAME].value + 'x'
+        response = self.client.get(reverse('cart'))
+        self.assertNotContains(response, self.pizzas[0].name)
+
+
+class KitchenTests(TestCase):
+    def setUp(self):
+        invalidate_catalog()
+        self.now = timezone.now()
+
+    def place(self, minutes, *items, status='confirmed'):
+        order = Order.objects.create(name='Иван', phone='1', address='ул. Ленина, 1', total_price=Decimal('1000'),
+                                     status=status, promised_at=self.now + timedelta(minutes=minutes))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, item_type='pizza', item_name=name, size=size, quantity=quantity,
+                      unit_price=Decimal('500'), total_price=Decimal('500') * quantity)
+            for name, size, quantity in items
+        ])
+        return order
+
+    def test_queue_orders_synthetic_stream_by_promised_time(self):
+        rng = random.Random(7)
+        queue = kitchen.KitchenQueue(slot_seconds=60)
+        expected = {}
+        for order_id in range(1, 501):
+            # Поток с опозданиями, переносами и отменами вперемешку с извлечением
+            ticket = kitchen.Ticket(order_id, 'confirmed',
+                                    self.now + timedelta(seconds=rng.randint(-600, 5400)), '', ())
+            queue.push(ticket)
+            expected[order_id] = ticket
+            if rng.random() < 0.1:
+                moved = rng.choice(list(expected))
+                expected[moved] = expected[moved]._replace(promised_at=self.now + timedelta(minutes=rng.randint(0, 60)))
+                queue.push(expected[moved])
+            if rng.random() < 0.1:
+                cancelled = rng.choice(list(expected))
+                self.assertIs(queue.discard(cancelled), expected.pop(cancelled))
+            if rng.random() < 0.05:
+                first = queue.pop()
+                self.assertEqual(queue._slot(first), min(queue._slot(t) for t in list(expected.values())))
+                del expected[first.order_id]
+        self.assertEqual(len(queue), len(expected))
+        self.assertEqual({t.order_id for t in queue}, set(expected))
+
+        slots = []
+        while (ticket := queue.pop()) is not None:
+            self.assertIs(ticket, expected.pop(ticket.order_id))
+            slots.append(queue._slot(ticket))
+        self.assertEqual(slots, sorted(slots))
+        self.assertFalse(expected)
+        self.assertIsNone(queue.peek())
+
+    def test_queue_handles_far_future_and_rescheduled_tickets(self):
+        queue = kitchen.KitchenQueue(slot_seconds=60)
+        soon, later, far = (kitchen.Ticket(order_id, 'confirmed', self.now + delta, '', ())
+                            for order_id, delta in ((1, timedelta(minutes=5)), (2, timedelta(minutes=30)),
+                                                    (3, timedelta(days=30))))
+        queue.push(far)
+        queue.push(soon)
+        self.assertIs(queue.pop(), soon)
+        queue.push(later)
+        self.assertIs(queue.peek(), later)
+        self.assertEqual(list(queue), [later, far])
+
+        # Частые переносы не раздувают кучу устаревшими записями
+        for minutes in range(100):
+            later = later._replace(promised_at=self.now + timedelta(minutes=minutes))
+            queue.push(later)
+        self.assertLessEqual(len(queue._heap), 2 * len(queue) + 16)
+        self.assertEqual(list(queue), [later, far])
+        self.assertIs(queue.pop(), later)
+        self.assertIs(queue.pop(), far)
+        self.assertIsNone(queue.pop())
+
+    def test_plan_groups_identical_pizzas_into_oven_batches(self):
+        tickets = [
+            kitchen.Ticket(1, 'confirmed', self.now, '', (('pizza', 'Маргарита', '30', 4), ('combo', 'Комбо', '', 1))),
+            kitchen.Ticket(2, 'confirmed', self.now + timedelta(minutes=5), '',
+                           (('pizza', 'Маргарита', '30', 3), ('pizza', 'Маргарита', '40', 1))),
+            kitchen.Ticket(3, 'confirmed', self.now + timedelta(minutes=9), '', (('pizza', 'Маргарита', '30', 2),)),
+        ]
+        batches = [(b.name, b.size, b.quantity, b.orders) for b in kitchen.plan_batches(tickets, capacity=6)]
+        self.assertEqual(batches, [
+            ('Маргарита', '30', 6, ((1, 4), (2, 2))),
+            ('Маргарита', '30', 3, ((2, 1), (3, 2))),
+            ('Маргарита', '40', 1, ((2, 1),)),
+        ])
+
+    def test_board_takes_orders_and_reports_changes(self):
+        late = self.place(40, ('Маргарита', '30', 2))
+        early = self.place(10, ('Маргарита', '30', 1), ('Пепперони', '35', 1))
+        self.place(5, ('Маргарита', '30', 1), status='new')
+        board = kitchen.KitchenBoard(version=lambda: 1)
+
+        state = board.changes_since(None)
+        self.assertTrue(state['full'])
+        self.assertEqual({key for key in state['changes'] if key.startswith('order:')},
+                         {f'order:{late.id}', f'order:{early.id}'})
+        self.assertEqual(state['changes']['batches'][0]['orders'], [[early.id, 1], [late.id, 2]])
+        cursor = state['cursor']
+
+        self.assertEqual(board.take_next().order_id, early.id)
+        self.assertEqual(Order.objects.get(pk=early.id).status, 'preparing')
+        update = board.changes_since(cursor)
+        self.assertFalse(update['full'])
+        self.assertEqual(update['changes'][f'order:{early.id}']['status'], 'preparing')
+        self.assertNotIn(f'order:{late.id}', update['changes'])
+
+        self.assertTrue(board.mark_ready(early.id))
+        self.assertEqual(Order.objects.get(pk=early.id).status, 'delivering')
+        self.assertIsNone(board.changes_since(update['cursor'])['changes'][f'order:{early.id}'])
+        # Отмена в админке видна после сверки
+        Order.objects.filter(pk=late.id).update(status='cancelled')
+        board.refresh(force=True)
+        self.assertIsNone(board.take_next())
+        self.assertTrue(board.changes_since('other:1')['full'])
+
+    @override_settings(ASYNC_VIEWS=False)
+    def test_stream_is_disabled_under_wsgi(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get(reverse('admin_kitchen_stream')).status_code, 204)
+        self.assertContains(self.client.get(reverse('admin_kitchen')), 'window.EventSource && false')
+
+    def test_new_orders_get_promised_time_and_kitchen_is_staff_only(self):
+        order = self.place(0)
+        self.assertRedirects(self.client.get(reverse('admin_kitchen_state')),
+                             f"{reverse('admin:login')}?next={reverse('admin_kitchen_state')}",
+                             fetch_redirect_response=False)
+        pizzas = make_pizzas(1)
+        session = self.client.session
+        session.save()
+        fill_cart(Cart.objects.create(session_key=session.session_key), pizzas)
+        self.client.post(reverse('order'), OrderPlacementTests.ORDER_DATA)
+        placed = Order.objects.exclude(pk=order.pk).get()
+        self.assertAlmostEqual((placed.promised_at - placed.created_at).total_seconds(),
+                               settings.KITCHEN_PROMISE_MINUTES * 60, delta=5)
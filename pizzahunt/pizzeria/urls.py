@@ -1,4 +1,5 @@
 from django.urls import path
+from django.conf import settings
 from django.contrib.auth import views as auth_views
 from django.urls import reverse_lazy
 from . import views
@@ -9,7 +10,13 @@ from .views import (
     profile_view, 
     profile_edit_view, 
     admin_dashboard,
-    admin_stats_api
+    admin_stats_api,
+    admin_stats_stream,
+    admin_perf,
+    admin_orders_export,
+    admin_kitchen,
+    admin_kitchen_state,
+    admin_kitchen_stream,
 )
 from django.contrib.auth.decorators import user_passes_test
 
@@ -23,16 +30,34 @@ def admin_required(function=None):
         return actual_decorator(function)
     return actual_decorator
 
+# Под ASGI корзина обслуживается нативными async-представлениями
+if settings.ASYNC_VIEWS:
+    cart_views = {
+        'cart': views.cart_view_async,
+        'add': views.add_to_cart_view_async,
+        'update': views.update_cart_view_async,
+        'remove': views.remove_from_cart_view_async,
+    }
+else:
+    cart_views = {
+        'cart': views.cart_view,
+        'add': views.add_to_cart_view,
+        'update': views.update_cart_view,
+        'remove': views.remove_from_cart_view,
+    }
+
 urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
     path('about/', views.AboutView.as_view(), name='about'),
     path('menu/', views.MenuView.as_view(), name='menu'),
+    path('menu/search/', views.menu_search_view, name='menu_search'),
     path('feedback/', views.FeedbackView.as_view(), name='feedback'),
     
-    path('cart/', views.cart_view, name='cart'),
-    path('cart/add/', views.add_to_cart_view, name='add_to_cart'),
-    path('cart/update/', views.update_cart_view, name='update_cart'),
-    path('cart/remove/<int:item_id>/', views.remove_from_cart_view, name='remove_from_cart'),
+    path('cart/', cart_views['cart'], name='cart'),
+    path('cart/add/', cart_views['add'], name='add_to_cart'),
+    path('cart/update/', cart_views['update'], name='update_cart'),
+    path('cart/remove/<int:item_id>/', cart_views['remove'], name='remove_from_cart'),
+    path('cart/batch/', views.batch_cart_view, name='batch_cart'),
     path('cart/clear/', views.clear_cart_view, name='clear_cart'),
     
     path('order/', views.OrderCreateView.as_view(), name='order'),
@@ -45,6 +70,12 @@ urlpatterns = [
 
     path('myadmin/dashboard/', admin_dashboard, name='admin_dashboard'),
     path('myadmin/stats/', admin_stats_api, name='admin_stats'),
+    path('myadmin/stats/stream/', admin_stats_stream, name='admin_stats_stream'),
+    path('myadmin/perf/', admin_perf, name='admin_perf'),
+    path('myadmin/orders/export/', admin_orders_export, name='admin_orders_export'),
+    path('myadmin/kitchen/', admin_kitchen, name='admin_kitchen'),
+    path('myadmin/kitchen/state/', admin_kitchen_state, name='admin_kitchen_state'),
+    path('myadmin/kitchen/stream/', admin_kitchen_stream, name='admin_kitchen_stream'),
     
     path('password-reset/', 
          auth_views.PasswordResetView.as_view(
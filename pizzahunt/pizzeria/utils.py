@@ -1,8 +1,66 @@
-from .models import Cart, CartItem
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from . import cart_storage
+from .cart_storage import CartStoreError, build_cart, get_store
+from .conditional import atouch_cart, touch_cart
+from .kitchen import promised_from
+from .models import Cart, CartItem, CartSummary, Order, OrderItem
+from .rollups import record_order_items
+
+def _cart_owner_key(request, user):
+    if user.is_authenticated:
+        return ('user', user.pk)
+    return ('session', request.session.session_key)
+
+def _cached_cart(request, user):
+    cached = getattr(request, '_cart_cache', None)
+    if cached is not None and cached[0] == _cart_owner_key(request, user):
+        return cached[1]
+    return None
+
+def _remember_cart(request, user, cart):
+    request._cart_cache = (_cart_owner_key(request, user), cart)
+    return cart
+
+def _stored_cart(request, store):
+    cart = _cached_cart(request, request.user)
+    if cart is None:
+        cart = _remember_cart(request, request.user, build_cart(store.load(request)))
+    return cart
+
+def _change_stored_cart(request, store, operations, message):
+    """Изменить корзину из кеша или cookie (см. cart_storage); операции - как в пакете"""
+    try:
+        data, name = cart_storage.apply(store.load(request), _parse_cart_batch(operations))
+        store.save(request, data)
+    except (CartBatchError, CartStoreError) as error:
+        return False, str(error)
+    _remember_cart(request, request.user, build_cart(data))
+    return True, message.format(name=name)
 
 def get_cart(request):
-    """Получить или создать корзину для пользователя/сессии"""
-    cart = None
+    """Получить или создать корзину для пользователя/сессии.
+    
+    Корзина запоминается на объекте запроса, поэтому представление,
+    шаблоны и контекст-процессор работают с одним экземпляром и
+    одними посчитанными итогами. Для анонимных посетителей при
+    CART_STORAGE 'cache' или 'cookie' корзина собирается из хранилища
+    и в БД не пишется.
+    """
+    store = get_store(request.user)
+    if store is not None:
+        return _stored_cart(request, store)
+    
+    cart = _cached_cart(request, request.user)
+    if cart is not None and cart.pk is not None:
+        return cart
     
     if request.user.is_authenticated:
         cart, created = Cart.objects.get_or_create(user=request.user)
@@ -15,12 +73,45 @@ def get_cart(request):
         
         cart, created = Cart.objects.get_or_create(session_key=session_key)
     
-    return cart
+    return _remember_cart(request, request.user, cart)
+
+def peek_cart(request):
+    """Найти корзину только для чтения.
+    
+    Не создаёт ни сессию, ни строку корзины: если корзины ещё нет,
+    возвращается пустая несохранённая корзина. Настоящая корзина
+    появляется при первом добавлении товара через get_cart().
+    """
+    store = get_store(request.user)
+    if store is not None:
+        return _stored_cart(request, store)
+    
+    cart = _cached_cart(request, request.user)
+    if cart is not None:
+        return cart
+    
+    if request.user.is_authenticated:
+        cart = Cart.objects.filter(user=request.user).first() or Cart(user=request.user)
+    else:
+        session_key = request.session.session_key
+        cart = None
+        if session_key:
+            cart = Cart.objects.filter(session_key=session_key).first()
+        if cart is None:
+            cart = Cart(session_key=session_key)
+    
+    return _remember_cart(request, request.user, cart)
 
 def add_to_cart(request, item_type, item_id, size='30', quantity=1):
     """Добавить товар в корзину"""
     from .models import Pizza, Combo, CartItem
     
+    store = get_store(request.user)
+    if store is not None:
+        return _change_stored_cart(request, store, [{
+            'op': 'add', 'item_type': item_type, 'item_id': item_id, 'size': size, 'quantity': quantity,
+        }], "{name} добавлен(о) в корзину")
+    
     cart = get_cart(request)
     
     try:
@@ -55,6 +146,8 @@ def add_to_cart(request, item_type, item_id, size='30', quantity=1):
             cart_item.quantity += quantity
             cart_item.save()
         
+        cart.invalidate_summary()
+        touch_cart(cart)
         return True, f"{item_name} добавлен(о) в корзину"
     
     except (Pizza.DoesNotExist, Combo.DoesNotExist):
@@ -64,39 +157,505 @@ def add_to_cart(request, item_type, item_id, size='30', quantity=1):
 
 def update_cart_item(request, item_id, quantity):
     """Обновить количество товара в корзине"""
+    store = get_store(request.user)
+    if store is not None:
+        return _change_stored_cart(
+            request, store, [{'op': 'update', 'item_id': item_id, 'quantity': quantity}],
+            "Товар удален из корзины" if quantity <= 0 else "Количество обновлено",
+        )
+    
     try:
         cart_item = CartItem.objects.get(id=item_id)
         
-        cart = get_cart(request)
-        if cart_item.cart != cart:
+        cart = peek_cart(request)
+        if cart_item.cart_id != cart.id:
             return False, "Этот товар не в вашей корзине"
         
+        cart.invalidate_summary()
         if quantity <= 0:
             cart_item.delete()
+            touch_cart(cart)
             return True, "Товар удален из корзины"
         else:
             cart_item.quantity = quantity
             cart_item.save()
+            touch_cart(cart)
             return True, "Количество обновлено"
     except CartItem.DoesNotExist:
         return False, "Элемент корзины не найден"
 
 def remove_from_cart(request, item_id):
     """Удалить товар из корзины"""
+    store = get_store(request.user)
+    if store is not None:
+        return _change_stored_cart(request, store, [{'op': 'remove', 'item_id': item_id}], "Товар удален из корзины")
+    
     try:
         cart_item = CartItem.objects.get(id=item_id)
 
-        cart = get_cart(request)
-        if cart_item.cart != cart:
+        cart = peek_cart(request)
+        if cart_item.cart_id != cart.id:
             return False, "Этот товар не в вашей корзине"
         
         cart_item.delete()
+        cart.invalidate_summary()
+        touch_cart(cart)
         return True, "Товар удален из корзины"
     except CartItem.DoesNotExist:
         return False, "Элемент корзины не найден"
 
 def clear_cart(request):
     """Очистить корзину"""
-    cart = get_cart(request)
+    store = get_store(request.user)
+    if store is not None:
+        store.save(request, cart_storage.empty())
+        _remember_cart(request, request.user, build_cart(cart_storage.empty()))
+        return True, "Корзина очищена"
+    
+    cart = peek_cart(request)
+    if cart.pk is None:
+        return True, "Корзина очищена"
     cart.items.all().delete()
-    return True, "Корзина очищена"
\ No newline at end of file
+    cart.invalidate_summary()
+    touch_cart(cart)
+    return True, "Корзина очищена"
+
+# Пакет изменений корзины от cart-batch.js: быстрые клики на клиенте
+# копятся и приходят одним запросом
+
+CART_BATCH_LIMIT = 100
+
+class CartBatchError(Exception):
+    """Ошибка в пакете операций; пакет отклоняется целиком"""
+
+def _batch_int(value, message):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CartBatchError(message)
+
+def _parse_cart_batch(operations):
+    """Проверить пакет и привести операции к кортежам"""
+    if not isinstance(operations, list) or not operations:
+        raise CartBatchError("Пустой пакет операций")
+    if len(operations) > CART_BATCH_LIMIT:
+        raise CartBatchError(f"Не больше {CART_BATCH_LIMIT} операций за раз")
+    
+    from .models import Pizza
+    sizes = {size for size, _ in Pizza.SIZE_CHOICES}
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise CartBatchError("Некорректная операция")
+        kind = operation.get('op')
+        if kind == 'add':
+            item_type = operation.get('item_type')
+            if item_type not in ('pizza', 'combo'):
+                raise CartBatchError("Неизвестный тип товара")
+            size = str(operation.get('size', '30')) if item_type == 'pizza' else '30'
+            if size not in sizes:
+                raise CartBatchError("Неизвестный размер")
+            quantity = _batch_int(operation.get('quantity', 1), "Некорректное количество")
+            if quantity < 1:
+                raise CartBatchError("Некорректное количество")
+            item_id = _batch_int(operation.get('item_id'), "Товар не найден")
+            parsed.append(('add', item_type, item_id, size, quantity))
+        elif kind == 'update':
+            item_id = _batch_int(operation.get('item_id'), "Элемент корзины не найден")
+            quantity = _batch_int(operation.get('quantity'), "Некорректное количество")
+            parsed.append(('remove', item_id) if quantity <= 0 else ('update', item_id, quantity))
+        elif kind == 'remove':
+            parsed.append(('remove', _batch_int(operation.get('item_id'), "Элемент корзины не найден")))
+        else:
+            raise CartBatchError("Неизвестная операция")
+    return parsed
+
+def _line_key(line):
+    if line.item_type == 'pizza':
+        return ('pizza', line.pizza_id, line.size)
+    return ('combo', line.combo_id, '')
+
+def apply_cart_batch(request, operations):
+    """Применить пакет операций add/update/remove одной транзакцией.
+    
+    Операции выполняются по порядку над строками корзины в памяти, затем
+    изменения записываются: удаление, обновление количеств и вставка
+    новых строк - не больше одного запроса на каждый вид изменения,
+    сколько бы операций ни было в пакете. Ошибка в любой операции
+    отменяет весь пакет. Возвращает (success, message).
+    """
+    from .catalog import get_catalog
+    
+    store = get_store(request.user)
+    if store is not None:
+        return _change_stored_cart(request, store, operations, "Корзина обновлена")
+    
+    try:
+        parsed = _parse_cart_batch(operations)
+        catalog = get_catalog()
+        # Корзина создаётся вне транзакции, как в add_to_cart(): пустая
+        # корзина после отклонённого пакета ничему не мешает
+        if any(operation[0] == 'add' for operation in parsed):
+            cart = get_cart(request)
+        else:
+            cart = peek_cart(request)
+        
+        with transaction.atomic():
+            lines = {}
+            if cart.pk is not None:
+                lines = {line.id: line for line in CartItem.objects.filter(cart=cart)}
+            by_key = {_line_key(line): line for line in lines.values()}
+            removed, changed, created = set(), set(), []
+            
+            for operation in parsed:
+                if operation[0] == 'add':
+                    _, item_type, item_id, size, quantity = operation
+                    if item_type == 'pizza':
+                        product = catalog.get_pizza(item_id)
+                        key = ('pizza', item_id, size)
+                    else:
+                        product = catalog.get_combo(item_id)
+                        key = ('combo', item_id, '')
+                    if product is None:
+                        raise CartBatchError("Товар не найден")
+                    line = by_key.get(key)
+                    if line is None:
+                        line = CartItem(cart=cart, item_type=item_type, size=size, quantity=quantity)
+                        setattr(line, f'{item_type}_id', item_id)
+                        by_key[key] = line
+                        created.append(line)
+                    else:
+                        line.quantity += quantity
+                        if line.pk is not None:
+                            changed.add(line.pk)
+                else:
+                    line = lines.get(operation[1])
+                    if line is None or line.pk in removed:
+                        raise CartBatchError("Элемент корзины не найден")
+                    if operation[0] == 'update':
+                        line.quantity = operation[2]
+                        changed.add(line.pk)
+                    else:
+                        removed.add(line.pk)
+                        changed.discard(line.pk)
+                        del by_key[_line_key(line)]
+            
+            if removed:
+                CartItem.objects.filter(cart=cart, pk__in=removed).delete()
+            if changed:
+                CartItem.objects.bulk_update([lines[pk] for pk in changed], ['quantity'])
+            if created:
+                CartItem.objects.bulk_create(created)
+            if removed or changed or created:
+                touch_cart(cart)
+    except CartBatchError as error:
+        return False, str(error)
+    
+    cart.invalidate_summary()
+    return True, "Корзина обновлена"
+
+# Асинхронные варианты для работы под ASGI: те же операции через async ORM,
+# без занятия потока из пула sync_to_async на каждый клик по корзине
+
+async def aget_cart(request):
+    """Асинхронный вариант get_cart()"""
+    user = await request.auser()
+    if get_store(user) is not None:
+        return await sync_to_async(get_cart)(request)
+    cart = _cached_cart(request, user)
+    if cart is not None and cart.pk is not None:
+        return cart
+    
+    if user.is_authenticated:
+        cart, created = await Cart.objects.aget_or_create(user=user)
+    else:
+        if not request.session.session_key:
+            await request.session.acreate()
+        cart, created = await Cart.objects.aget_or_create(session_key=request.session.session_key)
+    
+    return _remember_cart(request, user, cart)
+
+async def apeek_cart(request):
+    """Асинхронный вариант peek_cart()"""
+    user = await request.auser()
+    if get_store(user) is not None:
+        return await sync_to_async(peek_cart)(request)
+    cart = _cached_cart(request, user)
+    if cart is not None:
+        return cart
+    
+    if user.is_authenticated:
+        cart = await Cart.objects.filter(user=user).afirst() or Cart(user=user)
+    else:
+        session_key = request.session.session_key
+        cart = None
+        if session_key:
+            cart = await Cart.objects.filter(session_key=session_key).afirst()
+        if cart is None:
+            cart = Cart(session_key=session_key)
+    
+    return _remember_cart(request, user, cart)
+
+async def aadd_to_cart(request, item_type, item_id, size='30', quantity=1):
+    """Асинхронный вариант add_to_cart()"""
+    from .models import Pizza, Combo
+    
+    if get_store(await request.auser()) is not None:
+        # Хранимая корзина меняется в памяти, но снимок каталога и файловый
+        # кеш синхронные
+        return await sync_to_async(add_to_cart)(request, item_type, item_id, size, quantity)
+    
+    cart = await aget_cart(request)
+    
+    try:
+        if item_type == 'pizza':
+            item = await Pizza.objects.aget(id=item_id)
+            cart_item, created = await CartItem.objects.aget_or_create(
+                cart=cart,
+                item_type='pizza',
+                pizza=item,
+                size=size,
+                defaults={'quantity': quantity}
+            )
+        elif item_type == 'combo':
+            item = await Combo.objects.aget(id=item_id)
+            cart_item, created = await CartItem.objects.aget_or_create(
+                cart=cart,
+                item_type='combo',
+                combo=item,
+                defaults={'quantity': quantity}
+            )
+        else:
+            return False, "Неизвестный тип товара"
+        
+        if not created:
+            cart_item.quantity += quantity
+            await cart_item.asave()
+        
+        cart.invalidate_summary()
+        await atouch_cart(cart)
+        return True, f"{item.name} добавлен(о) в корзину"
+    
+    except (Pizza.DoesNotExist, Combo.DoesNotExist):
+        return False, "Товар не найден"
+    except Exception as e:
+        return False, f"Ошибка: {str(e)}"
+
+async def aupdate_cart_item(request, item_id, quantity):
+    """Асинхронный вариант update_cart_item()"""
+    if get_store(await request.auser()) is not None:
+        return await sync_to_async(update_cart_item)(request, item_id, quantity)
+    
+    try:
+        cart_item = await CartItem.objects.aget(id=item_id)
+        
+        cart = await apeek_cart(request)
+        if cart_item.cart_id != cart.id:
+            return False, "Этот товар не в вашей корзине"
+        
+        cart.invalidate_summary()
+        if quantity <= 0:
+            await cart_item.adelete()
+            await atouch_cart(cart)
+            return True, "Товар удален из корзины"
+        else:
+            cart_item.quantity = quantity
+            await cart_item.asave()
+            await atouch_cart(cart)
+            return True, "Количество обновлено"
+    except CartItem.DoesNotExist:
+        return False, "Элемент корзины не найден"
+
+async def aremove_from_cart(request, item_id):
+    """Асинхронный вариант remove_from_cart()"""
+    if get_store(await request.auser()) is not None:
+        return await sync_to_async(remove_from_cart)(request, item_id)
+    
+    try:
+        cart_item = await CartItem.objects.aget(id=item_id)
+        
+        cart = await apeek_cart(request)
+        if cart_item.cart_id != cart.id:
+            return False, "Этот товар не в вашей корзине"
+        
+        await cart_item.adelete()
+        cart.invalidate_summary()
+        await atouch_cart(cart)
+        return True, "Товар удален из корзины"
+    except CartItem.DoesNotExist:
+        return False, "Элемент корзины не найден"
+
+def _same_line(cart):
+    """Строки корзины cart с тем же товаром, что у строки внешнего запроса"""
+    return CartItem.objects.filter(cart=cart).filter(
+        Q(pizza_id=OuterRef('pizza_id'), size=OuterRef('size')) | Q(combo_id=OuterRef('combo_id'))
+    )
+
+def merge_carts(session_key, user):
+    """Перенести анонимную корзину сессии в корзину пользователя при входе.
+    
+    session_key нужно запомнить до login(): при входе ключ сессии меняется.
+    Совпадающие строки (та же пицца и размер или то же комбо) складываются
+    по количеству, остальные переносятся, анонимная корзина удаляется.
+    Число запросов не зависит от количества строк. Заказы, оформленные
+    из анонимной корзины, закрепляются за пользователем. Возвращает
+    корзину пользователя или None, если переносить нечего.
+    """
+    if not session_key:
+        return None
+    anonymous = Cart.objects.filter(session_key=session_key, user__isnull=True).first()
+    if anonymous is None:
+        return None
+    
+    with transaction.atomic():
+        Order.objects.filter(cart=anonymous, user__isnull=True).update(user=user)
+        
+        user_cart = Cart.objects.select_for_update().filter(user=user).first()
+        if user_cart is None:
+            anonymous.user, anonymous.session_key = user, None
+            anonymous.save(update_fields=['user', 'session_key', 'updated_at'])
+            touch_cart(anonymous)
+            return anonymous
+        
+        same_in_anonymous = _same_line(anonymous)
+        CartItem.objects.filter(cart=user_cart).filter(Exists(same_in_anonymous)).update(
+            quantity=F('quantity') + Subquery(same_in_anonymous.values('quantity')[:1])
+        )
+        CartItem.objects.filter(cart=anonymous).exclude(Exists(_same_line(user_cart))).update(cart=user_cart)
+        # Оставшиеся (уже сложенные) строки удаляются каскадом вместе с корзиной
+        Cart.objects.filter(pk=anonymous.pk).delete()
+        user_cart.save(update_fields=['updated_at'])
+        touch_cart(user_cart)
+        return user_cart
+
+def promote_stored_cart(request, user):
+    """Перенести корзину из кеша или cookie в корзину пользователя при входе.
+    
+    Вызывается после login(), как и merge_carts(): совпадающие строки
+    складываются, хранилище очищается. Возвращает корзину пользователя
+    или None, если переносить нечего.
+    """
+    store = get_store()
+    if store is None:
+        return None
+    data = store.load(request)
+    if not data['lines']:
+        return None
+    cart, created = Cart.objects.get_or_create(user=user)
+    cart_storage.promote(data, cart)
+    store.save(request, cart_storage.empty())
+    return _remember_cart(request, user, cart)
+
+def checkout_cart(request):
+    """Корзина для place_order(): хранимая корзина сначала переносится в БД.
+    
+    Строки пишутся в корзину сессии взамен прежних, поэтому повторная
+    попытка оформления после ошибки не удваивает количества. Хранилище
+    очищает forget_stored_cart() после успешного заказа.
+    """
+    store = get_store(request.user)
+    if store is None:
+        return peek_cart(request)
+    data = store.load(request)
+    if not data['lines']:
+        return Cart()
+    if not request.session.session_key:
+        request.session.create()
+    cart, created = Cart.objects.get_or_create(session_key=request.session.session_key, user__isnull=True)
+    return cart_storage.promote(data, cart, replace=True)
+
+def forget_stored_cart(request):
+    """Очистить хранимую корзину после оформления заказа"""
+    store = get_store(request.user)
+    if store is not None:
+        store.save(request, cart_storage.empty())
+        request._cart_cache = None
+
+def place_order(cart, order):
+    """Оформить заказ из корзины одной транзакцией.
+    
+    Строки корзины читаются одним запросом вместе с товарами и ценами,
+    элементы заказа пишутся одним bulk_create, после чего корзина
+    очищается. Число запросов не зависит от размера корзины.
+    Возвращает сохранённый заказ или None, если корзина пуста.
+    """
+    if cart.pk is None:
+        return None
+    
+    with transaction.atomic():
+        # Первая запись в транзакции блокирует корзину: в SQLite она сразу
+        # берёт блокировку на запись, в других СУБД - блокировку строки
+        touched = Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+        if not touched:
+            return None
+        
+        summary = CartSummary(cart.items.with_prices().order_by('added_at', 'id'))
+        if not summary.lines:
+            return None
+        
+        order.cart = cart
+        order.total_price = summary.total_price
+        if order.promised_at is None:
+            order.promised_at = promised_from(timezone.now())
+        order.save()
+        
+        # Суммы позиций - после скидок на строку, сумма заказа - после всех
+        # скидок (без доставки), как в расчёте pricing.quote()
+        items = OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                item_type=line.item.item_type,
+                item_name=line.item.get_name(),
+                size=line.item.size if line.item.item_type == 'pizza' else '',
+                quantity=line.quantity,
+                unit_price=line.unit_price,
+                total_price=line.total,
+            )
+            for line in summary.quote.lines
+        ])
+        record_order_items(order, items)
+        
+        CartItem.objects.filter(cart=cart).delete()
+        touch_cart(cart)
+    
+    cart.invalidate_summary()
+    return order
+
+
+ORDER_PAGE_SIZE = 10
+
+def encode_order_cursor(order):
+    """Курсор страницы истории: позиция заказа в порядке (created_at, id)"""
+    return urlsafe_base64_encode(f'{order.created_at.isoformat()}|{order.id}'.encode())
+
+def decode_order_cursor(cursor):
+    """Разобрать курсор; для пустого или испорченного возвращает None"""
+    if not cursor:
+        return None
+    try:
+        created_at, order_id = force_str(urlsafe_base64_decode(cursor)).split('|')
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def order_page(queryset, cursor=None, page_size=ORDER_PAGE_SIZE):
+    """Страница заказов от новых к старым после курсора.
+    
+    Вместо OFFSET используется условие по (created_at, id), поэтому
+    дальние страницы читаются так же быстро, как первая. Строки заказов
+    подгружаются одним запросом на страницу. Возвращает пару
+    (заказы, курсор следующей страницы или None).
+    """
+    position = decode_order_cursor(cursor)
+    if position is not None:
+        created_at, order_id = position
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id)
+        )
+    orders = list(
+        queryset.order_by('-created_at', '-id').prefetch_related('items')[:page_size + 1]
+    )
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        return orders, encode_order_cursor(orders[-1])
+    return orders, None
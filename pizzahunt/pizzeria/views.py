@@ -1,14 +1,24 @@
+import json
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import TemplateView, ListView, CreateView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.http import JsonResponse
-from django.db.models import Q
+from django.db.models import Count, Q, Sum
+from django.template.loader import render_to_string
+from asgiref.sync import sync_to_async
 from .models import *
-from .forms import FeedbackForm, OrderForm, RegisterForm, LoginForm, ProfileForm, UserUpdateForm
+from .forms import FeedbackForm, OrderForm, OrderExportForm, RegisterForm, LoginForm, ProfileForm, UserUpdateForm
 from .utils import *
+from .catalog import get_catalog
+from .conditional import conditional_page
+from .search import search_pizzas
+from . import exports, kitchen, rollups, live
+from .instrumentation import HISTOGRAM_BOUNDS, registry as timing_registry
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
+from django.utils.decorators import method_decorator
 
 from django.contrib.admin.views.decorators import staff_member_required
 from datetime import timedelta, datetime, time
@@ -24,12 +34,10 @@ def register_view(request):
         if form.is_valid():
             user = form.save()
             
+            anonymous_key = request.session.session_key
             login(request, user)
-
-            cart = get_cart(request)
-            if cart and not cart.user:
-                cart.user = user
-                cart.save()
+            merge_carts(anonymous_key, user)
+            promote_stored_cart(request, user)
             
             messages.success(request, f'Добро пожаловать, {user.username}! Регистрация успешна.')
             return redirect('profile')
@@ -46,12 +54,10 @@ def login_view(request):
         form = LoginForm(data=request.POST)
         if form.is_valid():
             user = form.get_user()
+            anonymous_key = request.session.session_key
             login(request, user)
-            
-            cart = get_cart(request)
-            if cart and not cart.user:
-                cart.user = user
-                cart.save()
+            merge_carts(anonymous_key, user)
+            promote_stored_cart(request, user)
             
             messages.success(request, f'Добро пожаловать, {user.username}!')
             next_url = request.GET.get('next', 'profile')
@@ -69,9 +75,14 @@ def logout_view(request):
 
 @login_required
 def profile_view(request):
-    orders = Order.objects.filter(cart__user=request.user).order_by('-created_at')[:5]
+    user_orders = Order.objects.filter(user=request.user)
+    orders, next_cursor = order_page(user_orders, page_size=5)
+    totals = user_orders.aggregate(count=Count('id'), spent=Sum('total_price'))
     return render(request, 'pizzeria/profile.html', {
         'orders': orders,
+        'has_more_orders': next_cursor is not None,
+        'orders_count': totals['count'],
+        'total_spent': totals['spent'],
     })
 
 @login_required
@@ -96,71 +107,110 @@ def profile_edit_view(request):
 
 @login_required
 def order_history_view(request):
-    orders = Order.objects.filter(cart__user=request.user).order_by('-created_at')
+    """История заказов по страницам; для бесконечной прокрутки - JSON с HTML-фрагментом"""
+    orders, next_cursor = order_page(
+        Order.objects.filter(user=request.user),
+        cursor=request.GET.get('cursor'),
+    )
+    
+    if request.GET.get('format') == 'json' or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'html': render_to_string('pizzeria/partials/order_list.html', {'orders': orders}, request=request),
+            'next_cursor': next_cursor,
+        })
+    
     return render(request, 'pizzeria/order_history.html', {
         'orders': orders,
+        'next_cursor': next_cursor,
     })
 
 
+@method_decorator(conditional_page, name='dispatch')
 class HomeView(TemplateView):
     template_name = 'pizzeria/index.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['popular_pizzas'] = Pizza.objects.filter(is_popular=True)[:8]
-        context['new_pizzas'] = Pizza.objects.filter(is_new=True)[:4]
-        context['combos'] = Combo.objects.all()[:4]
-        context['promotions'] = Promotion.objects.filter(is_active=True)[:3]
+        catalog = get_catalog()
+        context['popular_pizzas'] = catalog.popular_pizzas[:8]
+        context['new_pizzas'] = catalog.new_pizzas[:4]
+        context['combos'] = catalog.combos[:4]
+        context['promotions'] = catalog.promotions[:3]
         return context
 
+@method_decorator(conditional_page, name='dispatch')
 class AboutView(TemplateView):
     template_name = 'pizzeria/about.html'
 
+@method_decorator(conditional_page, name='dispatch')
 class MenuView(ListView):
     model = Pizza
     template_name = 'pizzeria/menu.html'
     context_object_name = 'pizzas'
     
     def get_queryset(self):
-        queryset = super().get_queryset()
+        catalog = get_catalog()
+        pizzas = list(catalog.pizzas)
         category = self.request.GET.get('category')
         sort = self.request.GET.get('sort', 'popular')
         
         # Фильтрация по категории
         if category and category != 'all':
             if category == 'meat':
-                queryset = queryset.filter(~Q(is_vegetarian=True))
+                pizzas = [p for p in pizzas if not p.is_vegetarian]
             elif category == 'vegetarian':
-                queryset = queryset.filter(is_vegetarian=True)
+                pizzas = [p for p in pizzas if p.is_vegetarian]
             elif category == 'spicy':
-                queryset = queryset.filter(is_spicy=True)
+                pizzas = [p for p in pizzas if p.is_spicy]
             elif category == 'cheese':
-                from .models import Category
-                try:
-                    cheese_category = Category.objects.filter(name__icontains='сыр').first()
-                    if cheese_category:
-                        queryset = queryset.filter(category=cheese_category)
-                    else:
-                        queryset = queryset.filter(
-                            Q(name__icontains='сыр') | 
-                            Q(description__icontains='сыр')
-                        )
-                except:
-                    queryset = queryset.filter(name__icontains='сыр')
+                cheese_category = catalog.get_category('сыр')
+                if cheese_category:
+                    pizzas = [p for p in pizzas if p.category_id == cheese_category.id]
+                else:
+                    pizzas = [
+                        p for p in pizzas
+                        if 'сыр' in p.name.lower() or 'сыр' in p.description.lower()
+                    ]
             elif category == 'special':
-                queryset = queryset.filter(Q(is_popular=True) | Q(is_new=True))
+                pizzas = [p for p in pizzas if p.is_popular or p.is_new]
         
         # Сортировка
         if sort == 'price-asc':
-            queryset = queryset.order_by('price_30')
+            pizzas.sort(key=lambda p: p.price_30)
         elif sort == 'price-desc':
-            queryset = queryset.order_by('-price_30')
+            pizzas.sort(key=lambda p: p.price_30, reverse=True)
         elif sort == 'name':
-            queryset = queryset.order_by('name')
+            pizzas.sort(key=lambda p: p.name)
         else:  
-            queryset = queryset.order_by('-is_popular', 'order')
+            pizzas.sort(key=lambda p: (not p.is_popular, p.order))
         
-        return queryset
+        return pizzas
+
+def menu_search_view(request):
+    """Поиск пицц по названию, описанию и составу (HTML или JSON)"""
+    query = request.GET.get('q', '').strip()
+    results = search_pizzas(query) if query else []
+    
+    if request.GET.get('format') == 'json' or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'query': query,
+            'results': [
+                {
+                    'id': pizza.id,
+                    'name': pizza.name,
+                    'slug': pizza.slug,
+                    'price_30': float(pizza.price_30),
+                    'image_url': pizza.image_url,
+                    'score': score,
+                }
+                for pizza, score in results
+            ],
+        })
+    
+    return render(request, 'pizzeria/menu.html', {
+        'pizzas': [pizza for pizza, score in results],
+        'search_query': query,
+    })
 
 class FeedbackView(CreateView):
     model = Feedback
@@ -173,13 +223,28 @@ class FeedbackView(CreateView):
         return super().form_valid(form)
 
 # Корзина и заказы
+def cart_totals(summary):
+    """Итоги корзины для AJAX-ответов: суммы, скидки и доставку считает сервер"""
+    if summary is None:
+        return {'cart_quantity': 0, 'cart_total': 0, 'cart_subtotal': 0, 'discount': 0,
+                'delivery_fee': 0, 'grand_total': 0}
+    return {
+        'cart_quantity': summary.total_quantity,
+        'cart_total': float(summary.total_price),
+        'cart_subtotal': float(summary.subtotal),
+        'discount': float(summary.discount_total),
+        'delivery_fee': float(summary.delivery_fee),
+        'grand_total': float(summary.grand_total),
+    }
+
 def cart_view(request):
-    cart = get_cart(request)
-    cart_items = cart.items.all() if cart else []
+    cart = peek_cart(request)
+    summary = cart.summary() if cart else None
     
     return render(request, 'pizzeria/cart.html', {
         'cart': cart,
-        'cart_items': cart_items,
+        'cart_items': summary.lines if summary else [],
+        'summary': summary,
     })
 
 def add_to_cart_view(request):
@@ -197,12 +262,12 @@ def add_to_cart_view(request):
             success, message = False, "Неизвестный тип товара"
         
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            cart = get_cart(request)
+            cart = peek_cart(request)
+            summary = cart.summary() if cart else None
             return JsonResponse({
                 'success': success,
                 'message': message,
-                'cart_quantity': cart.total_quantity() if cart else 0,
-                'cart_total': float(cart.total_price()) if cart else 0,
+                **cart_totals(summary),
             })
         else:
             if success:
@@ -221,20 +286,15 @@ def update_cart_view(request):
         success, message = update_cart_item(request, item_id, quantity)
         
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            cart = get_cart(request)
-            item = None
-            if success:
-                try:
-                    item = CartItem.objects.get(id=item_id)
-                except CartItem.DoesNotExist:
-                    pass
+            cart = peek_cart(request)
+            summary = cart.summary() if cart else None
+            item = summary.get_line(item_id) if summary and success else None
             
             return JsonResponse({
                 'success': success,
                 'message': message,
-                'cart_quantity': cart.total_quantity() if cart else 0,
-                'cart_total': float(cart.total_price()) if cart else 0,
-                'item_total': float(item.total_price()) if item else 0,
+                **cart_totals(summary),
+                'item_total': float(item.total) if item else 0,
             })
         else:
             if success:
@@ -249,12 +309,97 @@ def remove_from_cart_view(request, item_id):
     success, message = remove_from_cart(request, item_id)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        cart = get_cart(request)
+        cart = peek_cart(request)
+        summary = cart.summary() if cart else None
+        return JsonResponse({
+            'success': success,
+            'message': message,
+            **cart_totals(summary),
+        })
+    else:
+        if success:
+            messages.success(request, message)
+        else:
+            messages.error(request, message)
+        return redirect('cart')
+
+# Асинхронные варианты представлений корзины для ASGI (см. ASYNC_VIEWS в settings)
+async def cart_view_async(request):
+    cart = await apeek_cart(request)
+    summary = await cart.asummary()
+    
+    # Шаблоны и контекстные процессоры синхронные
+    return await sync_to_async(render)(request, 'pizzeria/cart.html', {
+        'cart': cart,
+        'cart_items': summary.lines,
+        'summary': summary,
+    })
+
+async def add_to_cart_view_async(request):
+    if request.method == 'POST':
+        item_type = request.POST.get('item_type')
+        item_id = request.POST.get('item_id')
+        quantity = int(request.POST.get('quantity', 1))
+        
+        if item_type == 'pizza':
+            size = request.POST.get('size', '30')
+            success, message = await aadd_to_cart(request, 'pizza', item_id, size, quantity)
+        elif item_type == 'combo':
+            success, message = await aadd_to_cart(request, 'combo', item_id, quantity=quantity)
+        else:
+            success, message = False, "Неизвестный тип товара"
+        
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            summary = await (await apeek_cart(request)).asummary()
+            return JsonResponse({
+                'success': success,
+                'message': message,
+                **cart_totals(summary),
+            })
+        else:
+            if success:
+                messages.success(request, message)
+            else:
+                messages.error(request, message)
+            return redirect(request.META.get('HTTP_REFERER', 'home'))
+    
+    return redirect('home')
+
+async def update_cart_view_async(request):
+    if request.method == 'POST':
+        item_id = request.POST.get('item_id')
+        quantity = int(request.POST.get('quantity', 1))
+        
+        success, message = await aupdate_cart_item(request, item_id, quantity)
+        
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            summary = await (await apeek_cart(request)).asummary()
+            item = summary.get_line(item_id) if success else None
+            
+            return JsonResponse({
+                'success': success,
+                'message': message,
+                **cart_totals(summary),
+                'item_total': float(item.total) if item else 0,
+            })
+        else:
+            if success:
+                messages.success(request, message)
+            else:
+                messages.error(request, message)
+            return redirect('cart')
+    
+    return redirect('cart')
+
+async def remove_from_cart_view_async(request, item_id):
+    success, message = await aremove_from_cart(request, item_id)
+    
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        summary = await (await apeek_cart(request)).asummary()
         return JsonResponse({
             'success': success,
             'message': message,
-            'cart_quantity': cart.total_quantity() if cart else 0,
-            'cart_total': float(cart.total_price()) if cart else 0,
+            **cart_totals(summary),
         })
     else:
         if success:
@@ -263,6 +408,24 @@ def remove_from_cart_view(request, item_id):
             messages.error(request, message)
         return redirect('cart')
 
+def batch_cart_view(request):
+    """Пакет изменений корзины: JSON {"operations": [{"op": "add" | "update" | "remove", ...}]}"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Ожидается POST'}, status=405)
+    try:
+        operations = json.loads(request.body).get('operations')
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'message': 'Некорректный JSON'}, status=400)
+    
+    success, message = apply_cart_batch(request, operations)
+    summary = peek_cart(request).summary()
+    return JsonResponse({
+        'success': success,
+        'message': message,
+        **cart_totals(summary),
+        'items': {str(line.item.id): float(line.total) for line in summary.quote.lines},
+    }, status=200 if success else 400)
+
 def clear_cart_view(request):
     success, message = clear_cart(request)
     
@@ -280,37 +443,24 @@ class OrderCreateView(CreateView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        cart = get_cart(self.request)
+        cart = peek_cart(self.request)
+        summary = cart.summary() if cart else None
         context['cart'] = cart
-        context['cart_items'] = cart.items.all() if cart else []
+        context['cart_items'] = summary.lines if summary else []
+        context['summary'] = summary
         return context
     
     def form_valid(self, form):
-        cart = get_cart(self.request)
+        cart = checkout_cart(self.request)
+        order = form.save(commit=False)
+        if self.request.user.is_authenticated:
+            order.user = self.request.user
+        order = place_order(cart, order)
         
-        if not cart or cart.items.count() == 0:
+        if order is None:
             messages.error(self.request, 'Ваша корзина пуста!')
             return redirect('cart')
-        
-        order = form.save(commit=False)
-        order.cart = cart
-        order.total_price = cart.total_price()
-        order.save()
-        
-
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                item_type=cart_item.item_type,
-                item_name=cart_item.get_name(),
-                size=cart_item.size if cart_item.item_type == 'pizza' else '',
-                quantity=cart_item.quantity,
-                unit_price=cart_item.unit_price(),
-                total_price=cart_item.total_price()
-            )
-        
-
-        cart.items.all().delete()
+        forget_stored_cart(self.request)
 
         self.request.session['last_order_id'] = order.id
         
@@ -335,15 +485,19 @@ def order_success(request):
     })
 
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-        
-    cart = get_cart(request)
-    if order.cart != cart:
-        messages.error(request, 'У вас нет доступа к этому заказу.')
-        return redirect('home')
+    order = get_object_or_404(Order.objects.prefetch_related('items'), id=order_id)
+    
+    is_owner = order.user_id is not None and order.user_id == request.user.id
+    if not is_owner:
+        # Анонимный заказ принадлежит сессии корзины, из которой он оформлен
+        session_key = request.session.session_key
+        if not session_key or not Cart.objects.filter(pk=order.cart_id, session_key=session_key).exists():
+            messages.error(request, 'У вас нет доступа к этому заказу.')
+            return redirect('home')
         
     return render(request, 'pizzeria/order_detail.html', {
         'order': order,
+        'orders': [order],
     })
 
 from django.contrib.admin.views.decorators import staff_member_required
@@ -353,35 +507,37 @@ from django.db.models import Count, Sum
 from django.http import JsonResponse
 from django.contrib.auth.models import User
 
-@staff_member_required
-def admin_dashboard(request):
-    """Кастомная админ-панель"""
-    
-    today = datetime.now().date()
-    today_start = datetime.combine(today, time.min)
-    today_end = datetime.combine(today, time.max)
+STATS_RANGES = {
+    'today': 0,
+    'week': 7,
+    'month': 30,
+    'quarter': 90,
+}
 
-    if timezone.is_aware(timezone.now()):
-        today_start = timezone.make_aware(today_start)
-        today_end = timezone.make_aware(today_end)
+def _today_start():
+    return timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
 
-    try:
-        orders_today = Order.objects.filter(created_at__date=today)
-    except:
-        from django.db.models import Q
-        orders_today = Order.objects.filter(
-            Q(created_at__gte=today_start) & 
-            Q(created_at__lte=today_end)
-        )
+def _range_totals(days, today_start):
+    """Заказы и выручка за каждый период из STATS_RANGES по дневным сводкам"""
+    by_day = rollups.sales_by_day(today_start - timedelta(days=max(days.values())))
+    totals = {}
+    for name, back in days.items():
+        since = today_start - timedelta(days=back)
+        rows = [value for day, value in by_day.items() if day >= since]
+        totals[name] = (sum(orders for orders, revenue in rows), sum(revenue for orders, revenue in rows))
+    return totals
 
-    orders_today = Order.objects.filter(created_at__range=[today_start, today_end])
-    orders_week = Order.objects.filter(created_at__gte=today - timedelta(days=7))
+@staff_member_required
+def admin_dashboard(request):
+    """Кастомная админ-панель"""
     
-    revenue_today = orders_today.aggregate(Sum('total_price'))['total_price__sum'] or 0
-    revenue_week = orders_week.aggregate(Sum('total_price'))['total_price__sum'] or 0
+    today_start = _today_start()
+    totals = _range_totals(STATS_RANGES, today_start)
     
     total_users = User.objects.count()
-    new_users_today = User.objects.filter(date_joined__date=today).count()
+    new_users_today = User.objects.filter(
+        date_joined__range=[today_start, today_start + timedelta(days=1)]
+    ).count()
     
     total_pizzas = Pizza.objects.count()
     popular_pizzas = Pizza.objects.filter(is_popular=True).count()
@@ -391,39 +547,143 @@ def admin_dashboard(request):
     context = {
         'today': timezone.now(),
         'stats': {
-            'orders_today': orders_today.count(),
-            'orders_week': orders_week.count(),
-            'revenue_today': revenue_today,
-            'revenue_week': revenue_week,
+            'orders_today': totals['today'][0],
+            'orders_week': totals['week'][0],
+            'revenue_today': totals['today'][1],
+            'revenue_week': totals['week'][1],
             'total_users': total_users,
             'new_users_today': new_users_today,
             'total_pizzas': total_pizzas,
             'popular_pizzas': popular_pizzas,
         },
+        'periods': [
+            ('Сегодня', *totals['today']),
+            ('7 дней', *totals['week']),
+            ('30 дней', *totals['month']),
+            ('90 дней', *totals['quarter']),
+        ],
+        'top_items': rollups.top_items(today_start.date() - timedelta(days=STATS_RANGES['month'])),
         'recent_orders': recent_orders,
+        # Поток SSE есть только под ASGI, иначе страница сразу опрашивает статистику
+        'live_stream': settings.ASYNC_VIEWS,
     }
     
     return render(request, 'pizzeria/admin_dashboard.html', context)
 
-@staff_member_required
-def admin_stats_api(request):
-    
-    today = timezone.now().date()
-    today_start = timezone.make_aware(timezone.datetime.combine(today, timezone.datetime.min.time()))
-    today_end = timezone.make_aware(timezone.datetime.combine(today, timezone.datetime.max.time()))
-    
-    orders_today = Order.objects.filter(created_at__range=[today_start, today_end])
-    revenue_today = orders_today.aggregate(Sum('total_price'))['total_price__sum'] or 0
+def _stats_payload(period='today'):
+    """Данные для обновления статистики админ-панели"""
+    today_start = _today_start()
+    since = today_start - timedelta(days=STATS_RANGES[period])
+    totals = _range_totals({'today': 0, period: STATS_RANGES[period]}, today_start)
     
     total_users = User.objects.count()
     total_pizzas = Pizza.objects.count()
     
+    status_names = dict(Order.STATUS_CHOICES)
+    payment_names = dict(Order.PAYMENT_CHOICES)
+    
     data = {
-        'orders_today': orders_today.count(),
-        'revenue_today': float(revenue_today),
+        'orders_today': totals['today'][0],
+        'revenue_today': float(totals['today'][1]),
+        'range': period,
+        'orders': totals[period][0],
+        'revenue': float(totals[period][1]),
+        'by_status': {
+            status: {'label': status_names.get(status, status), 'orders': orders, 'revenue': float(revenue)}
+            for status, (orders, revenue) in rollups.sales_breakdown(since, 'status').items()
+        },
+        'by_payment': {
+            method: {'label': payment_names.get(method, method), 'orders': orders, 'revenue': float(revenue)}
+            for method, (orders, revenue) in rollups.sales_breakdown(since, 'payment_method').items()
+        },
+        'hourly': [
+            {'hour': hour.isoformat(), 'orders': orders, 'revenue': float(revenue)}
+            for hour, orders, revenue in rollups.hourly_sales(today_start)
+        ],
         'total_users': total_users,
         'total_pizzas': total_pizzas,
         'updated': timezone.now().isoformat(),
     }
     
-    return JsonResponse(data)
\ No newline at end of file
+    return data
+
+@staff_member_required
+def admin_stats_api(request):
+    period = request.GET.get('range', 'today')
+    if period not in STATS_RANGES:
+        period = 'today'
+    return JsonResponse(_stats_payload(period))
+
+stats_broadcaster = live.Broadcaster(collect=_stats_payload)
+
+@staff_member_required
+async def admin_stats_stream(request):
+    """Живая статистика через Server-Sent Events (при запуске под ASGI)"""
+    return live.stream_response(stats_broadcaster)
+
+@staff_member_required
+def admin_orders_export(request):
+    """Потоковая выгрузка заказов: ?format=csv|jsonl&date_from=&date_to=&status=&payment_method="""
+    form = OrderExportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    queryset = form.filter(Order.objects.all())
+    return exports.export_response(queryset, form.cleaned_data['format'] or 'csv')
+
+@staff_member_required
+def admin_kitchen(request):
+    """Экран кухни: заказы по обещанному времени и загрузки печи"""
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if action == 'take':
+            ticket = kitchen.board.take_next()
+            if ticket is None:
+                messages.info(request, 'Ждущих заказов нет')
+            else:
+                messages.success(request, f'Заказ #{ticket.order_id} взят в работу')
+        elif action == 'ready' and request.POST.get('order_id', '').isdigit():
+            order_id = int(request.POST['order_id'])
+            if kitchen.board.mark_ready(order_id):
+                messages.success(request, f'Заказ #{order_id} передан в доставку')
+            else:
+                messages.error(request, f'Заказ #{order_id} не готовится')
+        return redirect('admin_kitchen')
+    
+    return render(request, 'pizzeria/admin_kitchen.html', {
+        'oven_capacity': settings.KITCHEN_OVEN_CAPACITY,
+        'live_stream': settings.ASYNC_VIEWS,
+    })
+
+@staff_member_required
+def admin_kitchen_state(request):
+    """Изменения экрана кухни после ?cursor= (без курсора - полное состояние)"""
+    return JsonResponse(kitchen.board.changes_since(request.GET.get('cursor')))
+
+kitchen_broadcaster = live.Broadcaster(collect=kitchen.board.collect, version=kitchen.board.version)
+
+@staff_member_required
+async def admin_kitchen_stream(request):
+    """Изменения экрана кухни через Server-Sent Events (при запуске под ASGI)"""
+    return live.stream_response(kitchen_broadcaster, event='kitchen')
+
+@staff_member_required
+def admin_perf(request):
+    """Скользящие p50/p95/p99 времени ответа по маршрутам"""
+    if request.method == 'POST':
+        timing_registry.reset()
+        return redirect('admin_perf')
+    
+    rows = timing_registry.snapshot()
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'bounds_ms': list(HISTOGRAM_BOUNDS), 'routes': rows})
+    
+    labels = [f'≤{bound}' for bound in HISTOGRAM_BOUNDS] + [f'>{HISTOGRAM_BOUNDS[-1]}']
+    for row in rows:
+        peak = max(row['histogram']) or 1
+        row['bars'] = [
+            (label, count, round(count * 100 / peak))
+            for label, count in zip(labels, row['histogram'])
+        ]
+    return render(request, 'pizzeria/admin_perf.html', {
+        'rows': rows,
+    })